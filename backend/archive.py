@@ -0,0 +1,163 @@
+"""Archival of finished tasks.
+
+Completed and cancelled tasks left untouched for ARCHIVE_AFTER_DAYS move
+from `tasks` to `tasks_archive`, so listings, indexes and counters only
+cover the tasks people still work with. Archiving runs as an
+"archive_tasks" background job (see jobs.py) in batches; ArchiveScheduler
+enqueues one every ARCHIVE_INTERVAL_SECONDS, and POST /api/archive/run
+starts one on demand.
+
+Archived tasks stay readable through `include_archived=true` on
+GET /api/tasks and GET /api/tasks/{task_id}, and POST
+/api/tasks/{task_id}/restore moves one back. /api/stats adds a summary of
+the archive, kept in its own counters document, to the live counters.
+Lists' and tags' task_count only cover live tasks.
+
+The scheduled job archives every tenant's tasks and moves each batch one
+tenant at a time; POST /api/archive/run only archives the caller's.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from counts import list_count_delta, tag_count_delta, write_task
+from events import event_bus
+from models import TaskStatus
+from repository import (
+    task_repository, archive_repository, list_repository, tag_repository, stats_repository,
+)
+from serializers import to_response
+from stats import (
+    ARCHIVE_STATS_ID, contribution_delta, get_counters, record_task_change, record_task_changes,
+)
+from tenancy import TENANT_FIELD, tenant_scope
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+# 0 leaves archiving to POST /api/archive/run
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+
+FINISHED_STATUSES = [TaskStatus.COMPLETED.value, TaskStatus.CANCELLED.value]
+
+def archivable_query(cutoff: datetime) -> dict:
+    """Finished tasks last changed before `cutoff`"""
+    # updated_at is never older than completed_at, and any edit or restore
+    # keeps a task out of the archive for another full period
+    return {"status": {"$in": FINISHED_STATUSES}, "updated_at": {"$lt": cutoff}}
+
+def archive_cutoff(older_than_days: float = ARCHIVE_AFTER_DAYS) -> datetime:
+    return datetime.utcnow() - timedelta(days=older_than_days)
+
+def _sum_deltas(deltas: List[Dict[str, int]]) -> Dict[str, int]:
+    total: Dict[str, int] = {}
+    for delta in deltas:
+        for key, value in delta.items():
+            total[key] = total.get(key, 0) + value
+    return {key: value for key, value in total.items() if value}
+
+async def archive_batch(job: dict, batch_size: int) -> int:
+    """Job handler moving one batch of archivable tasks; returns how many it examined"""
+    query = archivable_query(datetime.fromisoformat(job["target_id"]))
+    tasks = await task_repository.find_documents(query, limit=batch_size)
+    by_tenant: Dict[str, List[dict]] = {}
+    for task in tasks:
+        by_tenant.setdefault(task[TENANT_FIELD], []).append(task)
+    for tenant_id, tenant_tasks in by_tenant.items():
+        with tenant_scope(tenant_id):
+            await _archive_tasks(tenant_tasks, query)
+    return len(tasks)
+
+async def _archive_tasks(tasks: List[dict], query: dict):
+    """Move a tenant's archivable tasks to the archive"""
+    # Built before the archive grows, so the increments below are not counted twice
+    await get_counters(ARCHIVE_STATS_ID)
+    now = datetime.utcnow()
+    await archive_repository.upsert_many([{**task, "archived_at": now} for task in tasks])
+    # Tasks edited since they were read no longer match and stay live, and
+    # tasks deleted meanwhile are gone; either way their copies are dropped again
+    task_ids = [task["id"] for task in tasks]
+    archived_ids = set(await task_repository.delete_matching(task_ids, query, archived=True))
+    await archive_repository.delete_ids([task_id for task_id in task_ids if task_id not in archived_ids])
+    archived = [task for task in tasks if task["id"] in archived_ids]
+
+    # The tasks leave the live counters for the archive summary, so the
+    # combined /api/stats figures do not change
+    await record_task_changes([(task, None) for task in archived])
+    await stats_repository.increment(ARCHIVE_STATS_ID, _sum_deltas(
+        [contribution_delta(None, task) for task in archived]
+    ))
+    list_deltas = _sum_deltas([list_count_delta(task, None) for task in archived])
+    tag_deltas = _sum_deltas([tag_count_delta(task, None) for task in archived])
+    await list_repository.increment_task_counts(list_deltas)
+    await tag_repository.increment_task_counts(tag_deltas)
+    if archived:
+        event_bus.publish("tasks.batch", {"updated": [], "deleted": [task["id"] for task in archived]},
+                          lists=list_deltas, tags=tag_deltas)
+
+async def restore_task(task_id: str) -> Optional[dict]:
+    """Move an archived task back to the live tasks, or None if it is not archived"""
+    task = await archive_repository.remove(task_id)
+    if task is None:
+        return None
+    task.pop("archived_at", None)
+    task["updated_at"] = datetime.utcnow()
+    # Its list or tags may have been deleted while it was archived
+    if task.get("list_id") and not await list_repository.get(task["list_id"]):
+        task["list_id"] = None
+    if task.get("tags"):
+        live_tags = {tag["id"] for tag in await tag_repository.find_all()}
+        task["tags"] = [tag_id for tag_id in task["tags"] if tag_id in live_tags]
+
+    async def insert(session):
+        inserted = await task_repository.insert(task, session=session)
+        return None, task if inserted else None
+
+    try:
+        _, restored, list_delta, tag_delta = await write_task(insert)
+    except DuplicateKeyError:
+        # Already live again; the archived copy was stale
+        return await task_repository.get(task_id)
+    await stats_repository.increment(ARCHIVE_STATS_ID, contribution_delta(task, None))
+    await record_task_change(None, restored)
+    restored = to_response(restored)
+    event_bus.publish("task.created", restored, lists=list_delta, tags=tag_delta)
+    return restored
+
+class ArchiveScheduler:
+    """Periodically enqueues an archive job"""
+
+    def __init__(self, interval: float = ARCHIVE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self, job_queue):
+        if self.interval > 0:
+            self._worker = asyncio.create_task(self._run(job_queue))
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self, job_queue):
+        while True:
+            await asyncio.sleep(self.interval)
+            # Every worker process computes the same job id for a period,
+            # so only one of them enqueues it
+            period = int(datetime.utcnow().timestamp() // self.interval)
+            try:
+                await job_queue.enqueue("archive_tasks", archive_cutoff().isoformat(),
+                                        job_id=f"archive-{period}")
+            except Exception:
+                logger.exception("Scheduling task archival failed")
+
+archive_scheduler = ArchiveScheduler()
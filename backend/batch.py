@@ -0,0 +1,159 @@
+"""Execute many task mutations as a single bulk write.
+
+Each operation is validated against the current state of its task, turned
+into an UpdateOne/DeleteOne and sent in one `bulk_write`. The side effects
+the single-task routes perform (completed_at/updated_at, list and tag
+task_count, stats counters, search fields, the next instance of completed
+recurring tasks) are applied once for the whole batch.
+"""
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from models import BatchAction, TaskBatchOperation, TaskBatchRequest
+from counts import list_count_delta, tag_count_delta
+from recurrence import prepare_recurrence, roll_completed
+from repository import task_repository, list_repository, tag_repository
+from search import search_document_fields
+from serializers import to_response
+from stats import record_task_changes
+from subtasks import delete_task_subtasks
+
+SKIPPED = "اجرا نشد؛ عملیات قبلی ناموفق بود"
+CONFLICT = "تسک پس از آخرین دریافت تغییر کرده است"
+NOT_FOUND = "تسک پیدا نشد"
+
+class ConflictError(ValueError):
+    """The task changed since the client read it"""
+
+    def __init__(self, task: dict):
+        super().__init__(CONFLICT)
+        self.task = task
+
+def _same_instant(stored: Optional[datetime], seen: datetime) -> bool:
+    # Stored datetimes are naive UTC with millisecond precision
+    if stored is None:
+        return False
+    if seen.tzinfo is not None:
+        seen = seen.astimezone(timezone.utc).replace(tzinfo=None)
+    return abs((stored - seen).total_seconds()) < 0.001
+
+def _plan(operation: TaskBatchOperation, task: dict):
+    """Return the update document for one operation (None to delete the
+    task) and the task as it will look afterwards"""
+    if operation.if_updated_at and not _same_instant(task.get("updated_at"), operation.if_updated_at):
+        raise ConflictError(task)
+    if operation.action == BatchAction.DELETE:
+        return None, None
+
+    if operation.action == BatchAction.UPDATE:
+        if operation.update is None:
+            raise ValueError("برای ویرایش، فیلد update الزامی است")
+        update_data = operation.update.to_update_data()
+        prepare_recurrence(update_data, task.get("due_date"))
+        after = {**task, **update_data}
+        if "title" in update_data or "description" in update_data:
+            update_data.update(search_document_fields(after.get("title"), after.get("description")))
+        return {"$set": update_data}, after
+
+    now = datetime.utcnow()
+    if operation.action == BatchAction.ADD_TAGS:
+        tags = list(dict.fromkeys([*task.get("tags", []), *operation.tags]))
+        update = {"$addToSet": {"tags": {"$each": operation.tags}}, "$set": {"updated_at": now}}
+    else:
+        tags = [tag for tag in task.get("tags", []) if tag not in operation.tags]
+        update = {"$pull": {"tags": {"$in": operation.tags}}, "$set": {"updated_at": now}}
+    return update, {**task, "tags": tags, "updated_at": now}
+
+async def execute_batch(batch: TaskBatchRequest, publish: Optional[Callable] = None) -> dict:
+    """Run a batch of task operations and report the outcome of each one.
+
+    `publish` receives a single "tasks.batch" change event for the batch.
+    """
+    tasks = {
+        task["id"]: task
+        for task in await task_repository.find_by_ids(list({op.task_id for op in batch.operations}))
+    }
+    results: List[dict] = []
+    writes = []
+    planned = []  # (result index, before, after) for every write sent
+    stopped = False
+
+    for index, operation in enumerate(batch.operations):
+        result = {"index": index, "task_id": operation.task_id, "action": operation.action}
+        results.append(result)
+        if stopped:
+            result.update(ok=False, error=SKIPPED)
+            continue
+        task = tasks.get(operation.task_id)
+        try:
+            if task is None:
+                raise ValueError(NOT_FOUND)
+            update, after = _plan(operation, task)
+        except ConflictError as e:
+            result.update(ok=False, error=str(e), conflict=True, task=to_response(dict(e.task)))
+            stopped = batch.ordered
+            continue
+        except ValueError as e:
+            result.update(ok=False, error=str(e))
+            stopped = batch.ordered
+            continue
+        result["ok"] = True
+        task_filter = {"id": operation.task_id}
+        if operation.if_updated_at:
+            # Also checked by the write itself, against changes made meanwhile
+            task_filter["updated_at"] = task.get("updated_at")
+        writes.append((task_filter, update))
+        planned.append((index, task, after))
+        # Later operations on the same task see this one's result
+        if after is None:
+            tasks.pop(operation.task_id)
+        else:
+            tasks[operation.task_id] = after
+
+    failed_writes: Dict[int, str] = {}
+    unmatched: List[int] = []
+    if writes:
+        failed_writes, unmatched = await task_repository.apply_writes(writes, ordered=batch.ordered)
+    guarded = {task_filter["id"] for task_filter, _ in writes if "updated_at" in task_filter}
+
+    changes = []
+    list_deltas: Dict[str, int] = {}
+    tag_deltas: Dict[str, int] = {}
+    for position, (index, before, after) in enumerate(planned):
+        if position in failed_writes:
+            results[index].update(ok=False, error=failed_writes[position] or SKIPPED)
+            continue
+        if position in unmatched:
+            # Changed or deleted by another request after it was read
+            conflict = results[index]["task_id"] in guarded
+            results[index].update(ok=False, error=CONFLICT if conflict else NOT_FOUND, conflict=conflict)
+            continue
+        changes.append((before, after))
+        for list_id, delta in list_count_delta(before, after).items():
+            list_deltas[list_id] = list_deltas.get(list_id, 0) + delta
+        for tag_id, delta in tag_count_delta(before, after).items():
+            tag_deltas[tag_id] = tag_deltas.get(tag_id, 0) + delta
+
+    await delete_task_subtasks([before["id"] for before, after in changes if after is None])
+    await list_repository.increment_task_counts(list_deltas)
+    await tag_repository.increment_task_counts(tag_deltas)
+    stats_delta = await record_task_changes(changes)
+    # Completed recurring tasks are followed by their next instance
+    await roll_completed(changes)
+
+    if publish and changes:
+        final = {}
+        for before, after in changes:
+            final[before["id"]] = after
+        publish("tasks.batch", {
+            "updated": [to_response(dict(task)) for task in final.values() if task is not None],
+            "deleted": [task_id for task_id, task in final.items() if task is None],
+        }, stats=stats_delta, lists=list_deltas, tags=tag_deltas)
+
+    succeeded = sum(1 for result in results if result["ok"])
+    return {
+        "ordered": batch.ordered,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+    }
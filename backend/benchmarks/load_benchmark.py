@@ -0,0 +1,309 @@
+"""Replay a realistic mix of API requests against the in-process app.
+
+Seeds lists, tags and tasks with subtasks, then drives the same endpoints
+backend_test.py exercises (filtered and searched task listings, stats,
+task creation, updates, status flips and subtask operations) from a fixed
+number of concurrent clients through httpx's ASGI transport:
+
+    python benchmarks/load_benchmark.py --tasks 20000 --requests 5000 --concurrency 32
+
+Per scenario it reports p50/p95/p99 latency and the Mongo operations each
+request issued, plus overall requests per second. By default the
+mongomock stand-in is used so no server or database is needed; pass
+--mongo-url to run against a real MongoDB, or sqlite:///path/to/bench.db
+to compare the embedded SQLite backend (the scratch database is dropped
+afterwards unless --keep is given). --max-p95-ms makes the run exit
+non-zero when any scenario is slower, for use as a pre-deploy check.
+
+--tenants N seeds the same data for N tenants while requests are only
+made as the default tenant, showing whether a tenant's latency stays flat
+as other tenants' data grows.
+"""
+import argparse
+import asyncio
+import contextvars
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = [
+    "خرید", "کتاب", "جلسه", "پروژه", "گزارش", "تماس", "ایمیل", "بررسی", "طراحی",
+    "پرداخت", "قبض", "ورزش", "باشگاه", "مطالعه", "دانشگاه", "سفر", "بلیط", "هتل",
+]
+PRIORITIES = ["کم", "متوسط", "بالا"]
+STATUSES = ["در انتظار", "تکمیل شده", "لغو شده"]
+
+# Scenario name -> relative weight in the request mix
+MIX = {
+    "list_tasks": 25,
+    "filter_tasks": 15,
+    "search_tasks": 10,
+    "get_stats": 15,
+    "get_lists": 5,
+    "create_task": 8,
+    "update_task": 8,
+    "toggle_status": 6,
+    "add_subtask": 4,
+    "toggle_subtask": 4,
+}
+
+# Mongo collection methods counted as one operation each
+COUNTED_METHODS = {
+    "find", "find_one", "find_one_and_update", "find_one_and_delete", "aggregate",
+    "count_documents", "insert_one", "insert_many", "update_one", "update_many",
+    "delete_one", "delete_many", "replace_one", "bulk_write",
+}
+
+_request_ops = contextvars.ContextVar("request_ops", default=None)
+
+class CountingCollection:
+    """Collection proxy counting operations against the current request"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in COUNTED_METHODS:
+            return attribute
+
+        def counted(*args, **kwargs):
+            ops = _request_ops.get()
+            if ops is not None:
+                ops[0] += 1
+            return attribute(*args, **kwargs)
+        return counted
+
+def random_text(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+async def seed(args, rng, tenant_id):
+    from repository import task_repository, list_repository, tag_repository
+    from search import search_document_fields
+    from stats import rebuild_counters
+    from tenancy import TENANT_FIELD
+
+    now = datetime.utcnow()
+    lists = [{"id": str(uuid.uuid4()), "name": f"لیست {i}", "color": "#3B82F6",
+              "created_at": now, "task_count": 0, TENANT_FIELD: tenant_id} for i in range(args.lists)]
+    tags = [{"id": str(uuid.uuid4()), "name": f"برچسب {i}", "color": "#10B981",
+             "created_at": now, TENANT_FIELD: tenant_id} for i in range(args.tags)]
+    await list_repository.collection.insert_many(lists)
+    await tag_repository.collection.insert_many(tags)
+
+    task_ids = []
+    for offset in range(0, args.tasks, 1000):
+        batch = []
+        for i in range(offset, min(offset + 1000, args.tasks)):
+            title = random_text(rng, 4)
+            description = random_text(rng, 10)
+            status = rng.choice(STATUSES)
+            created_at = now - timedelta(minutes=i)
+            subtasks = [
+                {"id": str(uuid.uuid4()), "title": random_text(rng, 2),
+                 "completed": rng.random() < 0.5, "created_at": created_at}
+                for _ in range(rng.randint(0, args.subtasks))
+            ]
+            batch.append({
+                "id": str(uuid.uuid4()),
+                "title": title,
+                "description": description,
+                "priority": rng.choice(PRIORITIES),
+                "status": status,
+                "due_date": (date.today() + timedelta(days=rng.randint(-5, 30))).isoformat(),
+                "list_id": rng.choice(lists)["id"] if lists else None,
+                "tags": [tag["id"] for tag in rng.sample(tags, min(2, len(tags)))],
+                "subtasks": subtasks,
+                "subtask_total": len(subtasks),
+                "subtask_done": sum(1 for subtask in subtasks if subtask["completed"]),
+                "created_at": created_at,
+                "updated_at": created_at,
+                "completed_at": created_at if status == "تکمیل شده" else None,
+                TENANT_FIELD: tenant_id,
+                **search_document_fields(title, description),
+            })
+        await task_repository.collection.insert_many(batch)
+        task_ids.extend(task["id"] for task in batch)
+
+    await list_repository.set_task_counts(
+        await task_repository.count_by_list([lst["id"] for lst in lists]))
+    await rebuild_counters()
+    return [lst["id"] for lst in lists], task_ids
+
+class Workload:
+    def __init__(self, client, rng, list_ids, task_ids):
+        self.client = client
+        self.rng = rng
+        self.list_ids = list_ids
+        self.task_ids = task_ids
+        self.subtasks = {}  # task id -> subtask ids added during the run
+
+    async def list_tasks(self):
+        return await self.client.get("/api/tasks", params={"limit": 50})
+
+    async def filter_tasks(self):
+        params = {"limit": 50, "status": self.rng.choice(STATUSES)}
+        if self.list_ids and self.rng.random() < 0.5:
+            params["list_id"] = self.rng.choice(self.list_ids)
+        else:
+            params["priority"] = self.rng.choice(PRIORITIES)
+        return await self.client.get("/api/tasks", params=params)
+
+    async def search_tasks(self):
+        return await self.client.get("/api/tasks", params={
+            "limit": 20, "search": random_text(self.rng, self.rng.randint(1, 2))})
+
+    async def get_stats(self):
+        return await self.client.get("/api/stats")
+
+    async def get_lists(self):
+        return await self.client.get("/api/lists")
+
+    async def create_task(self):
+        response = await self.client.post("/api/tasks", json={
+            "title": random_text(self.rng, 4),
+            "description": random_text(self.rng, 10),
+            "priority": self.rng.choice(PRIORITIES),
+            "list_id": self.rng.choice(self.list_ids) if self.list_ids else None,
+        })
+        if response.status_code == 200:
+            self.task_ids.append(response.json()["id"])
+        return response
+
+    async def update_task(self):
+        return await self.client.put(f"/api/tasks/{self.rng.choice(self.task_ids)}", json={
+            "title": random_text(self.rng, 4), "priority": self.rng.choice(PRIORITIES)})
+
+    async def toggle_status(self):
+        return await self.client.put(f"/api/tasks/{self.rng.choice(self.task_ids)}", json={
+            "status": self.rng.choice(STATUSES[:2])})
+
+    async def add_subtask(self):
+        task_id = self.rng.choice(self.task_ids)
+        response = await self.client.post(f"/api/tasks/{task_id}/subtasks",
+                                          json={"title": random_text(self.rng, 2)})
+        if response.status_code == 200:
+            self.subtasks.setdefault(task_id, []).append(response.json()["subtask"]["id"])
+        return response
+
+    async def toggle_subtask(self):
+        if not self.subtasks:
+            return await self.add_subtask()
+        task_id = self.rng.choice(list(self.subtasks))
+        subtask_id = self.rng.choice(self.subtasks[task_id])
+        return await self.client.put(f"/api/tasks/{task_id}/subtasks/{subtask_id}",
+                                     params={"completed": self.rng.random() < 0.5})
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def report(samples, ops, errors, elapsed, total):
+    print(f"\n{'scenario':<16}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'ops/req':>9}")
+    worst_p95 = 0.0
+    for name in MIX:
+        if not samples[name]:
+            continue
+        ordered = sorted(samples[name])
+        p95 = percentile(ordered, 0.95)
+        worst_p95 = max(worst_p95, p95)
+        print(f"{name:<16}{len(ordered):>7}{errors[name]:>8}{statistics.median(ordered):>10.2f}"
+              f"{p95:>10.2f}{percentile(ordered, 0.99):>10.2f}"
+              f"{statistics.mean(ops[name]):>9.1f}")
+    all_ops = [count for counts in ops.values() for count in counts]
+    print(f"\n{total} requests in {elapsed:.2f}s: {total / elapsed:.0f} req/s, "
+          f"{statistics.mean(all_ops):.1f} Mongo ops/request")
+    return worst_p95
+
+async def main(args):
+    os.environ["MONGO_URL"] = args.mongo_url
+    if not args.mongo_url.startswith("mongomock://"):
+        os.environ["MONGO_DB_NAME"] = args.db
+
+    import httpx
+    import repository
+    from cache import response_cache
+    from database import get_client
+    from indexes import ensure_indexes
+    from server import app
+    from tenancy import DEFAULT_TENANT, tenant_scope
+
+    for repo in (repository.task_repository, repository.list_repository,
+                 repository.tag_repository, repository.stats_repository):
+        repo.collection = CountingCollection(repo.collection)
+    if args.no_response_cache:
+        response_cache.max_entries = 0
+
+    rng = random.Random(args.seed)
+    await ensure_indexes()
+    started = time.perf_counter()
+    # Requests carry no tenant header, so they are served as DEFAULT_TENANT
+    for tenant_id in [DEFAULT_TENANT] + [f"bench-{i}" for i in range(1, args.tenants)]:
+        with tenant_scope(tenant_id):
+            seeded = await seed(args, rng, tenant_id)
+        if tenant_id == DEFAULT_TENANT:
+            list_ids, task_ids = seeded
+    print(f"Seeded {args.lists} lists, {args.tags} tags, {args.tasks} tasks "
+          f"for {args.tenants} tenant(s) in {time.perf_counter() - started:.1f}s")
+
+    samples = defaultdict(list)
+    ops = defaultdict(list)
+    errors = defaultdict(int)
+    names, weights = list(MIX), list(MIX.values())
+    remaining = [args.requests]
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as http:
+        workload = Workload(http, rng, list_ids, task_ids)
+
+        async def worker():
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                name = rng.choices(names, weights)[0]
+                request_ops = [0]
+                token = _request_ops.set(request_ops)
+                started = time.perf_counter()
+                try:
+                    response = await getattr(workload, name)()
+                finally:
+                    _request_ops.reset(token)
+                samples[name].append((time.perf_counter() - started) * 1000)
+                ops[name].append(request_ops[0])
+                if response.status_code >= 400:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    worst_p95 = report(samples, ops, errors, elapsed, args.requests)
+    if not args.mongo_url.startswith("mongomock://") and not args.keep:
+        await get_client().drop_database(args.db)
+    if args.max_p95_ms and worst_p95 > args.max_p95_ms:
+        print(f"p95 {worst_p95:.2f}ms exceeds the {args.max_p95_ms}ms budget")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lists", type=int, default=20)
+    parser.add_argument("--tags", type=int, default=30)
+    parser.add_argument("--tasks", type=int, default=5000)
+    parser.add_argument("--subtasks", type=int, default=3, help="maximum subtasks per task")
+    parser.add_argument("--tenants", type=int, default=1, help="tenants seeded with the same data")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mongo-url", default="mongomock://")
+    parser.add_argument("--db", default="persian_todo_bench")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded database")
+    parser.add_argument("--no-response-cache", action="store_true",
+                        help="disable the in-process response cache")
+    parser.add_argument("--max-p95-ms", type=float, help="fail if any scenario's p95 is slower")
+    sys.exit(asyncio.run(main(parser.parse_args())))
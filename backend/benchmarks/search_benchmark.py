@@ -0,0 +1,111 @@
+"""Compare the regex search path with the indexed token search.
+
+Seeds a scratch database with synthetic Persian tasks and times both
+query strategies on the same search terms:
+
+    python benchmarks/search_benchmark.py --tasks 1000000
+
+Run it against a real MongoDB (MONGO_URL); the mongomock stand-in has no
+indexes, so its numbers are not meaningful beyond small smoke runs.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import MONGO_URL, create_client
+from indexes import INDEXES
+from search import search_document_fields, query_tokens, build_search_pipeline
+from tenancy import DEFAULT_TENANT, TENANT_FIELD
+
+WORDS = [
+    "خرید", "کتاب", "جلسه", "پروژه", "گزارش", "تماس", "ایمیل", "بررسی", "طراحی",
+    "پرداخت", "قبض", "ورزش", "باشگاه", "مطالعه", "دانشگاه", "سفر", "بلیط", "هتل",
+    "پزشک", "دارو", "تعمیر", "ماشین", "خانه", "نظافت", "آشپزی", "میوه", "نان",
+    "کلاس", "زبان", "انگلیسی", "برنامه‌نویسی", "سرور", "پایگاه", "داده", "تست",
+]
+
+QUERIES = ["کتاب", "جلسه پروژه", "برنامه", "خرید نان", "گزارش سرور", "دانش"]
+
+def random_text(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+async def seed(collection, total, batch_size=5000):
+    rng = random.Random(42)
+    start = datetime.utcnow()
+    for offset in range(0, total, batch_size):
+        batch = []
+        for i in range(offset, min(offset + batch_size, total)):
+            title = random_text(rng, 4)
+            description = random_text(rng, 12)
+            batch.append({
+                "id": str(uuid.uuid4()),
+                "title": title,
+                "description": description,
+                "status": "در انتظار",
+                "priority": "متوسط",
+                "created_at": start - timedelta(seconds=i),
+                TENANT_FIELD: DEFAULT_TENANT,
+                **search_document_fields(title, description),
+            })
+        await collection.insert_many(batch, ordered=False)
+        print(f"\rSeeded {min(offset + batch_size, total)}/{total}", end="", flush=True)
+    print()
+
+async def time_query(run, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+def summarize(samples):
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"p50={statistics.median(ordered):8.2f}ms  p95={p95:8.2f}ms"
+
+async def main(args):
+    client = create_client(args.mongo_url)
+    collection = client[args.db].tasks
+    if not args.reuse:
+        await collection.drop()
+        await collection.create_indexes(INDEXES["tasks"])
+        await seed(collection, args.tasks)
+
+    for search in QUERIES:
+        async def regex_path():
+            query = {TENANT_FIELD: DEFAULT_TENANT, "$or": [
+                {"title": {"$regex": search, "$options": "i"}},
+                {"description": {"$regex": search, "$options": "i"}},
+            ]}
+            await collection.find(query).sort("created_at", -1).limit(args.limit).to_list(length=None)
+
+        async def token_path():
+            pipeline = build_search_pipeline({TENANT_FIELD: DEFAULT_TENANT}, query_tokens(search), args.limit)
+            await collection.aggregate(pipeline).to_list(length=None)
+
+        print(f"{search!r}")
+        print(f"  regex  {summarize(await time_query(regex_path, args.repeat))}")
+        print(f"  tokens {summarize(await time_query(token_path, args.repeat))}")
+
+    if not args.keep:
+        await client.drop_database(args.db)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--mongo-url", default=MONGO_URL)
+    parser.add_argument("--db", default="persian_todo_bench")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded database")
+    parser.add_argument("--reuse", action="store_true", help="reuse a previously seeded database")
+    asyncio.run(main(parser.parse_args()))
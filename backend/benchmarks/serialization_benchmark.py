@@ -0,0 +1,94 @@
+"""Compare the previous task listing serialization with the orjson path.
+
+The previous path copied every document through `task_dict_to_model`
+(stringified `_id`, per-field `isoformat`), validated the list against
+`response_model=List[dict]` and encoded it with the stdlib JSON encoder.
+The current path returns projected documents straight to ORJSONResponse:
+
+    python benchmarks/serialization_benchmark.py --tasks 10000
+
+No database is needed; documents are synthesized in memory.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serializers import json_response
+
+def make_tasks(total: int, with_id: bool) -> List[dict]:
+    start = datetime.utcnow()
+    tasks = []
+    for i in range(total):
+        task = {
+            "id": str(uuid.uuid4()),
+            "title": f"تسک شماره {i}",
+            "description": "توضیحات نمونه برای سنجش سرعت",
+            "status": "در انتظار",
+            "priority": "متوسط",
+            "due_date": "2024-03-20",
+            "list_id": str(uuid.uuid4()),
+            "tags": ["کار", "خانه"],
+            "subtasks": [{"id": str(uuid.uuid4()), "title": "زیرتسک", "completed": False,
+                          "created_at": start}],
+            "created_at": start - timedelta(seconds=i),
+            "updated_at": start,
+            "completed_at": None,
+        }
+        if with_id:
+            task["_id"] = ObjectId()
+        tasks.append(task)
+    return tasks
+
+def legacy_task_dict_to_model(task_dict: dict) -> dict:
+    task_dict['_id'] = str(task_dict['_id'])
+    for field in ("created_at", "updated_at", "completed_at"):
+        if task_dict.get(field):
+            task_dict[field] = task_dict[field].isoformat()
+    return task_dict
+
+LIST_OF_DICTS = TypeAdapter(List[dict])
+
+def legacy_path(tasks: List[dict]) -> bytes:
+    content = [legacy_task_dict_to_model(task) for task in tasks]
+    content = jsonable_encoder(LIST_OF_DICTS.validate_python(content))
+    return JSONResponse(content).body
+
+def orjson_path(tasks: List[dict]) -> bytes:
+    return json_response(tasks).body
+
+def time_path(name, serialize, make, repeat):
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        tasks = make()
+        started = time.perf_counter()
+        size = len(serialize(tasks))
+        timings.append(time.perf_counter() - started)
+    median = statistics.median(timings)
+    print(f"{name:<10} median {median * 1000:8.1f} ms  "
+          f"{len(tasks) / median:10.0f} tasks/s  {size / 1024:8.0f} KiB")
+    return median
+
+def main(total: int, repeat: int):
+    legacy = time_path("legacy", legacy_path, lambda: make_tasks(total, True), repeat)
+    current = time_path("orjson", orjson_path, lambda: make_tasks(total, False), repeat)
+    print(f"speedup    {legacy / current:.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.tasks, args.repeat)
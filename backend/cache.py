@@ -0,0 +1,260 @@
+"""Conditional GET and response caching for the read endpoints.
+
+Each collection has a version counter that is bumped by every change
+event the mutation routes publish. A cached GET gets a strong ETag built
+from the versions of the collections it reads plus its query string;
+`If-None-Match` hits are answered with 304, and recent response bodies
+are served from an in-process LRU without touching Mongo.
+
+Versions are kept per tenant, so one tenant's writes never invalidate
+another tenant's responses, and the tenant is part of every cache key.
+
+With several worker processes, CACHE_SYNC=mongo keeps the versions in a
+shared Mongo document instead: bumps made while handling a request are
+written before its response is sent, and every cached GET reads the
+current versions, so a write on one worker invalidates every worker.
+"""
+import asyncio
+import contextvars
+import hashlib
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from starlette.datastructures import Headers
+
+from repository import version_repository
+from stats import current_due_date
+from tenancy import TENANT_FIELD, current_tenant
+
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '256'))
+# "local" (one process) or "mongo" (versions shared by worker processes)
+CACHE_SYNC = os.environ.get('CACHE_SYNC', 'local')
+VERSIONS_ID = "cache_versions"
+
+logger = logging.getLogger(__name__)
+MAX_CACHED_BODY_BYTES = 2 * 1024 * 1024
+
+# Path -> collections whose changes invalidate its responses
+CACHED_PATHS: Dict[str, Tuple[str, ...]] = {
+    # expand=list,tags joins in list and tag documents
+    "/api/tasks": ("tasks", "lists", "tags"),
+    "/api/lists": ("lists",),
+    "/api/tags": ("tags",),
+    "/api/stats": ("tasks", "lists"),
+    "/api/calendar/due-buckets": ("tasks",),
+    "/api/calendar/occurrences": ("tasks",),
+}
+
+# Event type prefix -> collections the event changes
+EVENT_COLLECTIONS = {
+    "task": ("tasks",),
+    "tasks": ("tasks",),
+    "subtask": ("tasks",),
+    "list": ("lists",),
+    "tag": ("tags",),
+    # Background cascades rewrite tasks batch by batch
+    "job": ("tasks",),
+}
+
+# Deletes that cascade into the tasks collection
+CASCADING_EVENTS = {"list.deleted", "tag.deleted"}
+
+def _versioned(name: str, tenant_id: Optional[str]) -> str:
+    """The version counter of a tenant's view of a collection"""
+    return f"{tenant_id}:{name}" if tenant_id is not None else name
+
+class CollectionVersions:
+    def __init__(self):
+        # Versions restart with the process, so ETags also carry a process epoch
+        self.epoch = uuid.uuid4().hex[:8]
+        self._versions: Dict[str, int] = {}
+
+    def get(self, name: str) -> int:
+        return self._versions.get(name, 0)
+
+    def bump(self, *names: str):
+        for name in names:
+            self._versions[name] = self.get(name) + 1
+
+    def snapshot(self, names: Iterable[str]) -> Tuple[int, ...]:
+        return tuple(self.get(name) for name in names)
+
+    def on_event(self, event: dict):
+        """EventBus listener bumping the collections an event touched,
+        as seen by the event's tenant"""
+        if event["type"] == "resync":
+            names = {name for names in CACHED_PATHS.values() for name in names}
+        else:
+            names = set(EVENT_COLLECTIONS.get(event["type"].split(".")[0], ()))
+            if event.get("lists"):
+                names.add("lists")
+            if event.get("tags"):
+                names.add("tags")
+            if event["type"] in CASCADING_EVENTS:
+                names.add("tasks")
+        tenant_id = event.get(TENANT_FIELD)
+        self.bump(*(_versioned(name, tenant_id) for name in names))
+
+    async def current(self, names: Iterable[str]) -> Tuple[str, Tuple[int, ...]]:
+        """The epoch and the current tenant's versions of `names` to key a response with"""
+        tenant_id = current_tenant()
+        return self.epoch, self.snapshot(_versioned(name, tenant_id) for name in names)
+
+    async def flush(self):
+        """Make this request's bumps visible to other processes"""
+
+# Set while a request is being handled, so bumps made by its routes are
+# written before the response is sent rather than in the background
+_handling_request = contextvars.ContextVar("handling_request", default=False)
+
+class SharedCollectionVersions(CollectionVersions):
+    """Collection versions stored in Mongo and shared by worker processes"""
+
+    def __init__(self, repository=version_repository):
+        super().__init__()
+        self.repository = repository
+        self._pending: Dict[str, int] = {}
+        self._writes: Set[asyncio.Future] = set()
+
+    def bump(self, *names: str):
+        for name in names:
+            self._pending[name] = self._pending.get(name, 0) + 1
+        if names and not _handling_request.get():
+            # Published by a background job: no response to hold back
+            self._start_write()
+
+    def _start_write(self):
+        pending, self._pending = self._pending, {}
+        if pending:
+            write = asyncio.ensure_future(self.repository.increment(VERSIONS_ID, pending, self.epoch))
+            self._writes.add(write)
+            write.add_done_callback(self._write_done)
+
+    def _write_done(self, write: asyncio.Future):
+        self._writes.discard(write)
+        if not write.cancelled() and write.exception():
+            logger.error("Could not share cache versions: %s", write.exception())
+
+    async def flush(self):
+        # Concurrent requests may have taken each other's bumps into their
+        # writes, so wait for every write in flight
+        self._start_write()
+        if self._writes:
+            await asyncio.wait(set(self._writes))
+
+    async def current(self, names: Iterable[str]) -> Tuple[str, Tuple[int, ...]]:
+        document = await self.repository.get(VERSIONS_ID, self.epoch)
+        versions = document.get("versions", {})
+        tenant_id = current_tenant()
+        return document["epoch"], tuple(versions.get(_versioned(name, tenant_id), 0) for name in names)
+
+class ResponseCache:
+    """LRU of serialized responses keyed by path, query and collection versions"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, headers: list, body: bytes):
+        self._entries[key] = (headers, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+collection_versions = SharedCollectionVersions() if CACHE_SYNC == "mongo" else CollectionVersions()
+response_cache = ResponseCache()
+
+def _etag(key: tuple) -> str:
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return etag in candidates or "*" in candidates
+
+class ConditionalGetMiddleware:
+    """ASGI middleware adding ETags, 304s and LRU caching to CACHED_PATHS"""
+
+    def __init__(self, app, versions: CollectionVersions = collection_versions,
+                 cache: ResponseCache = response_cache):
+        self.app = app
+        self.versions = versions
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _handling_request.set(True)
+        try:
+            await self._handle(scope, receive, send)
+        finally:
+            _handling_request.reset(token)
+
+    def _flush_before_start(self, send):
+        async def flushing_send(message):
+            if message["type"] == "http.response.start":
+                await self.versions.flush()
+            await send(message)
+        return flushing_send
+
+    async def _handle(self, scope, receive, send):
+        path = scope.get("path")
+        if scope["method"] != "GET" or path not in CACHED_PATHS:
+            await self.app(scope, receive, self._flush_before_start(send))
+            return
+
+        query = urlencode(sorted(parse_qsl(scope.get("query_string", b"").decode())))
+        epoch, versions = await self.versions.current(CACHED_PATHS[path])
+        # The day is part of the key since due_today changes at midnight
+        key = (path, query, current_tenant(), current_due_date(), epoch, versions)
+        etag = _etag(key)
+        validators = [(b"etag", etag.encode()), (b"cache-control", b"no-cache")]
+
+        if _etag_matches(Headers(scope=scope).get("if-none-match"), etag):
+            await send({"type": "http.response.start", "status": 304, "headers": validators})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            headers, body = cached
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        start = {}
+        chunks = []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            headers = list(start.get("headers", []))
+            if start["status"] == 200:
+                headers.extend(validators)
+                if len(body) <= MAX_CACHED_BODY_BYTES:
+                    self.cache.put(key, headers, body)
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, capture)
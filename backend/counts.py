@@ -0,0 +1,176 @@
+"""Denormalized list and tag task counts.
+
+Every task write adjusts the `task_count` of the lists and tags it enters
+or leaves. Single-task routes apply the write and the count increments in
+one transaction when the deployment supports them (replica sets and
+sharded clusters); elsewhere, and for batches and background cascades,
+the increments follow the write. A background reconciler recomputes
+each tenant's counts with one aggregation and corrects whatever has
+drifted:
+
+    python counts.py verify   # report drift between counts and tasks
+    python counts.py rebuild  # correct drifted counts
+"""
+import argparse
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from database import run_in_transaction
+from events import event_bus
+from repository import task_repository, list_repository, tag_repository
+from tenancy import tenant_scope
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_INTERVAL_SECONDS = float(os.environ.get('RECONCILE_INTERVAL_SECONDS', '600'))
+# Drift must survive two passes this far apart before it is corrected, so
+# counts of writes still between their task write and increment are left alone
+RECONCILE_SETTLE_SECONDS = float(os.environ.get('RECONCILE_SETTLE_SECONDS', '1'))
+
+REPOSITORIES = {"lists": list_repository, "tags": tag_repository}
+
+def list_count_delta(before: Optional[dict], after: Optional[dict]) -> Dict[str, int]:
+    """List task_count increments needed to go from `before` to `after`"""
+    old_list = before.get("list_id") if before else None
+    new_list = after.get("list_id") if after else None
+    delta: Dict[str, int] = {}
+    if old_list != new_list:
+        if old_list:
+            delta[old_list] = -1
+        if new_list:
+            delta[new_list] = 1
+    return delta
+
+def tag_count_delta(before: Optional[dict], after: Optional[dict]) -> Dict[str, int]:
+    """Tag task_count increments needed to go from `before` to `after`"""
+    old_tags = set(before.get("tags") or []) if before else set()
+    new_tags = set(after.get("tags") or []) if after else set()
+    delta = {tag_id: 1 for tag_id in new_tags - old_tags}
+    delta.update({tag_id: -1 for tag_id in old_tags - new_tags})
+    return delta
+
+async def apply_count_changes(before: Optional[dict], after: Optional[dict],
+                              session=None) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Apply and return the list and tag count increments of one task change"""
+    list_delta = list_count_delta(before, after)
+    tag_delta = tag_count_delta(before, after)
+    await list_repository.increment_task_counts(list_delta, session=session)
+    await tag_repository.increment_task_counts(tag_delta, session=session)
+    return list_delta, tag_delta
+
+async def write_task(write: Callable[..., Awaitable[tuple]]) -> tuple:
+    """Run a single-task write together with its count increments.
+
+    `write(session)` performs the write and returns the task as it was
+    before and after it, either of which may be None. Returns
+    (before, after, list delta, tag delta).
+    """
+    async def callback(session):
+        before, after = await write(session)
+        list_delta, tag_delta = await apply_count_changes(before, after, session=session)
+        return before, after, list_delta, tag_delta
+    return await run_in_transaction(callback)
+
+async def find_tenants() -> List[str]:
+    """Tenants owning lists or tags, whose counts can drift"""
+    tenants = set()
+    for repository in REPOSITORIES.values():
+        tenants.update(await repository.find_tenants())
+    return sorted(tenants)
+
+async def find_drift() -> Dict[str, Dict[str, tuple]]:
+    """Return {"lists"|"tags": {id: (stored, actual)}} for every drifted
+    count of the current tenant"""
+    actual = await task_repository.count_by_owner()
+    drift = {}
+    for name, repository in REPOSITORIES.items():
+        stored = await repository.get_task_counts()
+        drift[name] = {
+            doc_id: (count, actual[name].get(doc_id, 0))
+            for doc_id, count in stored.items()
+            if count != actual[name].get(doc_id, 0)
+        }
+    return drift
+
+async def reconcile(settle_seconds: float = RECONCILE_SETTLE_SECONDS) -> Dict[str, Dict[str, int]]:
+    """Correct counts that drifted and stayed drifted across two passes.
+
+    Returns the increments applied, as {"lists"|"tags": {id: delta}}.
+    """
+    first = await find_drift()
+    if not any(first.values()):
+        return {name: {} for name in REPOSITORIES}
+    if settle_seconds:
+        await asyncio.sleep(settle_seconds)
+    second = await find_drift()
+    applied = {}
+    for name, repository in REPOSITORIES.items():
+        stable = {
+            doc_id: counts for doc_id, counts in second[name].items()
+            if first[name].get(doc_id) == counts
+        }
+        await repository.correct_task_counts(stable)
+        applied[name] = {doc_id: actual - stored for doc_id, (stored, actual) in stable.items()}
+    return applied
+
+class CountReconciler:
+    """Periodically reconciles counts and publishes the corrections"""
+
+    def __init__(self, interval: float = RECONCILE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                tenants = await find_tenants()
+            except Exception:
+                logger.exception("Count reconciliation failed")
+                continue
+            for tenant_id in tenants:
+                with tenant_scope(tenant_id):
+                    try:
+                        applied = await reconcile()
+                    except Exception:
+                        logger.exception("Count reconciliation of tenant %s failed", tenant_id)
+                        continue
+                    if any(applied.values()):
+                        logger.warning("Corrected drifted task counts of tenant %s: %s", tenant_id, applied)
+                        event_bus.publish("counts.reconciled", lists=applied["lists"], tags=applied["tags"])
+
+count_reconciler = CountReconciler()
+
+async def main(command: str):
+    for tenant_id in await find_tenants():
+        with tenant_scope(tenant_id):
+            drift = await find_drift()
+            for name, counts in drift.items():
+                for doc_id, (stored, actual) in sorted(counts.items()):
+                    print(f"{tenant_id}/{name}.{doc_id}: stored={stored} actual={actual}")
+            if command == "rebuild":
+                applied = await reconcile()
+                print(f"Corrected {sum(len(counts) for counts in applied.values())} counts of {tenant_id}")
+            elif not any(drift.values()):
+                print(f"Task counts of {tenant_id} are consistent")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify or correct list and tag task counts")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    args = parser.parse_args()
+    asyncio.run(main(args.command))
@@ -0,0 +1,136 @@
+import os
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from metrics import command_listener
+
+# MongoDB connection settings
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
+MONGO_DB_NAME = os.environ.get('MONGO_DB_NAME', 'persian_todo')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '200'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '10'))
+
+# URLs starting with this prefix use an in-memory stand-in instead of a server
+MOCK_URL_PREFIX = 'mongomock://'
+# sqlite:///path/to/todo.db stores everything in an embedded SQLite file
+SQLITE_URL_PREFIX = 'sqlite://'
+
+def create_client(url: str = MONGO_URL):
+    """Create an async MongoDB client (or a stand-in with the same API) for the given URL"""
+    if url.startswith(MOCK_URL_PREFIX):
+        # Imported lazily so production installs do not need mongomock
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError as e:
+            raise RuntimeError(
+                f"MONGO_URL={MOCK_URL_PREFIX} needs mongomock-motor; install requirements-dev.txt"
+            ) from e
+        return AsyncMongoMockClient()
+    if url.startswith(SQLITE_URL_PREFIX):
+        from sqlite_store import SQLiteClient
+        return SQLiteClient(url)
+    return AsyncIOMotorClient(
+        url,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        event_listeners=[command_listener],
+    )
+
+# One client per process, created on first use. Worker processes must not
+# share a client created before they forked, so the app lifespan calls
+# connect() in each worker and nothing touches Mongo at import time.
+_client = None
+_client_pid: Optional[int] = None
+
+def get_client():
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = create_client()
+        _client_pid = os.getpid()
+    return _client
+
+def connect():
+    """Create this process's client if it does not have one yet"""
+    return get_client()
+
+def close():
+    """Close this process's client; the next use creates a new one"""
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        _client.close()
+    _client = None
+    _client_pid = None
+
+def get_db():
+    return get_client()[MONGO_DB_NAME]
+
+class LazyDatabase:
+    """The configured database of the current process's client"""
+
+    def __getitem__(self, name: str):
+        return get_db()[name]
+
+    def __getattr__(self, name: str):
+        return getattr(get_db(), name)
+
+class LazyCollection:
+    """A collection handle resolved against the current process's client
+    on every use, so module-level repositories survive forks and reconnects"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._client = None
+        self._collection = None
+
+    def _resolve(self):
+        client = get_client()
+        if client is not self._client:
+            self._collection = client[MONGO_DB_NAME][self._name]
+            self._client = client
+        return self._collection
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._resolve(), attribute)
+
+db = LazyDatabase()
+
+T = TypeVar("T")
+
+_transactions_supported: Optional[bool] = None
+
+async def supports_transactions() -> bool:
+    """Whether the deployment is a replica set or sharded cluster"""
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = await get_client().admin.command("hello")
+            _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        except Exception:
+            # Standalone servers without `hello` and the in-memory stand-in
+            _transactions_supported = False
+    return _transactions_supported
+
+async def run_in_transaction(callback: Callable[..., Awaitable[T]]) -> T:
+    """Run `callback(session)` inside a transaction when the deployment
+    supports them, otherwise run `callback(None)` directly.
+
+    The callback may be retried on transient errors, so it must derive
+    everything it writes from what it reads within the session.
+    """
+    if not await supports_transactions():
+        return await callback(None)
+    async with await get_client().start_session() as session:
+        return await session.with_transaction(callback)
+
+# Collections
+tasks_collection = LazyCollection("tasks")
+tasks_archive_collection = LazyCollection("tasks_archive")
+lists_collection = LazyCollection("lists")
+tags_collection = LazyCollection("tags")
+settings_collection = LazyCollection("settings")
+counters_collection = LazyCollection("counters")
+subtasks_collection = LazyCollection("subtasks")
+jobs_collection = LazyCollection("jobs")
+tombstones_collection = LazyCollection("tombstones")
+reminders_collection = LazyCollection("reminders")
@@ -0,0 +1,97 @@
+"""In-process publish/subscribe of data changes, streamed to clients over SSE.
+
+Mutation routes publish an event after every successful write, e.g.
+
+    {"type": "task.updated", "data": {...}, "stats": {"pending_tasks": -1},
+     "lists": {"<list id>": 1}, "sequence": 42, "tenant_id": "acme"}
+
+`stats` holds increments to the `/api/stats` fields, and `lists` and
+`tags` hold increments to list and tag task counts, so clients can apply
+changes without refetching. Events belong to the tenant whose data
+changed and are only streamed to that tenant's subscribers. A subscriber
+that falls too far behind receives a single `resync` event and should
+reload its data.
+"""
+import asyncio
+import json
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional
+
+from tenancy import TENANT_FIELD, current_tenant
+
+HEARTBEAT_SECONDS = 15
+MAX_PENDING_EVENTS = 1000
+
+class EventBus:
+    def __init__(self, max_pending: int = MAX_PENDING_EVENTS):
+        self.max_pending = max_pending
+        self.sequence = 0
+        # Queue -> tenant whose events it receives
+        self._subscribers: Dict[asyncio.Queue, Optional[str]] = {}
+        self._listeners: List[Callable[[dict], None]] = []
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        """Call `listener` synchronously with every published event"""
+        self._listeners.append(listener)
+
+    def subscribe(self) -> asyncio.Queue:
+        """A queue receiving the current tenant's events"""
+        queue = asyncio.Queue(maxsize=self.max_pending)
+        self._subscribers[queue] = current_tenant()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.pop(queue, None)
+
+    def publish(self, event_type: str, data=None, stats: Optional[dict] = None,
+                lists: Optional[dict] = None, tags: Optional[dict] = None) -> dict:
+        self.sequence += 1
+        tenant_id = current_tenant()
+        event = {"type": event_type, "sequence": self.sequence, TENANT_FIELD: tenant_id}
+        if data is not None:
+            event["data"] = data
+        if stats:
+            event["stats"] = stats
+        if lists:
+            event["lists"] = {list_id: delta for list_id, delta in lists.items() if delta}
+        if tags:
+            event["tags"] = {tag_id: delta for tag_id, delta in tags.items() if delta}
+        for listener in self._listeners:
+            listener(event)
+        for queue, subscriber_tenant in list(self._subscribers.items()):
+            if subscriber_tenant != tenant_id:
+                continue
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Drop the backlog of a slow client and ask it to reload
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync", "sequence": self.sequence, TENANT_FIELD: tenant_id})
+        return event
+
+event_bus = EventBus()
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+def format_sse(event: dict) -> str:
+    payload = json.dumps(event, ensure_ascii=False, default=_json_default)
+    return f"id: {event['sequence']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+async def sse_stream(is_disconnected, bus: EventBus = event_bus):
+    """Yield SSE frames for every published event until the client disconnects"""
+    queue = bus.subscribe()
+    try:
+        yield "retry: 3000\n\n"
+        while not await is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        bus.unsubscribe(queue)
@@ -0,0 +1,255 @@
+"""Index definitions for the task, archive, list, tag, subtask, job, tombstone and reminder collections.
+
+Documents carry the tenant owning them and every query the API issues
+filters on it, so the indexes start with tenant_id: a tenant's reads only
+walk that tenant's index entries, however many other tenants share the
+collection. The few unprefixed indexes serve background work that spans
+tenants. Every unique index starts with tenant_id as well, so the
+collections can be sharded on SHARD_KEYS, keeping a tenant's documents on
+one shard.
+
+`ensure_indexes` runs at application startup and is idempotent. The CLI
+reports how the live database differs from these definitions:
+
+    python indexes.py ensure   # create any missing indexes
+    python indexes.py report   # missing/unused indexes and query plans
+    python indexes.py shard    # shard the tenant collections (through mongos)
+"""
+import argparse
+import asyncio
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from database import MONGO_DB_NAME, db, get_client
+from pagination import TASK_SORT
+from tenancy import TENANT_FIELD
+
+TENANT = (TENANT_FIELD, ASCENDING)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "tasks": [
+        IndexModel([TENANT, ("id", ASCENDING)], unique=True, name="tenant_id_unique"),
+        # get_tasks pages are sorted by (created_at, id), newest first
+        IndexModel([TENANT, ("created_at", DESCENDING), ("id", DESCENDING)], name="tenant_created_at_id"),
+        # get_tasks filtered by list (other filters are applied on the fetch)
+        IndexModel(
+            [TENANT, ("list_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="tenant_list_created_at_id",
+        ),
+        # get_tasks filtered by status; recent pending tasks in get_stats
+        IndexModel(
+            [TENANT, ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="tenant_status_created_at_id",
+        ),
+        # get_tasks filtered by status and priority; pending-by-priority counts
+        IndexModel(
+            [TENANT, ("status", ASCENDING), ("priority", ASCENDING),
+             ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="tenant_status_priority_created_at_id",
+        ),
+        # Pending tasks due on a given day or in a range (calendar views)
+        IndexModel([TENANT, ("due_date", ASCENDING), ("status", ASCENDING)], name="tenant_due_date_status"),
+        # The reminder scheduler loads every tenant's upcoming due dates
+        IndexModel([("due_date", ASCENDING), ("status", ASCENDING)], name="due_date_status"),
+        # get_tasks filtered by tags (multikey, one entry per tag id)
+        IndexModel(
+            [TENANT, ("tags", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="tenant_tags_created_at_id",
+        ),
+        # One stored instance per occurrence of a recurring series
+        IndexModel(
+            [TENANT, ("series_id", ASCENDING), ("occurrence", ASCENDING)],
+            unique=True, partialFilterExpression={"series_id": {"$exists": True}},
+            name="tenant_series_occurrence_unique",
+        ),
+        # Multikey index over normalized word prefixes for search
+        IndexModel([TENANT, ("search_terms", ASCENDING)], name="tenant_search_terms"),
+        # GET /api/sync: tasks changed after a client's cursor
+        IndexModel([TENANT, ("seq", ASCENDING)], name="tenant_seq"),
+        # Finished tasks due for archiving, by the scheduled job spanning tenants
+        IndexModel([("status", ASCENDING), ("updated_at", ASCENDING)], name="status_updated_at"),
+    ],
+    # Read only with include_archived=true and by restores
+    "tasks_archive": [
+        IndexModel([TENANT, ("id", ASCENDING)], unique=True, name="tenant_id_unique"),
+        IndexModel([TENANT, ("created_at", DESCENDING), ("id", DESCENDING)], name="tenant_created_at_id"),
+        IndexModel(
+            [TENANT, ("list_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="tenant_list_created_at_id",
+        ),
+        IndexModel(
+            [TENANT, ("tags", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="tenant_tags_created_at_id",
+        ),
+        IndexModel([TENANT, ("search_terms", ASCENDING)], name="tenant_search_terms"),
+    ],
+    "lists": [
+        IndexModel([TENANT, ("id", ASCENDING)], unique=True, name="tenant_id_unique"),
+        # expand=list joins tasks to lists on id alone
+        IndexModel([("id", ASCENDING)], name="id"),
+        IndexModel([TENANT, ("created_at", DESCENDING)], name="tenant_created_at"),
+        IndexModel([TENANT, ("seq", ASCENDING)], name="tenant_seq"),
+    ],
+    "tags": [
+        IndexModel([TENANT, ("id", ASCENDING)], unique=True, name="tenant_id_unique"),
+        # expand=tags joins tasks to tags on id alone
+        IndexModel([("id", ASCENDING)], name="id"),
+        IndexModel([TENANT, ("created_at", DESCENDING)], name="tenant_created_at"),
+        IndexModel([TENANT, ("seq", ASCENDING)], name="tenant_seq"),
+    ],
+    "tombstones": [
+        IndexModel([TENANT, ("seq", ASCENDING)], name="tenant_seq"),
+    ],
+    # Sent reminders only need to outlive the catch-up window after a restart
+    "reminders": [
+        IndexModel([("sent_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600, name="sent_at_ttl"),
+    ],
+    # Only populated when SUBTASK_STORAGE=collection
+    "subtasks": [
+        IndexModel([TENANT, ("id", ASCENDING)], unique=True, name="tenant_id_unique"),
+        # A task's checklist in creation order
+        IndexModel([TENANT, ("task_id", ASCENDING), ("created_at", ASCENDING)], name="tenant_task_id_created_at"),
+    ],
+    # Job queues serve every tenant, so jobs are claimed and resumed by id and status
+    "jobs": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        # Unfinished jobs resumed at startup
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+        # A tenant's recent jobs
+        IndexModel([TENANT, ("created_at", DESCENDING)], name="tenant_created_at"),
+    ],
+}
+
+# Shard keys of the collections that grow with every tenant's data
+SHARD_KEYS: Dict[str, Dict[str, int]] = {
+    name: {TENANT_FIELD: ASCENDING} for name in ("tasks", "tasks_archive", "subtasks", "tombstones")
+}
+
+SAMPLE_TENANT = {TENANT_FIELD: "sample"}
+
+# Representative (collection, filter, sort) shapes issued by the API routes
+# and background work
+QUERY_SHAPES = [
+    ("tasks", {**SAMPLE_TENANT, "id": "sample"}, None),
+    ("tasks", SAMPLE_TENANT, TASK_SORT),
+    ("tasks", {**SAMPLE_TENANT, "list_id": "sample"}, TASK_SORT),
+    ("tasks", {**SAMPLE_TENANT, "list_id": "sample", "status": "در انتظار"}, TASK_SORT),
+    ("tasks", {**SAMPLE_TENANT, "status": "در انتظار"}, TASK_SORT),
+    ("tasks", {**SAMPLE_TENANT, "status": "در انتظار", "priority": "بالا"}, TASK_SORT),
+    ("tasks", {**SAMPLE_TENANT, "due_date": "2024-01-01", "status": "در انتظار"}, None),
+    ("tasks", {"due_date": {"$gte": "2024-01-01", "$lte": "2024-01-03"}, "status": "در انتظار"}, None),
+    ("tasks", {**SAMPLE_TENANT, "search_terms": {"$all": ["sample"]}}, None),
+    ("tasks", {"status": {"$in": ["تکمیل شده", "لغو شده"]}, "updated_at": {"$lt": "2024-01-01"}}, None),
+    ("tasks_archive", {**SAMPLE_TENANT, "id": "sample"}, None),
+    ("tasks_archive", SAMPLE_TENANT, TASK_SORT),
+    ("lists", {**SAMPLE_TENANT, "id": "sample"}, None),
+    ("lists", SAMPLE_TENANT, [("created_at", DESCENDING)]),
+    ("tags", {**SAMPLE_TENANT, "id": "sample"}, None),
+    ("tags", SAMPLE_TENANT, [("created_at", DESCENDING)]),
+    ("tasks", {**SAMPLE_TENANT, "seq": {"$gt": 0}}, [("seq", ASCENDING)]),
+    ("tombstones", {**SAMPLE_TENANT, "seq": {"$gt": 0}}, [("seq", ASCENDING)]),
+    ("jobs", {**SAMPLE_TENANT, "id": "sample"}, None),
+]
+
+async def ensure_indexes(database=db) -> Dict[str, List[str]]:
+    """Create every defined index; existing indexes are left untouched"""
+    created = {}
+    for name, models in INDEXES.items():
+        # One at a time: mongomock's create_indexes drops partialFilterExpression
+        created[name] = []
+        for model in models:
+            options = {key: value for key, value in model.document.items() if key != "key"}
+            created[name].append(await database[name].create_index(list(model.document["key"].items()), **options))
+    return created
+
+async def missing_indexes(database=db) -> Dict[str, List[str]]:
+    """Defined indexes that do not exist in the database"""
+    missing = {}
+    for name, models in INDEXES.items():
+        existing = await database[name].index_information()
+        absent = [m.document["name"] for m in models if m.document["name"] not in existing]
+        if absent:
+            missing[name] = absent
+    return missing
+
+async def unused_indexes(database=db) -> Dict[str, List[str]]:
+    """Indexes with no recorded accesses since the server started"""
+    unused = {}
+    for name in INDEXES:
+        stats = await database[name].aggregate([{"$indexStats": {}}]).to_list(length=None)
+        idle = [s["name"] for s in stats if s["name"] != "_id_" and s["accesses"]["ops"] == 0]
+        if idle:
+            unused[name] = idle
+    return unused
+
+def _plan_stages(plan: dict) -> List[str]:
+    """Flatten the stage names of a query plan tree"""
+    stages = [plan.get("stage", "")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+async def explain_query_shapes(database=db) -> List[dict]:
+    """Winning plan stages for every known query shape"""
+    results = []
+    for name, query, sort in QUERY_SHAPES:
+        cursor = database[name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        results.append({
+            "collection": name,
+            "query": query,
+            "sort": sort,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return results
+
+async def report(database=db):
+    for name, absent in (await missing_indexes(database)).items():
+        print(f"Missing indexes on {name}: {', '.join(absent)}")
+    try:
+        for name, idle in (await unused_indexes(database)).items():
+            print(f"Unused indexes on {name}: {', '.join(idle)}")
+    except OperationFailure as e:
+        print(f"Index usage statistics unavailable: {e}")
+    for shape in await explain_query_shapes(database):
+        marker = "COLLSCAN" if shape["collscan"] else "ok"
+        print(f"[{marker}] {shape['collection']} {shape['query']} sort={shape['sort']}: "
+              f"{' > '.join(shape['stages'])}")
+
+async def shard_collections() -> List[str]:
+    """Shard the SHARD_KEYS collections; needs a sharded cluster"""
+    admin = get_client().admin
+    await admin.command("enableSharding", MONGO_DB_NAME)
+    sharded = []
+    for name, key in SHARD_KEYS.items():
+        await admin.command("shardCollection", f"{MONGO_DB_NAME}.{name}", key=key)
+        sharded.append(name)
+    return sharded
+
+async def main(command: str):
+    if command == "ensure":
+        for name, created in (await ensure_indexes()).items():
+            print(f"{name}: {', '.join(created)}")
+    elif command == "shard":
+        try:
+            for name in await shard_collections():
+                print(f"Sharded {name} on {SHARD_KEYS[name]}")
+        except OperationFailure as e:
+            print(f"Sharding failed: {e}")
+    else:
+        await report()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage MongoDB indexes")
+    parser.add_argument("command", choices=["ensure", "report", "shard"])
+    args = parser.parse_args()
+    asyncio.run(main(args.command))
@@ -0,0 +1,148 @@
+"""Jalali calendar service anchored to the Tehran day.
+
+The current day and its Jalali fields are computed once and cached until
+the next midnight in Asia/Tehran, and Gregorian <-> Jalali conversions are
+served from a lookup table covering CALENDAR_YEARS (Gregorian years,
+"2015-2040" by default) instead of calling khayyam per value.
+"""
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import khayyam
+
+from models import TaskStatus
+from repository import task_repository
+
+TEHRAN = ZoneInfo("Asia/Tehran")
+CALENDAR_YEARS = os.environ.get('CALENDAR_YEARS', '2015-2040')
+
+JalaliTuple = Tuple[int, int, int]
+
+def _year_range(spec: str) -> Tuple[int, int]:
+    first, _, last = spec.partition("-")
+    return int(first), int(last or first)
+
+class CalendarService:
+    def __init__(self, years: str = CALENDAR_YEARS):
+        self.first_year, self.last_year = _year_range(years)
+        self._to_jalali: Dict[date, JalaliTuple] = {}
+        self._to_gregorian: Dict[JalaliTuple, date] = {}
+        self._today: Optional[date] = None
+        self._today_info: Optional[dict] = None
+        self._expires_at: Optional[datetime] = None
+
+    def _build_table(self):
+        day = date(self.first_year, 1, 1)
+        last = date(self.last_year, 12, 31)
+        jalali = khayyam.JalaliDate(day)
+        one_day = timedelta(days=1)
+        while day <= last:
+            key = (jalali.year, jalali.month, jalali.day)
+            self._to_jalali[day] = key
+            self._to_gregorian[key] = day
+            day += one_day
+            jalali += one_day
+
+    def to_jalali(self, day: date) -> JalaliTuple:
+        if not self._to_jalali:
+            self._build_table()
+        key = self._to_jalali.get(day)
+        if key is None:
+            jalali = khayyam.JalaliDate(day)
+            key = (jalali.year, jalali.month, jalali.day)
+        return key
+
+    def to_gregorian(self, year: int, month: int, day: int) -> date:
+        if not self._to_gregorian:
+            self._build_table()
+        gregorian = self._to_gregorian.get((year, month, day))
+        if gregorian is None:
+            gregorian = khayyam.JalaliDate(year, month, day).todate()
+        return gregorian
+
+    def days_in_month(self, year: int, month: int) -> int:
+        """Length of a Jalali month, 29 or 30 for Esfand depending on leap years"""
+        if month <= 6:
+            return 31
+        if month <= 11:
+            return 30
+        return (self.to_gregorian(year + 1, 1, 1) - self.to_gregorian(year, 12, 1)).days
+
+    def now(self) -> datetime:
+        return datetime.now(TEHRAN)
+
+    def _refresh(self):
+        now = self.now()
+        if self._expires_at is not None and now < self._expires_at:
+            return
+        today = now.date()
+        jalali = khayyam.JalaliDate(today)
+        week_start = today - timedelta(days=jalali.weekday())  # weeks start on Saturday
+        month_start = today - timedelta(days=jalali.day - 1)
+        self._today = today
+        self._today_info = {
+            "persian_date": jalali.strftime('%Y/%m/%d'),
+            "persian_date_long": jalali.strftime('%A، %d %B %Y'),
+            "gregorian_date": today.isoformat(),
+            "day_name": jalali.strftime('%A'),
+            "month_name": jalali.strftime('%B'),
+            "year": jalali.year,
+            "month": jalali.month,
+            "day": jalali.day,
+            "week_start": week_start.isoformat(),
+            "week_end": (week_start + timedelta(days=6)).isoformat(),
+            "month_start": month_start.isoformat(),
+            "month_end": (month_start + timedelta(days=jalali.daysinmonth - 1)).isoformat(),
+        }
+        self._expires_at = datetime.combine(today + timedelta(days=1), datetime.min.time(), TEHRAN)
+
+    def today(self) -> date:
+        """The current date in Tehran"""
+        self._refresh()
+        return self._today
+
+    def today_info(self) -> dict:
+        """Jalali fields of the current Tehran day, including week and month bounds"""
+        self._refresh()
+        return self._today_info
+
+calendar_service = CalendarService()
+
+async def due_buckets(list_id: Optional[str] = None) -> dict:
+    """Count pending tasks per due-date window in one aggregation.
+
+    `overdue` is due before today; `today`, `this_week` and `this_month`
+    are due between today and the end of the Jalali week (Friday) or
+    month, so each window contains the previous one. A week running into
+    the next month is cut at the end of this one.
+    """
+    info = calendar_service.today_info()
+    today = info["gregorian_date"]
+    week_end = min(info["week_end"], info["month_end"])
+    match = {"status": TaskStatus.PENDING, "due_date": {"$lte": info["month_end"]}}
+    if list_id:
+        match["list_id"] = list_id
+
+    def count_between(first: str, last: str) -> dict:
+        within = {"$and": [{"$gte": ["$due_date", first]}, {"$lte": ["$due_date", last]}]}
+        return {"$sum": {"$cond": [within, 1, 0]}}
+
+    groups = await task_repository.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": None,
+            "overdue": {"$sum": {"$cond": [{"$lt": ["$due_date", today]}, 1, 0]}},
+            "today": count_between(today, today),
+            "this_week": count_between(today, week_end),
+            "this_month": count_between(today, info["month_end"]),
+        }},
+    ])
+    counts = groups[0] if groups else {}
+    return {
+        "date": today,
+        "week_end": week_end,
+        "month_end": info["month_end"],
+        **{bucket: counts.get(bucket, 0) for bucket in ("overdue", "today", "this_week", "this_month")},
+    }
@@ -0,0 +1,188 @@
+"""Background job queue for cascading deletes and task archival.
+
+Deleting a list or tag only marks it deleted inside the request; the
+cascade (removing the list's tasks, pulling the tag id from tasks) runs
+here in batches, as does moving finished tasks to the archive. Jobs are stored in the `jobs` collection with their
+progress, are readable from GET /api/jobs/{job_id}, publish a
+"job.updated" event after every batch, and are resumed at startup if the
+process stopped while they were queued or running.
+
+With several worker processes each one runs a queue; a worker claims a
+job with a lease it renews after every batch, and idle workers pick up
+jobs whose owner stopped renewing.
+
+A job belongs to the tenant that started it and runs scoped to it; the
+scheduled archive job belongs to none and spans every tenant.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from archive import archive_batch, archivable_query
+from events import event_bus
+from repository import task_repository, list_repository, tag_repository, job_repository
+from stats import record_task_changes
+from subtasks import delete_task_subtasks
+from tenancy import TENANT_FIELD, tenant_scope
+
+CASCADE_BATCH_SIZE = 1000
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '60'))
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# A handler processes one batch and returns how many items it handled;
+# the job is finished when a batch handles nothing
+BatchHandler = Callable[[dict, int], Awaitable[int]]
+
+# The fields a deleted task's stats and tag counts are computed from
+_COUNTED_FIELDS = {"_id": 0, "id": 1, "status": 1, "priority": 1, "due_date": 1, "tags": 1}
+
+async def _delete_list_batch(job: dict, batch_size: int) -> int:
+    list_id = job["target_id"]
+    task_ids = await task_repository.find_ids({"list_id": list_id}, limit=batch_size)
+    if not task_ids:
+        await list_repository.delete(list_id)
+        return 0
+    # Tasks moved to another list since they were picked stay
+    deleted = await task_repository.remove_matching(task_ids, {"list_id": list_id}, _COUNTED_FIELDS)
+    deleted_ids = [task["id"] for task in deleted]
+    tag_deltas: Dict[str, int] = {}
+    for task in deleted:
+        for tag_id in task.get("tags") or []:
+            tag_deltas[tag_id] = tag_deltas.get(tag_id, 0) - 1
+    await delete_task_subtasks(deleted_ids)
+    await tag_repository.increment_task_counts(tag_deltas)
+    stats_delta = await record_task_changes([(task, None) for task in deleted])
+    event_bus.publish("tasks.batch", {"updated": [], "deleted": deleted_ids},
+                      stats=stats_delta, tags=tag_deltas)
+    return len(task_ids)
+
+async def _delete_tag_batch(job: dict, batch_size: int) -> int:
+    tag_id = job["target_id"]
+    task_ids = await task_repository.find_ids({"tags": tag_id}, limit=batch_size)
+    if not task_ids:
+        await tag_repository.delete(tag_id)
+        return 0
+    await task_repository.pull_tag(task_ids, tag_id)
+    event_bus.publish("tasks.batch", {"updated": await task_repository.find_by_ids(task_ids), "deleted": []})
+    return len(task_ids)
+
+HANDLERS: Dict[str, BatchHandler] = {
+    "delete_list": _delete_list_batch,
+    "delete_tag": _delete_tag_batch,
+    "archive_tasks": archive_batch,
+}
+
+# Query counting the items a job will process, for progress reporting
+TOTAL_QUERIES = {
+    "delete_list": lambda target_id: {"list_id": target_id},
+    "delete_tag": lambda target_id: {"tags": target_id},
+    "archive_tasks": lambda target_id: archivable_query(datetime.fromisoformat(target_id)),
+}
+
+class JobQueue:
+    def __init__(self, batch_size: int = CASCADE_BATCH_SIZE, lease_seconds: float = JOB_LEASE_SECONDS):
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the worker and resume jobs left unfinished by a previous process"""
+        await self._queue_unfinished()
+        self._worker = asyncio.create_task(self._run())
+
+    async def _queue_unfinished(self):
+        # Jobs another live worker holds are skipped when the claim fails
+        for job in await job_repository.find_unfinished():
+            self._queue.put_nowait(job["id"])
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def enqueue(self, job_type: str, target_id: str, job_id: Optional[str] = None) -> dict:
+        """Store and queue a job; enqueueing a given `job_id` again returns
+        the existing job instead"""
+        now = datetime.utcnow()
+        job = {
+            "id": job_id or str(uuid.uuid4()),
+            "type": job_type,
+            "target_id": target_id,
+            "status": QUEUED,
+            "processed": 0,
+            "total": await task_repository.count(TOTAL_QUERIES[job_type](target_id)),
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        try:
+            await job_repository.insert(job)
+        except DuplicateKeyError:
+            return await job_repository.get(job["id"])
+        self._queue.put_nowait(job["id"])
+        job.pop("_id", None)
+        return job
+
+    async def join(self):
+        """Wait until every queued job has finished"""
+        await self._queue.join()
+
+    async def _run(self):
+        while True:
+            try:
+                job_id = await asyncio.wait_for(self._queue.get(), timeout=self.lease_seconds)
+            except asyncio.TimeoutError:
+                await self._queue_unfinished()
+                continue
+            try:
+                await self._process(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _lease_until(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    async def _update(self, job: dict, **fields):
+        fields["updated_at"] = datetime.utcnow()
+        if fields.get("status", job["status"]) == RUNNING:
+            fields["lease_until"] = self._lease_until()
+        job.update(fields)
+        await job_repository.update(job["id"], fields)
+        event_bus.publish("job.updated", job)
+
+    async def _process(self, job_id: str):
+        job = await job_repository.claim(job_id, self.owner, self._lease_until())
+        if not job:
+            return
+        with tenant_scope(job.pop(TENANT_FIELD, None)):
+            event_bus.publish("job.updated", job)
+            handler = HANDLERS[job["type"]]
+            try:
+                while True:
+                    handled = await handler(job, self.batch_size)
+                    if not handled:
+                        break
+                    await self._update(job, processed=job["processed"] + handled)
+            except Exception as e:
+                await self._update(job, status=FAILED, error=str(e))
+                return
+            await self._update(job, status=COMPLETED)
+
+job_queue = JobQueue()
+
+async def recent_jobs(limit: int = 20) -> List[dict]:
+    return await job_repository.find_recent(limit)
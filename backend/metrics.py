@@ -0,0 +1,214 @@
+"""Request and MongoDB instrumentation exposed in Prometheus text format.
+
+`MetricsMiddleware` times every request per route template and counts the
+Mongo commands it issued, which `MongoCommandListener` attributes to the
+request through a context variable (Motor copies the context into its
+executor threads). Requests slower than SLOW_REQUEST_MS are logged with the
+shapes of their queries; set it to 0 to disable the log.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from pymongo import monitoring
+
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+# Long-lived or self-referential paths kept out of the latency histograms
+UNTIMED_PATHS = {"/api/events", "/api/metrics"}
+
+logger = logging.getLogger(__name__)
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+class MetricFamily:
+    """Histograms or counters of one metric name, keyed by label values"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...],
+                 buckets: Optional[Tuple[float, ...]] = None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values: Dict[tuple, object] = {}
+
+    def observe(self, label_values: tuple, value: float):
+        histogram = self.values.get(label_values)
+        if histogram is None:
+            histogram = self.values[label_values] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def inc(self, label_values: tuple, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        kind = "histogram" if self.buckets else "counter"
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {kind}"]
+        for label_values, value in sorted(self.values.items()):
+            labels = ",".join(
+                f'{label}="{_escape(str(v))}"' for label, v in zip(self.labels, label_values)
+            )
+            if self.buckets:
+                lines.extend(value.render(self.name, labels))
+            else:
+                lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_duration = MetricFamily(
+            "http_request_duration_seconds", "Request latency by route",
+            ("method", "route", "status"), LATENCY_BUCKETS)
+        self.request_commands = MetricFamily(
+            "http_request_mongo_commands", "Mongo commands issued per request",
+            ("method", "route"), COMMAND_COUNT_BUCKETS)
+        self.command_duration = MetricFamily(
+            "mongo_command_duration_seconds", "Mongo command latency",
+            ("command",), LATENCY_BUCKETS)
+        self.command_failures = MetricFamily(
+            "mongo_command_failures_total", "Failed Mongo commands", ("command",))
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, commands: int):
+        with self._lock:
+            self.request_duration.observe((method, route, str(status)), seconds)
+            self.request_commands.observe((method, route), commands)
+
+    def record_command(self, command: str, seconds: float, failed: bool = False):
+        with self._lock:
+            self.command_duration.observe((command,), seconds)
+            if failed:
+                self.command_failures.inc((command,))
+
+    def render(self) -> str:
+        with self._lock:
+            families = (self.request_duration, self.request_commands,
+                        self.command_duration, self.command_failures)
+            return "\n".join(line for family in families for line in family.render()) + "\n"
+
+metrics_registry = MetricsRegistry()
+
+class RequestTrace:
+    """Mongo activity of the request being served"""
+
+    def __init__(self):
+        self.commands = 0
+        self.command_seconds = 0.0
+        self.shapes = []
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    "request_trace", default=None)
+
+def _shape(value):
+    """Replace the literal values of a query with "?" to get its shape"""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_shape(value[0])] if value else []
+    return "?"
+
+def query_shape(command_name: str, command: dict) -> str:
+    collection = command.get(command_name)
+    if command_name == "aggregate":
+        body = [next(iter(stage), "?") for stage in command.get("pipeline", [])]
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or [{}]
+        body = _shape(statements[0].get("q", {}))
+    else:
+        body = _shape(command.get("filter", command.get("query", {})))
+    return f"{command_name} {collection} {json.dumps(body, ensure_ascii=False)}"
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Record every Mongo command globally and against the current request"""
+
+    def __init__(self, registry: MetricsRegistry = metrics_registry):
+        self.registry = registry
+
+    def started(self, event):
+        trace = _current_trace.get()
+        if trace is not None and SLOW_REQUEST_MS:
+            trace.shapes.append(query_shape(event.command_name, event.command))
+
+    def _finished(self, event, failed: bool):
+        seconds = event.duration_micros / 1_000_000
+        self.registry.record_command(event.command_name, seconds, failed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.commands += 1
+            trace.command_seconds += seconds
+
+    def succeeded(self, event):
+        self._finished(event, failed=False)
+
+    def failed(self, event):
+        self._finished(event, failed=True)
+
+command_listener = MongoCommandListener()
+
+class MetricsMiddleware:
+    """ASGI middleware timing requests per route template"""
+
+    def __init__(self, app, registry: MetricsRegistry = metrics_registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNTIMED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_trace.reset(token)
+            seconds = time.perf_counter() - started
+            # The router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.registry.record_request(scope["method"], route, status[0], seconds, trace.commands)
+            if SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS:
+                logger.warning(
+                    "Slow request %s %s: %.0fms, %d Mongo commands (%.0fms): %s",
+                    scope["method"], route, seconds * 1000, trace.commands,
+                    trace.command_seconds * 1000, "; ".join(trace.shapes) or "-",
+                )
@@ -0,0 +1,159 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Any
+from datetime import datetime, date
+import uuid
+from enum import Enum
+
+class Priority(str, Enum):
+    LOW = "کم"
+    MEDIUM = "متوسط"
+    HIGH = "بالا"
+
+class TaskStatus(str, Enum):
+    PENDING = "در انتظار"
+    COMPLETED = "تکمیل شده"
+    CANCELLED = "لغو شده"
+
+class RecurrenceFrequency(str, Enum):
+    DAILY = "daily"
+    WEEKLY = "weekly"
+    MONTHLY = "monthly"
+    # Same day of every Persian month, e.g. the 1st of each month
+    JALALI_MONTHLY = "jalali_monthly"
+
+# Pydantic models
+class RecurrenceRule(BaseModel):
+    frequency: RecurrenceFrequency
+    interval: int = Field(1, ge=1, le=365)
+    # Weekly: days of the week, 0 = Saturday ... 6 = Friday
+    weekdays: List[int] = []
+    # Monthly: day of the (Gregorian or Jalali) month, clamped to its length
+    month_day: Optional[int] = Field(None, ge=1, le=31)
+    until: Optional[date] = None
+    count: Optional[int] = Field(None, ge=1, le=1000)
+    # First occurrence; defaults to the task's due date
+    start: Optional[date] = None
+
+class TagMatch(str, Enum):
+    ANY = "any"
+    ALL = "all"
+
+class TaskModel(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    title: str
+    description: Optional[str] = None
+    priority: Priority = Priority.MEDIUM
+    status: TaskStatus = TaskStatus.PENDING
+    due_date: Optional[date] = None
+    due_time: Optional[str] = None
+    list_id: Optional[str] = None
+    tags: List[str] = []
+    subtasks: List[Dict[str, Any]] = []
+    subtask_total: int = 0
+    subtask_done: int = 0
+    recurrence: Optional[RecurrenceRule] = None
+    series_id: Optional[str] = None
+    occurrence: Optional[int] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    completed_at: Optional[datetime] = None
+
+class TaskCreate(BaseModel):
+    title: str
+    description: Optional[str] = None
+    priority: Priority = Priority.MEDIUM
+    due_date: Optional[date] = None
+    due_time: Optional[str] = None
+    list_id: Optional[str] = None
+    tags: List[str] = []
+    recurrence: Optional[RecurrenceRule] = None
+
+class TaskUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    priority: Optional[Priority] = None
+    status: Optional[TaskStatus] = None
+    due_date: Optional[date] = None
+    due_time: Optional[str] = None
+    list_id: Optional[str] = None
+    tags: Optional[List[str]] = None
+    # An explicit null stops the task recurring
+    recurrence: Optional[RecurrenceRule] = None
+
+    def to_update_data(self) -> Dict[str, Any]:
+        """Build the $set document for this update"""
+        update_data = {k: v for k, v in self.dict(exclude={"recurrence"}).items() if v is not None}
+        if "recurrence" in self.model_fields_set:
+            update_data["recurrence"] = self.recurrence.model_dump(mode="json") if self.recurrence else None
+        update_data["updated_at"] = datetime.utcnow()
+        
+        # Convert date to string if provided
+        if update_data.get("due_date"):
+            if isinstance(update_data["due_date"], date):
+                update_data["due_date"] = update_data["due_date"].isoformat()
+        
+        # Handle status change to completed
+        if update_data.get("status") == TaskStatus.COMPLETED:
+            update_data["completed_at"] = datetime.utcnow()
+        elif update_data.get("status") == TaskStatus.PENDING:
+            update_data["completed_at"] = None
+        return update_data
+
+class ListModel(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    color: str = "#3B82F6"
+    icon: str = "📋"
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    task_count: int = 0
+
+class ListCreate(BaseModel):
+    name: str
+    color: str = "#3B82F6"
+    icon: str = "📋"
+
+class TagModel(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    color: str = "#10B981"
+    task_count: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class TagCreate(BaseModel):
+    name: str
+    color: str = "#10B981"
+
+class SubtaskModel(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    title: str
+    completed: bool = False
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class BatchAction(str, Enum):
+    UPDATE = "update"
+    ADD_TAGS = "add_tags"
+    REMOVE_TAGS = "remove_tags"
+    DELETE = "delete"
+
+class TaskBatchOperation(BaseModel):
+    action: BatchAction
+    task_id: str
+    update: Optional[TaskUpdate] = None
+    tags: List[str] = []
+    # The task's updated_at as the client last saw it; the operation is
+    # rejected as a conflict if the task changed since
+    if_updated_at: Optional[datetime] = None
+
+class TaskBatchRequest(BaseModel):
+    operations: List[TaskBatchOperation] = Field(..., max_length=1000)
+    ordered: bool = True
+
+class SyncTaskCreate(TaskCreate):
+    # Chosen by the client, so pushing the same creation twice stores one task
+    id: str = Field(..., min_length=1, max_length=100)
+
+class SyncPushRequest(BaseModel):
+    """Edits a client queued while offline: tasks it created, then its
+    other changes, applied as an unordered batch"""
+    created: List[SyncTaskCreate] = Field([], max_length=1000)
+    operations: List[TaskBatchOperation] = Field([], max_length=1000)
@@ -0,0 +1,111 @@
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+from tenancy import current_tenant
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Keyset order shared by every paginated task query
+TASK_SORT = [("created_at", -1), ("id", -1)]
+
+# Fields a page always carries, since the next cursor is built from them
+CURSOR_FIELDS = ["id", "created_at"]
+
+def encode_cursor(task: dict) -> str:
+    """Encode the (created_at, id) position of the last task on a page.
+
+    Ranked search results also carry their `search_score`.
+    """
+    created_at = task["created_at"]
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    payload = {"created_at": created_at, "id": task["id"]}
+    if "search_score" in task:
+        payload["score"] = task["search_score"]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_cursor(cursor: str) -> dict:
+    """Decode a cursor into its created_at, id and optional score"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        position = {
+            "created_at": datetime.fromisoformat(payload["created_at"]),
+            "id": str(payload["id"]),
+        }
+        if "score" in payload:
+            position["score"] = int(payload["score"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="مکان‌نمای صفحه‌بندی نامعتبر است")
+    return position
+
+def after_cursor(position: dict) -> dict:
+    """Query clause selecting tasks after a decoded cursor position"""
+    return {"$or": [
+        {"created_at": {"$lt": position["created_at"]}},
+        {"created_at": position["created_at"], "id": {"$lt": position["id"]}},
+    ]}
+
+# expand= options: the task field each one joins on, and the aggregation
+# stages adding a {id, name, color} summary of the referenced documents
+# of a tenant
+EXPAND_SOURCE_FIELDS = {"tags": "tags", "list": "list_id"}
+
+def _live_summaries(source: str, tenant_id: Optional[str]) -> dict:
+    """Summaries of the joined documents that belong to the tenant and are
+    not soft-deleted"""
+    condition = {"$eq": [{"$ifNull": ["$$item.deleted_at", None]}, None]}
+    if tenant_id is not None:
+        # Joins match on id alone, which another tenant may have used too
+        condition = {"$and": [condition, {"$eq": ["$$item.tenant_id", tenant_id]}]}
+    return {"$map": {
+        "input": {"$filter": {"input": source, "as": "item", "cond": condition}},
+        "as": "item",
+        "in": {"id": "$$item.id", "name": "$$item.name", "color": "$$item.color"},
+    }}
+
+def _expand_tags(tenant_id: Optional[str]) -> List[dict]:
+    return [
+        {"$lookup": {"from": "tags", "localField": "tags", "foreignField": "id", "as": "tag_details"}},
+        {"$addFields": {"tag_details": _live_summaries("$tag_details", tenant_id)}},
+    ]
+
+def _expand_list(tenant_id: Optional[str]) -> List[dict]:
+    return [
+        {"$lookup": {"from": "lists", "localField": "list_id", "foreignField": "id", "as": "list"}},
+        {"$addFields": {"list": {"$let": {
+            "vars": {"found": _live_summaries("$list", tenant_id)},
+            "in": {"$cond": [{"$gt": [{"$size": "$$found"}, 0]},
+                             {"$arrayElemAt": ["$$found", 0]}, None]},
+        }}}},
+    ]
+
+EXPANSIONS = {"tags": _expand_tags, "list": _expand_list}
+
+def parse_expand(expand: Optional[str]) -> List[str]:
+    """Validate a comma separated `expand=` parameter"""
+    if not expand:
+        return []
+    requested = list(dict.fromkeys(e.strip() for e in expand.split(",") if e.strip()))
+    unknown = [e for e in requested if e not in EXPANSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"مقدار expand نامعتبر: {', '.join(unknown)}")
+    return requested
+
+def expand_stages(expand: List[str]) -> List[dict]:
+    tenant_id = current_tenant()
+    return [stage for name in expand for stage in EXPANSIONS[name](tenant_id)]
+
+def parse_fields(fields: Optional[str], allowed: List[str]) -> Optional[dict]:
+    """Turn a comma separated `fields=` parameter into a Mongo projection"""
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"فیلد نامعتبر: {', '.join(unknown)}")
+    return {"_id": 0, **{f: 1 for f in [*CURSOR_FIELDS, *requested]}}
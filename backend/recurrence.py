@@ -0,0 +1,255 @@
+"""Recurring tasks.
+
+A recurring task carries its rule in `recurrence` and only the current
+instance of a series is stored. Further occurrences are computed on
+demand for a date window (GET /api/calendar/occurrences), and completing
+an instance creates the next one, dated at the first occurrence after it
+that is not already in the past. Rules are anchored at their `start`
+date; weekly rules use Jalali weeks (Saturday = 0) and `jalali_monthly`
+rules repeat on a day of the Persian month.
+"""
+from calendar import monthrange
+from datetime import date, timedelta
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from jalali import calendar_service
+from models import RecurrenceFrequency, TaskCreate, TaskStatus
+from repository import task_repository
+from tasks import build_task, insert_task
+
+MAX_WINDOW_DAYS = 366
+MAX_OCCURRENCES = 2000
+
+# Fields a new instance copies from the one completed before it
+INSTANCE_FIELDS = ["title", "description", "priority", "due_time", "list_id", "tags", "recurrence"]
+
+def _value(field):
+    return getattr(field, "value", field)
+
+def jalali_weekday(day: date) -> int:
+    """Day of the week with Saturday = 0 ... Friday = 6"""
+    return (day.weekday() + 2) % 7
+
+def normalize_rule(rule: dict, start: date) -> dict:
+    """Fill a rule's defaults from its first occurrence so it no longer
+    depends on the task it was created with"""
+    rule = dict(rule)
+    rule_start = date.fromisoformat(rule["start"]) if rule.get("start") else start
+    rule["start"] = rule_start.isoformat()
+    frequency = rule["frequency"]
+    if frequency == RecurrenceFrequency.WEEKLY.value:
+        rule["weekdays"] = sorted(set(rule.get("weekdays") or [jalali_weekday(rule_start)]))
+    elif frequency == RecurrenceFrequency.MONTHLY.value and not rule.get("month_day"):
+        rule["month_day"] = rule_start.day
+    elif frequency == RecurrenceFrequency.JALALI_MONTHLY.value and not rule.get("month_day"):
+        rule["month_day"] = calendar_service.to_jalali(rule_start)[2]
+    return rule
+
+def _daily(rule: dict, start: date, since: date) -> Iterator[date]:
+    step = rule["interval"]
+    # Jump straight to the first period at or after `since`
+    periods = -(-(since - start).days // step)
+    day = start + timedelta(days=periods * step)
+    while True:
+        yield day
+        day += timedelta(days=step)
+
+def _weekly(rule: dict, start: date, since: date) -> Iterator[date]:
+    step = rule["interval"]
+    first_week = start - timedelta(days=jalali_weekday(start))
+    week = ((since - first_week).days // 7) // step * step
+    while True:
+        week_start = first_week + timedelta(weeks=week)
+        for weekday in rule["weekdays"]:
+            day = week_start + timedelta(days=weekday)
+            if day >= start:
+                yield day
+        week += step
+
+def _monthly(rule: dict, start: date, since: date) -> Iterator[date]:
+    step = rule["interval"]
+    first_month = start.year * 12 + start.month - 1
+    month = max(0, (since.year * 12 + since.month - 1 - first_month) // step * step)
+    while True:
+        year, index = divmod(first_month + month, 12)
+        if year > 9999:
+            return
+        day = date(year, index + 1, min(rule["month_day"], monthrange(year, index + 1)[1]))
+        if day >= start:
+            yield day
+        month += step
+
+def _jalali_monthly(rule: dict, start: date, since: date) -> Iterator[date]:
+    step = rule["interval"]
+    start_year, start_month, _ = calendar_service.to_jalali(start)
+    since_year, since_month, _ = calendar_service.to_jalali(since)
+    first_month = start_year * 12 + start_month - 1
+    month = max(0, (since_year * 12 + since_month - 1 - first_month) // step * step)
+    while True:
+        year, index = divmod(first_month + month, 12)
+        if year > 3000:
+            return
+        month_day = min(rule["month_day"], calendar_service.days_in_month(year, index + 1))
+        day = calendar_service.to_gregorian(year, index + 1, month_day)
+        if day >= start:
+            yield day
+        month += step
+
+GENERATORS = {
+    RecurrenceFrequency.DAILY.value: _daily,
+    RecurrenceFrequency.WEEKLY.value: _weekly,
+    RecurrenceFrequency.MONTHLY.value: _monthly,
+    RecurrenceFrequency.JALALI_MONTHLY.value: _jalali_monthly,
+}
+
+def iter_occurrences(rule: dict, since: Optional[date] = None) -> Iterator[date]:
+    """Occurrence dates of a normalized rule from `since` on, in order"""
+    start = date.fromisoformat(rule["start"])
+    until = date.fromisoformat(rule["until"]) if rule.get("until") else None
+    since = max(since or start, start)
+    for day in GENERATORS[rule["frequency"]](rule, start, since):
+        if until and day > until:
+            return
+        if day >= since:
+            yield day
+
+def next_instance(task: dict, today: Optional[date] = None) -> Optional[dict]:
+    """The task following a completed instance, or None when the series ended"""
+    rule = task["recurrence"]
+    occurrence = (task.get("occurrence") or 0) + 1
+    if rule.get("count") and occurrence >= rule["count"]:
+        return None
+    today = today or calendar_service.today()
+    after = date.fromisoformat(task["due_date"]) if task.get("due_date") else today
+    # Occurrences missed while the instance was overdue are skipped
+    since = max(after + timedelta(days=1), today)
+    due_date = next(iter_occurrences(rule, since), None)
+    if due_date is None:
+        return None
+    fields = {field: task.get(field) for field in INSTANCE_FIELDS}
+    fields.update(due_date=due_date, series_id=task.get("series_id") or task["id"], occurrence=occurrence)
+    return build_task(fields)
+
+def prepare_recurrence(task_dict: dict, current_due_date: Optional[str] = None):
+    """Normalize the rule of a task being created or updated in place.
+
+    Rules start at the task's due date (`current_due_date` for an update
+    that does not change it), and a recurring task without a due date
+    becomes due at its first occurrence. Raises ValueError for rules
+    without any occurrence.
+    """
+    rule = task_dict.get("recurrence")
+    if not rule:
+        return
+    due_date = task_dict.get("due_date") or current_due_date
+    if isinstance(due_date, str):
+        due_date = date.fromisoformat(due_date)
+    rule = normalize_rule(rule, due_date or calendar_service.today())
+    if rule.get("until") and rule["until"] < rule["start"]:
+        raise ValueError("تاریخ پایان تکرار نباید قبل از شروع آن باشد")
+    task_dict["recurrence"] = rule
+    if not due_date:
+        first = next(iter_occurrences(rule), None)
+        if first is None:
+            raise ValueError("قانون تکرار هیچ تاریخی ندارد")
+        task_dict["due_date"] = first.isoformat()
+
+def build_created_task(task: TaskCreate) -> dict:
+    """The document for a task a client created; a recurring one starts a
+    new series. Raises ValueError for an invalid recurrence rule."""
+    task_dict = task.dict(exclude={"recurrence"})
+    if task.recurrence:
+        task_dict["recurrence"] = task.recurrence.model_dump(mode="json")
+        prepare_recurrence(task_dict)
+    task_dict = build_task(task_dict)
+    if task.recurrence:
+        task_dict["series_id"] = task_dict["id"]
+        task_dict["occurrence"] = 0
+    return task_dict
+
+async def roll_completed(changes: List[Tuple[Optional[dict], Optional[dict]]]) -> List[dict]:
+    """Create the next instance of every recurring task that was completed.
+
+    Instances are unique per (series_id, occurrence), so completing the
+    same instance again after reopening it does not create another one.
+    """
+    created = []
+    completed = TaskStatus.COMPLETED.value
+    for before, after in changes:
+        if not after or not after.get("recurrence") or _value(after.get("status")) != completed:
+            continue
+        if before and _value(before.get("status")) == completed:
+            continue
+        task_dict = next_instance(after)
+        if task_dict is None:
+            continue
+        try:
+            task = await insert_task(task_dict)
+        except DuplicateKeyError:
+            continue
+        if task:
+            created.append(task)
+    return created
+
+async def occurrences_between(start: date, end: date, list_id: Optional[str] = None) -> List[dict]:
+    """Pending tasks due between `start` and `end`, including the future
+    occurrences of recurring series, computed without storing them"""
+    if end < start or (end - start).days > MAX_WINDOW_DAYS:
+        raise HTTPException(status_code=400, detail=f"بازه تاریخ باید حداکثر {MAX_WINDOW_DAYS} روز باشد")
+    first, last = start.isoformat(), end.isoformat()
+    query = {
+        "status": TaskStatus.PENDING,
+        "$or": [
+            {"due_date": {"$gte": first, "$lte": last}},
+            {"recurrence": {"$ne": None}, "due_date": {"$lte": last}},
+        ],
+    }
+    if list_id:
+        query["list_id"] = list_id
+    tasks = await task_repository.find(query)
+
+    occurrences = []
+    for task in tasks:
+        entry = {
+            "task_id": task["id"],
+            "series_id": task.get("series_id"),
+            "title": task["title"],
+            "priority": task.get("priority"),
+            "due_time": task.get("due_time"),
+            "list_id": task.get("list_id"),
+            "tags": task.get("tags", []),
+        }
+        for day, materialized in _window_dates(task, start, end):
+            occurrences.append({**entry, "date": day, "materialized": materialized})
+            if len(occurrences) >= MAX_OCCURRENCES:
+                return _by_date(occurrences)
+    return _by_date(occurrences)
+
+def _window_dates(task: dict, start: date, end: date) -> Iterator[Tuple[str, bool]]:
+    """(date, materialized) of a pending task's occurrences between `start` and `end`"""
+    rule = task.get("recurrence")
+    if not rule:
+        yield task["due_date"], True
+        return
+    due_date = date.fromisoformat(task["due_date"])
+    if rule.get("count"):
+        # Instances left after the stored one are counted from it, which
+        # walks at most the rule's (bounded) count
+        remaining = max(rule["count"] - (task.get("occurrence") or 0), 0)
+        days = islice(iter_occurrences(rule, due_date), remaining)
+    else:
+        # Other series start at the window, however old they are
+        days = iter_occurrences(rule, max(due_date, start))
+    for day in days:
+        if day > end:
+            return
+        if day >= start:
+            yield day.isoformat(), day == due_date
+
+def _by_date(occurrences: List[dict]) -> List[dict]:
+    occurrences.sort(key=lambda item: (item["date"], item["due_time"] or ""))
+    return occurrences
@@ -0,0 +1,325 @@
+"""Reminders for pending tasks at their due time.
+
+A task's reminder is due REMINDER_LEAD_MINUTES before its due_date and
+due_time in Tehran time (REMINDER_DEFAULT_TIME for tasks without a
+due_time). The scheduler keeps the reminders of the next
+REMINDER_HORIZON_HOURS in a heap, loaded with an indexed due_date range
+query and extended as time passes, and follows task changes through the
+event bus instead of rescanning: every change pushes the task's new
+reminder time and leaves its old heap entry to be skipped when popped.
+
+One heap serves every tenant, its entries keyed by tenant and task. Due
+reminders are checked against the stored task within its tenant's scope,
+recorded in the `reminders` collection so each is sent once even with
+several worker processes, and handed to the sinks named in REMINDER_SINKS:
+
+    log      log a line per reminder
+    sse      publish a "reminder.due" event to the tenant's /api/events subscribers
+    webhook  POST the reminder as JSON to REMINDER_WEBHOOK_URL
+
+The time up to which reminders were handled is persisted, so after a
+restart reminders that fell due meanwhile (at most REMINDER_CATCHUP_HOURS
+back) are still sent.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+import urllib.request
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from events import event_bus
+from jalali import TEHRAN
+from models import TaskStatus
+from repository import task_repository, reminder_repository
+from tenancy import DEFAULT_TENANT, TENANT_FIELD, current_tenant, tenant_scope
+
+logger = logging.getLogger(__name__)
+
+REMINDER_SINKS = os.environ.get('REMINDER_SINKS', 'sse')
+REMINDER_WEBHOOK_URL = os.environ.get('REMINDER_WEBHOOK_URL', '')
+REMINDER_LEAD_MINUTES = float(os.environ.get('REMINDER_LEAD_MINUTES', '0'))
+REMINDER_DEFAULT_TIME = os.environ.get('REMINDER_DEFAULT_TIME', '09:00')
+REMINDER_HORIZON_HOURS = float(os.environ.get('REMINDER_HORIZON_HOURS', '48'))
+REMINDER_CATCHUP_HOURS = float(os.environ.get('REMINDER_CATCHUP_HOURS', '24'))
+
+# Longest the scheduler sleeps without re-checking its heap
+MAX_SLEEP_SECONDS = 60
+DISPATCH_BATCH_SIZE = 500
+
+# (tenant id, task id) of a scheduled reminder
+ReminderKey = Tuple[str, str]
+
+def _parse_time(value: Optional[str]) -> Optional[time]:
+    try:
+        hour, minute = (value or "").split(":")[:2]
+        return time(int(hour), int(minute))
+    except ValueError:
+        return None
+
+def reminder_time(task: dict) -> Optional[datetime]:
+    """When a task's reminder is due, as naive UTC, or None without a due date"""
+    due_date = task.get("due_date")
+    if not due_date:
+        return None
+    if isinstance(due_date, str):
+        try:
+            due_date = date.fromisoformat(due_date)
+        except ValueError:
+            return None
+    due_time = _parse_time(task.get("due_time")) or _parse_time(REMINDER_DEFAULT_TIME) or time(9)
+    due_at = datetime.combine(due_date, due_time, TEHRAN) - timedelta(minutes=REMINDER_LEAD_MINUTES)
+    return due_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+def _tehran_date(moment: datetime) -> str:
+    return moment.replace(tzinfo=timezone.utc).astimezone(TEHRAN).date().isoformat()
+
+def _is_pending(task: dict) -> bool:
+    return getattr(task.get("status"), "value", task.get("status")) == TaskStatus.PENDING.value
+
+class LogSink:
+    async def send(self, reminder: dict):
+        logger.info("Reminder for task %s of %s (%s) due at %s", reminder["task_id"],
+                    reminder[TENANT_FIELD], reminder["title"], reminder["remind_at"])
+
+class EventSink:
+    async def send(self, reminder: dict):
+        event_bus.publish("reminder.due", reminder)
+
+class WebhookSink:
+    def __init__(self, url: str, timeout: float = 5):
+        self.url = url
+        self.timeout = timeout
+
+    def _post(self, body: bytes):
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    async def send(self, reminder: dict):
+        await asyncio.to_thread(self._post, json.dumps(reminder, ensure_ascii=False).encode())
+
+def build_sinks(spec: str = REMINDER_SINKS) -> list:
+    sinks = []
+    for name in (name.strip() for name in spec.split(",")):
+        if name == "log":
+            sinks.append(LogSink())
+        elif name == "sse":
+            sinks.append(EventSink())
+        elif name == "webhook" and REMINDER_WEBHOOK_URL:
+            sinks.append(WebhookSink(REMINDER_WEBHOOK_URL))
+        elif name:
+            logger.warning("Ignoring unknown or unconfigured reminder sink %r", name)
+    return sinks
+
+class ReminderScheduler:
+    """Heap of upcoming reminders, kept current from task change events"""
+
+    def __init__(self, sinks: Optional[list] = None, horizon_hours: float = REMINDER_HORIZON_HOURS,
+                 catchup_hours: float = REMINDER_CATCHUP_HOURS):
+        self.sinks = build_sinks() if sinks is None else sinks
+        self.horizon = timedelta(hours=horizon_hours)
+        self.catchup = timedelta(hours=catchup_hours)
+        # (reminder time, key); entries no longer in _scheduled are stale
+        self._heap: List[Tuple[datetime, ReminderKey]] = []
+        self._scheduled: Dict[ReminderKey, datetime] = {}
+        # Tenant -> {task id: reminder time}, so a tenant's listing only
+        # reads its own reminders
+        self._by_tenant: Dict[str, Dict[str, datetime]] = {}
+        # Reminders after this time are not loaded yet
+        self._loaded_until: Optional[datetime] = None
+        self._reload = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not self.sinks:
+            return
+        self._wakeup = asyncio.Event()
+        now = datetime.utcnow()
+        cursor = await reminder_repository.get_cursor()
+        await self._load(max(cursor, now - self.catchup) if cursor else now, now + self.horizon)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._loaded_until = None
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
+
+    def schedule(self, tenant_id: str, task: dict):
+        """Set (or clear) a task's reminder after it changed"""
+        key = (tenant_id, task["id"])
+        remind_at = reminder_time(task) if _is_pending(task) else None
+        if (remind_at is None or remind_at <= datetime.utcnow()
+                or self._loaded_until is None or remind_at > self._loaded_until):
+            # Past reminders are not sent for edits; later ones are loaded
+            # when the horizon reaches them
+            self.cancel(tenant_id, task["id"])
+            return
+        if self._scheduled.get(key) == remind_at:
+            return
+        self._push(key, remind_at)
+        if self._heap[0] == (remind_at, key):
+            self._wakeup.set()
+
+    def cancel(self, tenant_id: str, task_id: str):
+        # The heap entry is dropped when it reaches the top
+        self._unset((tenant_id, task_id))
+
+    def _tenant_entries(self) -> Iterable[Tuple[str, datetime]]:
+        """(task id, reminder time) of the current tenant's reminders, or
+        of every tenant's outside a tenant's scope"""
+        tenant_id = current_tenant()
+        if tenant_id is None:
+            return [(task_id, remind_at) for (_, task_id), remind_at in self._scheduled.items()]
+        return self._by_tenant.get(tenant_id, {}).items()
+
+    def count(self) -> int:
+        """Number of reminders scheduled for the current tenant"""
+        tenant_id = current_tenant()
+        return len(self._scheduled) if tenant_id is None else len(self._by_tenant.get(tenant_id, {}))
+
+    def upcoming(self, limit: int) -> List[dict]:
+        """The current tenant's next `limit` scheduled reminders"""
+        entries = heapq.nsmallest(limit, self._tenant_entries(), key=lambda item: (item[1], item[0]))
+        return [{"task_id": task_id, "remind_at": remind_at} for task_id, remind_at in entries]
+
+    def on_event(self, event: dict):
+        """EventBus listener applying task changes to the heap"""
+        if self._loaded_until is None:
+            return
+        event_type, data = event["type"], event.get("data")
+        tenant_id = event.get(TENANT_FIELD) or DEFAULT_TENANT
+        if event_type in ("task.created", "task.updated"):
+            self.schedule(tenant_id, data)
+        elif event_type == "task.deleted":
+            self.cancel(tenant_id, data["id"])
+        elif event_type == "tasks.batch":
+            for task in data["updated"]:
+                self.schedule(tenant_id, task)
+            for task_id in data["deleted"]:
+                self.cancel(tenant_id, task_id)
+        elif event_type == "resync":
+            # Imports change tasks without per-task events
+            self._reload = True
+            self._wakeup.set()
+
+    def _set(self, key: ReminderKey, remind_at: datetime):
+        self._scheduled[key] = remind_at
+        self._by_tenant.setdefault(key[0], {})[key[1]] = remind_at
+
+    def _unset(self, key: ReminderKey):
+        if self._scheduled.pop(key, None) is None:
+            return
+        tenant_reminders = self._by_tenant[key[0]]
+        del tenant_reminders[key[1]]
+        if not tenant_reminders:
+            del self._by_tenant[key[0]]
+
+    def _push(self, key: ReminderKey, remind_at: datetime):
+        self._set(key, remind_at)
+        heapq.heappush(self._heap, (remind_at, key))
+        if len(self._heap) > 2 * len(self._scheduled) + 1024:
+            # Too many stale entries; rebuild from the live ones
+            self._heap = [(at, entry_key) for entry_key, at in self._scheduled.items()]
+            heapq.heapify(self._heap)
+
+    async def _load(self, start: datetime, end: datetime):
+        """Schedule the reminders due from `start` up to `end`"""
+        # Every tenant's, read with one query on the due date index; a
+        # reminder can only fall in the window if its due date does
+        lead = timedelta(minutes=REMINDER_LEAD_MINUTES)
+        query = {
+            "status": TaskStatus.PENDING.value,
+            "due_date": {"$gte": _tehran_date(start + lead), "$lte": _tehran_date(end + lead)},
+        }
+        async for task in task_repository.iter_due(query):
+            remind_at = reminder_time(task)
+            # Inclusive, since the persisted cursor may be the time of a
+            # reminder that was not sent yet; sent ones are skipped on claim
+            if remind_at is not None and start <= remind_at <= end:
+                self._push((task.get(TENANT_FIELD) or DEFAULT_TENANT, task["id"]), remind_at)
+        self._loaded_until = end
+
+    def _pop_due(self, now: datetime) -> List[Tuple[datetime, ReminderKey]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < DISPATCH_BATCH_SIZE:
+            remind_at, key = heapq.heappop(self._heap)
+            if self._scheduled.get(key) == remind_at:
+                self._unset(key)
+                due.append((remind_at, key))
+        return due
+
+    async def _dispatch(self, due: List[Tuple[datetime, ReminderKey]]):
+        by_tenant: Dict[str, List[Tuple[datetime, str]]] = {}
+        for remind_at, (tenant_id, task_id) in due:
+            by_tenant.setdefault(tenant_id, []).append((remind_at, task_id))
+        for tenant_id, tenant_due in by_tenant.items():
+            with tenant_scope(tenant_id):
+                await self._dispatch_tenant(tenant_id, tenant_due)
+        await reminder_repository.advance_cursor(due[-1][0])
+
+    async def _dispatch_tenant(self, tenant_id: str, due: List[Tuple[datetime, str]]):
+        tasks = {task["id"]: task for task in await task_repository.find_by_ids([task_id for _, task_id in due])}
+        for remind_at, task_id in due:
+            task = tasks.get(task_id)
+            # Changed in another worker process since it was scheduled here
+            if not task or not _is_pending(task) or reminder_time(task) != remind_at:
+                continue
+            if not await reminder_repository.claim(f"{tenant_id}:{task_id}@{remind_at.isoformat()}", task_id):
+                continue
+            reminder = {
+                "task_id": task_id,
+                TENANT_FIELD: tenant_id,
+                "title": task["title"],
+                "due_date": task.get("due_date"),
+                "due_time": task.get("due_time"),
+                "list_id": task.get("list_id"),
+                "remind_at": remind_at.isoformat(),
+            }
+            for sink in self.sinks:
+                try:
+                    await sink.send(reminder)
+                except Exception:
+                    logger.exception("Sending reminder for task %s through %s failed",
+                                     task_id, type(sink).__name__)
+
+    async def _run(self):
+        while True:
+            try:
+                now = datetime.utcnow()
+                if self._reload:
+                    self._reload = False
+                    self._heap, self._scheduled, self._by_tenant = [], {}, {}
+                    await self._load(now, now + self.horizon)
+                elif now + self.horizon / 2 >= self._loaded_until:
+                    await self._load(self._loaded_until, now + self.horizon)
+                due = self._pop_due(now)
+                if due:
+                    await self._dispatch(due)
+                    continue
+                sleep = MAX_SLEEP_SECONDS
+                if self._heap:
+                    sleep = min(sleep, (self._heap[0][0] - now).total_seconds())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(sleep, 0))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Reminder scheduling failed")
+                await asyncio.sleep(MAX_SLEEP_SECONDS)
+
+reminder_scheduler = ReminderScheduler()
@@ -0,0 +1,872 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import DeleteOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from database import (
+    tasks_collection, lists_collection, tags_collection, counters_collection,
+    subtasks_collection, jobs_collection, settings_collection, tombstones_collection,
+    tasks_archive_collection, reminders_collection,
+)
+from pagination import TASK_SORT
+from search import SEARCH_FIELDS
+from tenancy import TENANT_FIELD, owned, scoped, scoped_pipeline, tenant_key
+
+# Change sequence number of a document's last write, read only by GET /api/sync
+SEQUENCE_FIELD = "seq"
+
+# Internal fields never shipped to clients
+HIDDEN_TASK_FIELDS = {"_id": 0, SEQUENCE_FIELD: 0, TENANT_FIELD: 0, **{field: 0 for field in SEARCH_FIELDS}}
+
+# Denormalized checklist progress kept on every task
+SUBTASK_COUNTERS = {"_id": 0, "subtask_total": 1, "subtask_done": 1}
+
+class ChangeSequence:
+    """Monotonic sequence stamped as `seq` on every task, list and tag write.
+
+    Numbers come from a counter document in the settings collection. A
+    write holds its numbers until it completes, and `ceiling()` tells
+    GET /api/sync not to hand out a cursor past a change this process is
+    still writing. Writes in progress in other worker processes are not
+    visible here.
+    """
+
+    def __init__(self, collection=settings_collection, sequence_id: str = "change_sequence"):
+        self.collection = collection
+        self.sequence_id = sequence_id
+        self._in_flight: List[List[int]] = []
+        self._high_water = 0
+
+    async def allocate(self, count: int = 1) -> int:
+        """Take `count` consecutive numbers and return the first"""
+        previous = await self.collection.find_one_and_update(
+            {"_id": self.sequence_id},
+            {"$inc": {"value": count}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        return (previous or {}).get("value", 0) + 1
+
+    async def current(self) -> int:
+        """The last number handed out"""
+        document = await self.collection.find_one({"_id": self.sequence_id})
+        return document.get("value", 0) if document else 0
+
+    @asynccontextmanager
+    async def reserve(self, count: int = 1):
+        """Allocate numbers for a write in progress, yielding the first"""
+        # Until they are known, the numbers are at least the next one this
+        # process has not handed out yet
+        marker = [self._high_water + 1]
+        self._in_flight.append(marker)
+        try:
+            first = await self.allocate(count)
+            marker[0] = first
+            self._high_water = max(self._high_water, first + count - 1)
+            yield first
+        finally:
+            self._in_flight.remove(marker)
+
+    def ceiling(self) -> Optional[int]:
+        """Lowest number a write in progress may stamp"""
+        return min(marker[0] for marker in self._in_flight) if self._in_flight else None
+
+change_sequence = ChangeSequence()
+
+def changed_since(since: int, ceiling: Optional[int]) -> dict:
+    """Filter matching documents written after change `since` and before `ceiling`"""
+    seq_range = {"$gt": since}
+    if ceiling is not None:
+        seq_range["$lt"] = ceiling
+    return {SEQUENCE_FIELD: seq_range}
+
+def stamped(update: dict, seq: int) -> dict:
+    """An update document that also records the change's sequence number"""
+    return {**update, "$set": {**update.get("$set", {}), SEQUENCE_FIELD: seq}}
+
+class BaseRepository:
+    """Operations shared by every collection keyed by a custom `id`.
+
+    Documents belong to a tenant: every filter is scoped to the current
+    tenant and inserted documents are stamped with it (see tenancy.py).
+    """
+
+    # Projection applied when streaming documents out of the collection
+    export_projection = {"_id": 0, SEQUENCE_FIELD: 0, TENANT_FIELD: 0}
+
+    # Sync name of the collection's documents, None if not synced
+    kind: Optional[str] = None
+
+    # Filter excluding documents that are soft-deleted and awaiting cleanup
+    live_filter: dict = {}
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def iter_all(self, batch_size: int = 1000):
+        """Async cursor over every document, fetched in batches"""
+        cursor = self.collection.find(scoped(self.live_filter), self.export_projection)
+        cursor.batch_size(batch_size)
+        return cursor
+
+    async def upsert_many(self, documents: List[dict]) -> int:
+        """Insert or replace documents by `id` in one bulk write"""
+        if not documents:
+            return 0
+        if self.kind is None:
+            return await self._replace_many(documents)
+        async with change_sequence.reserve(len(documents)) as first:
+            return await self._replace_many([
+                {**doc, SEQUENCE_FIELD: first + index} for index, doc in enumerate(documents)
+            ])
+
+    async def _replace_many(self, documents: List[dict]) -> int:
+        result = await self.collection.bulk_write(
+            [ReplaceOne(scoped({"id": doc["id"]}), owned(doc), upsert=True) for doc in documents],
+            ordered=False
+        )
+        return result.upserted_count + result.matched_count
+
+    async def find_changed(self, since: int, ceiling: Optional[int], limit: int) -> List[dict]:
+        """Documents written after change `since` (and before `ceiling`), oldest change first"""
+        projection = {field: 0 for field in self.export_projection if field != SEQUENCE_FIELD}
+        cursor = self.collection.find(scoped({**changed_since(since, ceiling), **self.live_filter}), projection)
+        return await cursor.sort(SEQUENCE_FIELD, 1).limit(limit).to_list(length=None)
+
+    async def find_unsequenced_ids(self, limit: int) -> List[str]:
+        """Ids of documents written before change sequences existed"""
+        cursor = self.collection.find(scoped({SEQUENCE_FIELD: None}), {"_id": 0, "id": 1}).limit(limit)
+        return [doc["id"] async for doc in cursor]
+
+    async def set_sequences(self, ids: List[str]):
+        """Stamp every document in `ids` with a change sequence number of its own"""
+        if ids:
+            async with change_sequence.reserve(len(ids)) as first:
+                await self.collection.bulk_write([
+                    UpdateOne(scoped({"id": doc_id}), {"$set": {SEQUENCE_FIELD: first + index}})
+                    for index, doc_id in enumerate(ids)
+                ], ordered=False)
+
+    async def find_tenants(self) -> List[str]:
+        """Ids of the tenants owning documents in the collection"""
+        # Sorted first, so the tenant-prefixed indexes answer it
+        cursor = self.collection.aggregate([
+            {"$sort": {TENANT_FIELD: 1}},
+            {"$group": {"_id": f"${TENANT_FIELD}"}},
+        ])
+        return sorted([group["_id"] async for group in cursor if group["_id"] is not None])
+
+class TaskRepository(BaseRepository):
+    """Async data access for tasks and their embedded subtasks"""
+
+    export_projection = HIDDEN_TASK_FIELDS
+    kind = "task"
+
+    def __init__(self, collection=tasks_collection):
+        super().__init__(collection)
+
+    async def find(self, query: dict, limit: int = 0) -> List[dict]:
+        cursor = self.collection.find(scoped(query), HIDDEN_TASK_FIELDS).sort(TASK_SORT)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(length=None)
+
+    async def find_page(self, query: dict, limit: int, projection: Optional[dict] = None,
+                        expand_stages: Optional[List[dict]] = None) -> List[dict]:
+        """Return up to `limit` tasks in keyset (created_at, id) order.
+
+        `expand_stages` are appended after the page is selected, so joins
+        only run for the returned tasks.
+        """
+        if expand_stages:
+            return await self.aggregate([
+                {"$match": query},
+                {"$sort": dict(TASK_SORT)},
+                {"$limit": limit},
+                {"$project": projection or HIDDEN_TASK_FIELDS},
+                *expand_stages,
+            ])
+        cursor = self.collection.find(scoped(query), projection or HIDDEN_TASK_FIELDS)
+        cursor = cursor.sort(TASK_SORT).limit(limit)
+        return await cursor.to_list(length=None)
+
+    async def find_documents(self, query: dict, limit: int = 0) -> List[dict]:
+        """Stored tasks with their search fields and tenant, e.g. to copy them elsewhere"""
+        cursor = self.collection.find(scoped(query), {"_id": 0, SEQUENCE_FIELD: 0}).limit(limit)
+        return await cursor.to_list(length=None)
+
+    def iter_due(self, query: dict, batch_size: int = 1000):
+        """Async cursor over the due date fields and tenants of matching tasks"""
+        cursor = self.collection.find(scoped(query), {
+            "_id": 0, "id": 1, TENANT_FIELD: 1, "status": 1, "due_date": 1, "due_time": 1,
+        })
+        cursor.batch_size(batch_size)
+        return cursor
+
+    async def search(self, pipeline: List[dict]) -> List[dict]:
+        return await self.aggregate(pipeline)
+
+    async def get(self, task_id: str) -> Optional[dict]:
+        return await self.collection.find_one(scoped({"id": task_id}), HIDDEN_TASK_FIELDS)
+
+    async def find_by_ids(self, task_ids: List[str]) -> List[dict]:
+        cursor = self.collection.find(scoped({"id": {"$in": task_ids}}), HIDDEN_TASK_FIELDS)
+        return await cursor.to_list(length=None)
+
+    async def count(self, query: dict) -> int:
+        return await self.collection.count_documents(scoped(query))
+
+    async def apply_writes(self, writes: List[Tuple[dict, Optional[dict]]],
+                           ordered: bool = True) -> Tuple[Dict[int, str], List[int]]:
+        """Apply (filter, update) writes in one bulk write; a None update
+        deletes the task. Filters select a task by `id`, optionally with
+        further conditions that apply to its first write. Later writes to
+        the same task only apply if the previous one did.
+
+        Returns the write errors by position and the positions of writes
+        whose filter matched no task.
+        """
+        failed: Dict[int, str] = {}
+        async with change_sequence.reserve(len(writes)) as first:
+            operations = []
+            previous: Dict[str, int] = {}
+            for index, (task_filter, update) in enumerate(writes):
+                task_id = task_filter["id"]
+                if task_id in previous:
+                    task_filter = {"id": task_id, SEQUENCE_FIELD: previous[task_id]}
+                previous[task_id] = first + index
+                task_filter = scoped(task_filter)
+                operations.append(DeleteOne(task_filter) if update is None
+                                  else UpdateOne(task_filter, stamped(update, first + index)))
+            try:
+                result = await self.collection.bulk_write(operations, ordered=ordered)
+                applied = result.matched_count + result.deleted_count
+            except BulkWriteError as e:
+                failed = {error["index"]: error.get("errmsg", "") for error in e.details["writeErrors"]}
+                applied = e.details.get("nMatched", 0) + e.details.get("nRemoved", 0)
+            if ordered and failed:
+                # An ordered bulk write stops at its first error
+                failed.update({position: "" for position in range(min(failed), len(writes))
+                               if position not in failed})
+            unmatched = []
+            if applied < len(writes) - len(failed):
+                unmatched = await self._unmatched_writes(writes, failed, first)
+            deleted = [
+                (task_filter["id"], first + index)
+                for index, (task_filter, update) in enumerate(writes)
+                if update is None and index not in failed and index not in unmatched
+            ]
+            await tombstone_repository.record(self.kind, deleted)
+        return failed, unmatched
+
+    async def _unmatched_writes(self, writes: List[Tuple[dict, Optional[dict]]],
+                                failed: Dict[int, str], first: int) -> List[int]:
+        # Writes to a task are chained, so an update matched if its task
+        # carries one of this bulk write's sequence numbers from the
+        # update's position on, or was deleted by a later write; a delete
+        # matched if its task is gone
+        cursor = self.collection.find(
+            scoped({"id": {"$in": list({task_filter["id"] for task_filter, _ in writes})}}),
+            {"_id": 0, "id": 1, SEQUENCE_FIELD: 1}
+        )
+        stored = {doc["id"]: doc.get(SEQUENCE_FIELD) or 0 async for doc in cursor}
+        last = first + len(writes)
+        deleted_by = {
+            task_filter["id"]: index for index, (task_filter, update) in enumerate(writes)
+            if update is None and index not in failed
+        }
+        unmatched = []
+        for index, (task_filter, update) in enumerate(writes):
+            if index in failed:
+                continue
+            seq = stored.get(task_filter["id"])
+            if update is None:
+                matched = seq is None or first <= seq < last
+            elif seq is None:
+                matched = deleted_by.get(task_filter["id"], -1) > index
+            else:
+                matched = first + index <= seq < last
+            if not matched:
+                unmatched.append(index)
+        return unmatched
+
+    async def insert(self, task_dict: dict, session=None) -> bool:
+        async with change_sequence.reserve() as seq:
+            task_dict[SEQUENCE_FIELD] = seq
+            result = await self.collection.insert_one(owned(task_dict), session=session)
+        return result.inserted_id is not None
+
+    async def update(self, task_id: str, update_data: dict, session=None) -> Optional[dict]:
+        """Apply update_data and return the task as it was before the update"""
+        async with change_sequence.reserve() as seq:
+            return await self.collection.find_one_and_update(
+                scoped({"id": task_id}),
+                stamped({"$set": update_data}, seq),
+                projection=HIDDEN_TASK_FIELDS,
+                return_document=ReturnDocument.BEFORE,
+                session=session
+            )
+
+    async def update_search_fields(self, task_id: str, fields: dict):
+        await self.collection.update_one(scoped({"id": task_id}), {"$set": fields})
+
+    async def delete(self, task_id: str, session=None) -> Optional[dict]:
+        """Delete a task and return the removed document"""
+        async with change_sequence.reserve() as seq:
+            task = await self.collection.find_one_and_delete(
+                scoped({"id": task_id}), projection=HIDDEN_TASK_FIELDS, session=session
+            )
+            if task:
+                await tombstone_repository.record(self.kind, [(task_id, seq)], session=session)
+        return task
+
+    async def aggregate(self, pipeline: List[dict]) -> List[dict]:
+        return await self.collection.aggregate(scoped_pipeline(pipeline)).to_list(length=None)
+
+    async def count_by_owner(self) -> Dict[str, Dict[str, int]]:
+        """Number of tasks in every list and carrying every tag, in one aggregation"""
+        result = await self.aggregate([
+            {"$facet": {
+                "lists": [
+                    {"$match": {"list_id": {"$ne": None}}},
+                    {"$group": {"_id": "$list_id", "count": {"$sum": 1}}},
+                ],
+                "tags": [
+                    {"$unwind": "$tags"},
+                    {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+                ],
+            }},
+        ])
+        facets = result[0] if result else {}
+        return {
+            name: {group["_id"]: group["count"] for group in facets.get(name, [])}
+            for name in ("lists", "tags")
+        }
+
+    async def count_by_list(self, list_ids: List[str]) -> Dict[str, int]:
+        """Number of tasks in each of the given lists"""
+        groups = await self.aggregate([
+            {"$match": {"list_id": {"$in": list_ids}}},
+            {"$group": {"_id": "$list_id", "count": {"$sum": 1}}},
+        ])
+        counts = {list_id: 0 for list_id in list_ids}
+        counts.update({group["_id"]: group["count"] for group in groups})
+        return counts
+
+    async def count_by_tag(self, query: dict) -> Dict[str, int]:
+        """Number of tasks matching `query` carrying each tag"""
+        groups = await self.aggregate([
+            {"$match": query},
+            {"$unwind": "$tags"},
+            {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+        ])
+        return {group["_id"]: group["count"] for group in groups}
+
+    async def find_ids(self, query: dict, limit: int = 0) -> List[str]:
+        cursor = self.collection.find(scoped(query), {"_id": 0, "id": 1}).limit(limit)
+        return [task["id"] async for task in cursor]
+
+    async def delete_many(self, task_ids: List[str]) -> int:
+        return len(await self.delete_matching(task_ids, {}))
+
+    async def delete_matching(self, task_ids: List[str], condition: dict, **tombstone_fields) -> List[str]:
+        """Delete the given tasks that still match `condition` and return
+        the ids this call deleted; `tombstone_fields` are stored on their
+        tombstones"""
+        removed = await self.remove_matching(task_ids, condition, {"_id": 0, "id": 1}, **tombstone_fields)
+        return [task["id"] for task in removed]
+
+    async def remove_matching(self, task_ids: List[str], condition: dict,
+                              projection: Optional[dict] = None, **tombstone_fields) -> List[dict]:
+        """Like delete_matching, returning the deleted tasks themselves"""
+        if not task_ids:
+            return []
+        async with change_sequence.reserve(len(task_ids)) as first:
+            # One delete per task, so each deleted task is reported by
+            # exactly one of several concurrent callers, and only deleted
+            # tasks get a tombstone
+            removed = await asyncio.gather(*[
+                self.collection.find_one_and_delete(scoped({**condition, "id": task_id}),
+                                                    projection=projection or HIDDEN_TASK_FIELDS)
+                for task_id in task_ids
+            ])
+            deleted = [task for task in removed if task]
+            await tombstone_repository.record(
+                self.kind, [(task["id"], first + index) for index, task in enumerate(deleted)],
+                **tombstone_fields
+            )
+        return deleted
+
+    async def pull_tag(self, task_ids: List[str], tag_id: str) -> int:
+        """Remove a tag id from the given tasks"""
+        if not task_ids:
+            return 0
+        async with change_sequence.reserve(len(task_ids)) as first:
+            result = await self.collection.bulk_write([
+                UpdateOne(scoped({"id": task_id, "tags": tag_id}),
+                          stamped({"$pull": {"tags": tag_id}}, first + index))
+                for index, task_id in enumerate(task_ids)
+            ], ordered=False)
+        return result.modified_count
+
+    async def get_subtask_counters(self, task_id: str) -> Optional[dict]:
+        return await self.collection.find_one(scoped({"id": task_id}), SUBTASK_COUNTERS)
+
+    async def increment_subtask_counters(self, task_id: str, total: int, done: int) -> Optional[dict]:
+        """Atomically adjust a task's subtask counters and return their new values"""
+        async with change_sequence.reserve() as seq:
+            return await self.collection.find_one_and_update(
+                scoped({"id": task_id}),
+                stamped({"$inc": {"subtask_total": total, "subtask_done": done}}, seq),
+                projection=SUBTASK_COUNTERS,
+                return_document=ReturnDocument.AFTER
+            )
+
+    async def find_subtask_counters(self, task_ids: List[str], with_subtask_ids: bool = False) -> Dict[str, dict]:
+        """Subtask counters of many tasks keyed by task id, optionally with
+        the ids of their embedded subtasks"""
+        projection = {**SUBTASK_COUNTERS, "id": 1}
+        if with_subtask_ids:
+            projection["subtasks.id"] = 1
+        cursor = self.collection.find(scoped({"id": {"$in": task_ids}}), projection)
+        return {task.pop("id"): task async for task in cursor}
+
+    async def increment_subtask_counters_many(self, deltas: Dict[str, tuple]):
+        """Adjust the (total, done) subtask counters of many tasks"""
+        deltas = {task_id: delta for task_id, delta in deltas.items() if any(delta)}
+        if deltas:
+            async with change_sequence.reserve(len(deltas)) as first:
+                await self.collection.bulk_write([
+                    UpdateOne(scoped({"id": task_id}), stamped(
+                        {"$inc": {"subtask_total": total, "subtask_done": done}}, first + index))
+                    for index, (task_id, (total, done)) in enumerate(deltas.items())
+                ], ordered=False)
+
+    async def set_subtask_counters(self, counters: Dict[str, tuple]):
+        """Store (total, done) subtask counters for many tasks"""
+        if counters:
+            await self.collection.bulk_write([
+                UpdateOne(scoped({"id": task_id}), {"$set": {"subtask_total": total, "subtask_done": done}})
+                for task_id, (total, done) in counters.items()
+            ], ordered=False)
+
+    # Embedded subtasks: each change updates the array and the counters in
+    # one atomic update and returns the new counters, or None if not found.
+    # The element filters no longer match once applied, so the new counters
+    # are derived from the document as it was before the update.
+
+    async def add_subtask(self, task_id: str, subtask_dict: dict) -> Optional[dict]:
+        async with change_sequence.reserve() as seq:
+            return await self.collection.find_one_and_update(
+                scoped({"id": task_id}),
+                stamped({"$push": {"subtasks": subtask_dict},
+                         "$inc": {"subtask_total": 1, "subtask_done": int(subtask_dict["completed"])}}, seq),
+                projection=SUBTASK_COUNTERS,
+                return_document=ReturnDocument.AFTER
+            )
+
+    async def update_subtask(self, task_id: str, subtask_id: str, completed: bool) -> Optional[dict]:
+        change = 1 if completed else -1
+        async with change_sequence.reserve() as seq:
+            before = await self.collection.find_one_and_update(
+                scoped({"id": task_id, "subtasks": {"$elemMatch": {"id": subtask_id, "completed": {"$ne": completed}}}}),
+                stamped({"$set": {"subtasks.$.completed": completed}, "$inc": {"subtask_done": change}}, seq),
+                projection=SUBTASK_COUNTERS,
+                return_document=ReturnDocument.BEFORE
+            )
+        if before is not None:
+            return {
+                "subtask_total": before.get("subtask_total", 0),
+                "subtask_done": before.get("subtask_done", 0) + change,
+            }
+        # Either missing or already in the requested state
+        return await self.collection.find_one(
+            scoped({"id": task_id, "subtasks.id": subtask_id}), SUBTASK_COUNTERS
+        )
+
+    async def update_subtasks(self, changes: Dict[tuple, bool]):
+        """Set the completion of many embedded subtasks, keyed by
+        (task id, subtask id), in one bulk write"""
+        if changes:
+            async with change_sequence.reserve(len(changes)) as first:
+                await self.collection.bulk_write([
+                    UpdateOne(
+                        scoped({"id": task_id, "subtasks": {"$elemMatch": {"id": subtask_id, "completed": {"$ne": completed}}}}),
+                        stamped({"$set": {"subtasks.$.completed": completed},
+                                 "$inc": {"subtask_done": 1 if completed else -1}}, first + index)
+                    )
+                    for index, ((task_id, subtask_id), completed) in enumerate(changes.items())
+                ], ordered=False)
+
+    async def delete_subtask(self, task_id: str, subtask_id: str) -> Optional[dict]:
+        # One number for the task's change and one for the subtask's tombstone
+        async with change_sequence.reserve(2) as seq:
+            for completed in (True, False):
+                before = await self.collection.find_one_and_update(
+                    scoped({"id": task_id, "subtasks": {"$elemMatch": {"id": subtask_id, "completed": completed}}}),
+                    stamped({"$pull": {"subtasks": {"id": subtask_id}},
+                             "$inc": {"subtask_total": -1, "subtask_done": -int(completed)}}, seq),
+                    projection=SUBTASK_COUNTERS,
+                    return_document=ReturnDocument.BEFORE
+                )
+                if before is not None:
+                    await tombstone_repository.record("subtask", [(subtask_id, seq + 1)], task_id=task_id)
+                    return {
+                        "subtask_total": before.get("subtask_total", 0) - 1,
+                        "subtask_done": before.get("subtask_done", 0) - int(completed),
+                    }
+        return None
+
+class ArchiveRepository(TaskRepository):
+    """Async data access for archived tasks, read like live ones but not synced"""
+
+    kind = None
+
+    def __init__(self, collection=tasks_archive_collection):
+        super().__init__(collection)
+
+    async def remove(self, task_id: str) -> Optional[dict]:
+        """Delete an archived task and return it with its search fields"""
+        return await self.collection.find_one_and_delete(scoped({"id": task_id}), projection={"_id": 0})
+
+    async def delete_ids(self, task_ids: List[str]) -> int:
+        if not task_ids:
+            return 0
+        result = await self.collection.delete_many(scoped({"id": {"$in": task_ids}}))
+        return result.deleted_count
+
+class CountedRepository(BaseRepository):
+    """Lists and tags: soft-deleted, with a denormalized `task_count`.
+
+    The counts are derived data and not change-stamped, so GET /api/sync
+    sends a list or tag again only when it is itself edited.
+    """
+
+    async def mark_deleted(self, doc_id: str) -> bool:
+        async with change_sequence.reserve() as seq:
+            result = await self.collection.update_one(
+                scoped({"id": doc_id, **self.live_filter}),
+                stamped({"$set": {"deleted_at": datetime.utcnow()}}, seq)
+            )
+            if result.matched_count:
+                await tombstone_repository.record(self.kind, [(doc_id, seq)])
+        return result.matched_count > 0
+
+    async def increment_task_counts(self, deltas: Dict[str, int], session=None):
+        deltas = {doc_id: delta for doc_id, delta in deltas.items() if delta}
+        if deltas:
+            await self.collection.bulk_write([
+                UpdateOne(scoped({"id": doc_id}), {"$inc": {"task_count": delta}})
+                for doc_id, delta in deltas.items()
+            ], ordered=False, session=session)
+
+    async def set_task_counts(self, counts: Dict[str, int]):
+        if counts:
+            await self.collection.bulk_write([
+                UpdateOne(scoped({"id": doc_id}), {"$set": {"task_count": count}})
+                for doc_id, count in counts.items()
+            ], ordered=False)
+
+    async def get_task_counts(self) -> Dict[str, int]:
+        cursor = self.collection.find(scoped(self.live_filter), {"_id": 0, "id": 1, "task_count": 1})
+        return {doc["id"]: doc.get("task_count", 0) async for doc in cursor}
+
+    async def correct_task_counts(self, corrections: Dict[str, tuple]) -> int:
+        """Set {id: (expected, actual)} counts, skipping documents whose
+        count no longer equals `expected` because a write got there first"""
+        if not corrections:
+            return 0
+        result = await self.collection.bulk_write([
+            UpdateOne(
+                scoped({"id": doc_id, "task_count": expected if expected else {"$in": [0, None]}}),
+                {"$set": {"task_count": actual}}
+            )
+            for doc_id, (expected, actual) in corrections.items()
+        ], ordered=False)
+        return result.modified_count
+
+class ListRepository(CountedRepository):
+    """Async data access for task lists"""
+
+    live_filter = {"deleted_at": None}
+    kind = "list"
+
+    def __init__(self, collection=lists_collection):
+        super().__init__(collection)
+
+    async def find_all(self) -> List[dict]:
+        cursor = self.collection.find(scoped(self.live_filter), self.export_projection).sort("created_at", -1)
+        return await cursor.to_list(length=None)
+
+    async def get(self, list_id: str) -> Optional[dict]:
+        return await self.collection.find_one(scoped({"id": list_id, **self.live_filter}), self.export_projection)
+
+    async def count(self) -> int:
+        return await self.collection.count_documents(scoped(self.live_filter))
+
+    async def insert(self, list_dict: dict) -> bool:
+        async with change_sequence.reserve() as seq:
+            result = await self.collection.insert_one(owned({**list_dict, SEQUENCE_FIELD: seq}))
+        return result.inserted_id is not None
+
+    async def update(self, list_id: str, update_data: dict) -> bool:
+        async with change_sequence.reserve() as seq:
+            result = await self.collection.update_one(
+                scoped({"id": list_id, **self.live_filter}),
+                stamped({"$set": update_data}, seq)
+            )
+        return result.matched_count > 0
+
+    async def delete(self, list_id: str) -> bool:
+        result = await self.collection.delete_one(scoped({"id": list_id}))
+        return result.deleted_count == 1
+
+
+class TagRepository(CountedRepository):
+    """Async data access for tags"""
+
+    live_filter = {"deleted_at": None}
+    kind = "tag"
+
+    def __init__(self, collection=tags_collection):
+        super().__init__(collection)
+
+    async def find_all(self) -> List[dict]:
+        cursor = self.collection.find(scoped(self.live_filter), self.export_projection).sort("created_at", -1)
+        return await cursor.to_list(length=None)
+
+    async def get(self, tag_id: str) -> Optional[dict]:
+        return await self.collection.find_one(scoped({"id": tag_id, **self.live_filter}), self.export_projection)
+
+    async def insert(self, tag_dict: dict) -> bool:
+        async with change_sequence.reserve() as seq:
+            result = await self.collection.insert_one(owned({**tag_dict, SEQUENCE_FIELD: seq}))
+        return result.inserted_id is not None
+
+    async def delete(self, tag_id: str) -> bool:
+        result = await self.collection.delete_one(scoped({"id": tag_id}))
+        return result.deleted_count == 1
+
+class SubtaskRepository(BaseRepository):
+    """Async data access for subtasks stored in their own collection"""
+
+    def __init__(self, collection=subtasks_collection):
+        super().__init__(collection)
+
+    async def find_by_task(self, task_id: str) -> List[dict]:
+        cursor = self.collection.find(scoped({"task_id": task_id}), self.export_projection)
+        return await cursor.sort("created_at", 1).to_list(length=None)
+
+    async def insert(self, subtask_dict: dict) -> bool:
+        result = await self.collection.insert_one(owned(subtask_dict))
+        return result.inserted_id is not None
+
+    async def insert_many(self, subtasks: List[dict]):
+        if subtasks:
+            await self.collection.insert_many([owned(subtask) for subtask in subtasks], ordered=False)
+
+    async def set_completed(self, task_id: str, subtask_id: str, completed: bool) -> Optional[dict]:
+        """Set a subtask's completion and return it as it was before"""
+        return await self.collection.find_one_and_update(
+            scoped({"id": subtask_id, "task_id": task_id}),
+            {"$set": {"completed": completed}},
+            projection=self.export_projection,
+            return_document=ReturnDocument.BEFORE
+        )
+
+    async def find_by_ids(self, subtask_ids: List[str]) -> List[dict]:
+        cursor = self.collection.find(scoped({"id": {"$in": subtask_ids}}), self.export_projection)
+        return await cursor.to_list(length=None)
+
+    async def set_completed_many(self, changes: Dict[tuple, bool]):
+        """Set the completion of many subtasks, keyed by (task id, subtask id)"""
+        if changes:
+            await self.collection.bulk_write([
+                UpdateOne(scoped({"id": subtask_id, "task_id": task_id}), {"$set": {"completed": completed}})
+                for (task_id, subtask_id), completed in changes.items()
+            ], ordered=False)
+
+    async def delete(self, task_id: str, subtask_id: str) -> Optional[dict]:
+        async with change_sequence.reserve() as seq:
+            subtask = await self.collection.find_one_and_delete(
+                scoped({"id": subtask_id, "task_id": task_id}), projection=self.export_projection
+            )
+            if subtask:
+                await tombstone_repository.record("subtask", [(subtask_id, seq)], task_id=task_id)
+        return subtask
+
+    async def find_by_tasks(self, task_ids: List[str]) -> Dict[str, List[dict]]:
+        """Subtasks of many tasks in creation order, keyed by task id"""
+        subtasks: Dict[str, List[dict]] = {task_id: [] for task_id in task_ids}
+        cursor = self.collection.find(scoped({"task_id": {"$in": task_ids}}), self.export_projection)
+        async for subtask in cursor.sort("created_at", 1):
+            subtasks[subtask["task_id"]].append(subtask)
+        return subtasks
+
+    async def delete_by_tasks(self, task_ids: List[str]) -> int:
+        result = await self.collection.delete_many(scoped({"task_id": {"$in": task_ids}}))
+        return result.deleted_count
+
+    async def count_by_task(self, task_ids: List[str]) -> Dict[str, tuple]:
+        """(total, done) subtask counts of the given tasks"""
+        groups = await self.collection.aggregate(scoped_pipeline([
+            {"$match": {"task_id": {"$in": task_ids}}},
+            {"$group": {
+                "_id": "$task_id",
+                "total": {"$sum": 1},
+                "done": {"$sum": {"$cond": ["$completed", 1, 0]}},
+            }},
+        ])).to_list(length=None)
+        counts = {task_id: (0, 0) for task_id in task_ids}
+        counts.update({group["_id"]: (group["total"], group["done"]) for group in groups})
+        return counts
+
+class JobRepository:
+    """Async data access for background jobs, owned by the tenant that
+    started them or by none for scheduled jobs spanning tenants"""
+
+    def __init__(self, collection=jobs_collection):
+        self.collection = collection
+
+    async def insert(self, job: dict):
+        await self.collection.insert_one(owned(job))
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.collection.find_one(scoped({"id": job_id}), {"_id": 0, TENANT_FIELD: 0})
+
+    async def update(self, job_id: str, fields: dict):
+        await self.collection.update_one(scoped({"id": job_id}), {"$set": fields})
+
+    async def claim(self, job_id: str, owner: str, lease_until: datetime) -> Optional[dict]:
+        """Take a queued job, or a running one whose owner's lease expired,
+        so only one worker process runs it. Returns the claimed job."""
+        now = datetime.utcnow()
+        fields = {"status": "running", "owner": owner, "lease_until": lease_until, "updated_at": now}
+        previous = await self.collection.find_one_and_update(
+            scoped({"id": job_id, "$or": [
+                {"status": "queued"},
+                {"status": "running", "lease_until": {"$not": {"$gte": now}}},
+            ]}),
+            {"$set": fields},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        return {**previous, **fields} if previous else None
+
+    async def find_unfinished(self) -> List[dict]:
+        cursor = self.collection.find(scoped({"status": {"$in": ["queued", "running"]}}), {"_id": 0})
+        return await cursor.sort("created_at", 1).to_list(length=None)
+
+    async def find_recent(self, limit: int) -> List[dict]:
+        cursor = self.collection.find(scoped({}), {"_id": 0, TENANT_FIELD: 0}).sort("created_at", -1).limit(limit)
+        return await cursor.to_list(length=None)
+
+class VersionRepository:
+    """Shared cache version counters, kept in the settings collection"""
+
+    def __init__(self, collection=settings_collection):
+        self.collection = collection
+
+    async def get(self, versions_id: str, epoch: str) -> dict:
+        """Return the versions document, creating it with `epoch` if missing"""
+        document = await self.collection.find_one({"_id": versions_id})
+        if document is None:
+            document = await self.collection.find_one_and_update(
+                {"_id": versions_id},
+                {"$setOnInsert": {"epoch": epoch, "versions": {}}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        return document
+
+    async def increment(self, versions_id: str, delta: Dict[str, int], epoch: str):
+        await self.collection.update_one(
+            {"_id": versions_id},
+            {"$inc": {f"versions.{name}": value for name, value in delta.items()},
+             "$setOnInsert": {"epoch": epoch}},
+            upsert=True
+        )
+
+class TombstoneRepository:
+    """Records of deleted tasks, lists, tags and subtasks for GET /api/sync"""
+
+    def __init__(self, collection=tombstones_collection):
+        self.collection = collection
+
+    async def record(self, kind: str, deleted: List[Tuple[str, int]], session=None, **fields):
+        """Store a tombstone per (id, sequence number) pair"""
+        if deleted:
+            now = datetime.utcnow()
+            await self.collection.insert_many([
+                owned({"kind": kind, "id": doc_id, SEQUENCE_FIELD: seq, "deleted_at": now, **fields})
+                for doc_id, seq in deleted
+            ], session=session)
+
+    async def find_changed(self, since: int, ceiling: Optional[int], limit: int) -> List[dict]:
+        cursor = self.collection.find(scoped(changed_since(since, ceiling)), {"_id": 0, TENANT_FIELD: 0})
+        return await cursor.sort(SEQUENCE_FIELD, 1).limit(limit).to_list(length=None)
+
+class ReminderRepository:
+    """Sent reminders, so each is sent once across worker processes, and
+    the time up to which reminders were handled"""
+
+    def __init__(self, collection=reminders_collection, settings=settings_collection,
+                 cursor_id: str = "reminder_cursor"):
+        self.collection = collection
+        self.settings = settings
+        self.cursor_id = cursor_id
+
+    async def claim(self, reminder_id: str, task_id: str) -> bool:
+        """Record a reminder as sent; False if it already was"""
+        try:
+            await self.collection.insert_one(
+                owned({"_id": reminder_id, "task_id": task_id, "sent_at": datetime.utcnow()})
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def get_cursor(self) -> Optional[datetime]:
+        document = await self.settings.find_one({"_id": self.cursor_id})
+        return document.get("value") if document else None
+
+    async def advance_cursor(self, value: datetime):
+        await self.settings.update_one({"_id": self.cursor_id}, {"$max": {"value": value}}, upsert=True)
+
+class StatsRepository:
+    """Async data access for the precomputed dashboard counters, one
+    document per counters id and tenant"""
+
+    def __init__(self, collection=counters_collection):
+        self.collection = collection
+
+    async def get(self, counters_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": tenant_key(counters_id)})
+
+    async def increment(self, counters_id: str, delta: Dict[str, int]):
+        # No upsert: a missing document is rebuilt from the tasks collection
+        if delta:
+            await self.collection.update_one({"_id": tenant_key(counters_id)}, {"$inc": delta})
+
+    async def replace(self, counters_id: str, counters: dict):
+        key = tenant_key(counters_id)
+        await self.collection.replace_one({"_id": key}, owned({**counters, "_id": key}), upsert=True)
+
+    async def find_tenants(self) -> List[str]:
+        """Ids of the tenants with stored counters"""
+        cursor = self.collection.aggregate([{"$group": {"_id": f"${TENANT_FIELD}"}}])
+        return sorted([group["_id"] async for group in cursor if group["_id"] is not None])
+
+task_repository = TaskRepository()
+archive_repository = ArchiveRepository()
+list_repository = ListRepository()
+tag_repository = TagRepository()
+subtask_repository = SubtaskRepository()
+stats_repository = StatsRepository()
+job_repository = JobRepository()
+version_repository = VersionRepository()
+tombstone_repository = TombstoneRepository()
+reminder_repository = ReminderRepository()
@@ -0,0 +1,144 @@
+"""Persian-aware task search backed by a multikey index.
+
+Each task stores the normalized prefixes of the words in its title and
+description (`search_terms`). A query matches tasks whose terms contain
+every query word, which is an indexed `$all` lookup instead of an
+unanchored regex scan. Matches are ranked by title hits and whole-word
+hits, then by recency.
+
+Existing tasks are backfilled with:
+
+    python search.py reindex
+"""
+import argparse
+import asyncio
+import re
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_LENGTH = 15
+MAX_TERMS_PER_TASK = 1000
+
+SEARCH_FIELDS = ["search_terms", "search_title_terms", "search_words"]
+
+ZWNJ = "\u200c"
+
+_CHAR_MAP = str.maketrans({
+    "ي": "ی", "ى": "ی", "ئ": "ی",
+    "ك": "ک",
+    "ة": "ه", "ۀ": "ه",
+    "أ": "ا", "إ": "ا", "ٱ": "ا",
+    "ؤ": "و",
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic digits
+})
+
+# Harakat, superscript alef and tatweel carry no meaning for matching
+_DIACRITICS = re.compile("[\u064B-\u065F\u0670\u0640]")
+_WORD = re.compile(r"[\w" + ZWNJ + r"]+")
+
+def normalize(text: str) -> str:
+    """Fold Arabic/Persian letter variants, digits and diacritics"""
+    return _DIACRITICS.sub("", text.translate(_CHAR_MAP)).lower()
+
+def _words(text: Optional[str]) -> List[str]:
+    """Normalized words of a text; ZWNJ compounds yield the joined word and its parts"""
+    words = []
+    for word in _WORD.findall(normalize(text or "")):
+        parts = [part for part in word.split(ZWNJ) if part]
+        if len(parts) > 1:
+            words.append("".join(parts))
+        words.extend(parts)
+    return words
+
+def _prefixes(words: List[str]) -> List[str]:
+    terms = set()
+    for word in words:
+        for length in range(MIN_PREFIX_LENGTH, min(len(word), MAX_PREFIX_LENGTH) + 1):
+            terms.add(word[:length])
+    return sorted(terms)
+
+def search_document_fields(title: Optional[str], description: Optional[str]) -> Dict[str, List[str]]:
+    """Search fields stored on a task for the given title and description"""
+    title_words = _words(title)
+    words = title_words + _words(description)
+    return {
+        "search_terms": _prefixes(words)[:MAX_TERMS_PER_TASK],
+        "search_title_terms": _prefixes(title_words),
+        "search_words": sorted(set(words)),
+    }
+
+def query_tokens(search: str) -> List[str]:
+    """Normalized tokens of a search query, truncated to the indexed prefix length"""
+    tokens = []
+    for word in _WORD.findall(normalize(search)):
+        word = word.replace(ZWNJ, "")
+        if len(word) >= MIN_PREFIX_LENGTH:
+            token = word[:MAX_PREFIX_LENGTH]
+            if token not in tokens:
+                tokens.append(token)
+    return tokens
+
+def build_search_pipeline(filters: dict, tokens: List[str], limit: int,
+                          after: Optional[dict] = None,
+                          projection: Optional[dict] = None) -> List[dict]:
+    """Aggregation returning ranked matches, optionally after a cursor position.
+
+    `after` holds the score, created_at and id of the last task of the
+    previous page. Each match carries its rank in `search_score`, for
+    ordering and cursors; callers drop it before responding.
+    """
+    from repository import HIDDEN_TASK_FIELDS
+
+    score = {"$add": [
+        term
+        for token in tokens
+        for term in (
+            {"$cond": [{"$in": [token, "$search_title_terms"]}, 2, 0]},
+            {"$cond": [{"$in": [token, "$search_words"]}, 1, 0]},
+        )
+    ]}
+    pipeline = [
+        {"$match": {**filters, "search_terms": {"$all": tokens}}},
+        {"$addFields": {"search_score": score}},
+    ]
+    if after:
+        pipeline.append({"$match": {"$or": [
+            {"search_score": {"$lt": after["score"]}},
+            {"search_score": after["score"], "created_at": {"$lt": after["created_at"]}},
+            {"search_score": after["score"], "created_at": after["created_at"],
+             "id": {"$lt": after["id"]}},
+        ]}})
+    pipeline.extend([
+        {"$sort": {"search_score": -1, "created_at": -1, "id": -1}},
+        {"$limit": limit},
+        {"$project": {**projection, "search_score": 1} if projection else HIDDEN_TASK_FIELDS},
+    ])
+    return pipeline
+
+async def reindex(batch_size: int = 1000) -> int:
+    """Recompute the search fields of every task"""
+    from repository import task_repository
+
+    updated = 0
+    batch = []
+    async for task in task_repository.collection.find({}, {"id": 1, "title": 1, "description": 1}):
+        fields = search_document_fields(task.get("title"), task.get("description"))
+        batch.append(UpdateOne({"_id": task["_id"]}, {"$set": fields}))
+        if len(batch) >= batch_size:
+            await task_repository.collection.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await task_repository.collection.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    return updated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the task search fields")
+    parser.add_argument("command", choices=["reindex"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    print(f"Reindexed {asyncio.run(reindex(args.batch_size))} tasks")
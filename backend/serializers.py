@@ -0,0 +1,27 @@
+"""Response serialization for documents read from MongoDB.
+
+Repositories project `_id`, the change sequence, the tenant and the
+search fields away, so documents are already in their response shape;
+datetimes stay native and are encoded by orjson. Listing routes return
+`json_response(...)` directly, which skips FastAPI's per-item
+`jsonable_encoder` pass and response-model validation.
+"""
+from typing import Optional
+
+from fastapi.responses import ORJSONResponse
+
+from search import SEARCH_FIELDS
+from tenancy import TENANT_FIELD
+
+def to_response(document: dict) -> dict:
+    """Strip the internal fields of a document that was not read through a projection"""
+    if document:
+        document.pop('_id', None)
+        document.pop('seq', None)
+        document.pop(TENANT_FIELD, None)
+        for field in SEARCH_FIELDS:
+            document.pop(field, None)
+    return document
+
+def json_response(content, headers: Optional[dict] = None) -> ORJSONResponse:
+    return ORJSONResponse(content, headers=headers)
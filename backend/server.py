@@ -1,17 +1,80 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from typing import Optional
 from datetime import datetime, date
-from pymongo import MongoClient
-from bson import ObjectId
+from contextlib import asynccontextmanager
 import os
 import uuid
-from enum import Enum
 import khayyam
 
-app = FastAPI(title="Persian Todo API", version="1.0.0")
+import database
+from models import (
+    Priority, TaskStatus, TagMatch, TaskModel, TaskCreate, TaskUpdate,
+    ListCreate, TagCreate, SubtaskModel, TaskBatchRequest, SyncPushRequest,
+)
+from repository import task_repository, archive_repository, list_repository, tag_repository
+from stats import ARCHIVE_STATS_ID, get_counters, record_task_change, current_due_date
+from counts import write_task, count_reconciler
+from indexes import ensure_indexes
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor, after_cursor,
+    parse_fields, parse_expand, expand_stages, EXPAND_SOURCE_FIELDS,
+)
+from search import search_document_fields, query_tokens, build_search_pipeline
+from serializers import to_response, json_response
+from transfer import export_ndjson, import_ndjson
+from batch import execute_batch
+from sync import SYNC_PAGE_SIZE, changes_since, push, ensure_sequences
+from tasks import insert_task
+from recurrence import build_created_task, prepare_recurrence, roll_completed, occurrences_between
+from events import event_bus, sse_stream
+from jalali import calendar_service, due_buckets
+from subtasks import (
+    get_subtasks, add_subtask as store_subtask, set_subtask_completed,
+    delete_subtask as remove_subtask, delete_task_subtasks,
+)
+from jobs import job_queue, recent_jobs
+from archive import ARCHIVE_AFTER_DAYS, archive_cutoff, archive_scheduler, restore_task
+from reminders import reminder_scheduler
+from write_buffer import subtask_buffer, status_buffer, is_status_flip, drain_all as drain_write_buffers
+from repository import job_repository
+from cache import ConditionalGetMiddleware, collection_versions
+from metrics import MetricsMiddleware, metrics_registry
+from tenancy import TenantMiddleware, ensure_tenants
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Each worker process opens its own client once it has started
+    database.connect()
+    # Index creation is idempotent, so every startup can run it
+    await ensure_indexes()
+    await ensure_tenants()
+    await ensure_sequences()
+    await job_queue.start()
+    count_reconciler.start()
+    archive_scheduler.start(job_queue)
+    await reminder_scheduler.start()
+    yield
+    await reminder_scheduler.stop()
+    await archive_scheduler.stop()
+    await count_reconciler.stop()
+    await drain_write_buffers()
+    await job_queue.stop()
+    database.close()
+
+app = FastAPI(title="Persian Todo API", version="1.0.0", lifespan=lifespan,
+              default_response_class=ORJSONResponse)
+
+# ETags and cached responses for the read endpoints; registered before CORS
+# so CORS headers are added per request rather than cached
+event_bus.add_listener(collection_versions.on_event)
+event_bus.add_listener(reminder_scheduler.on_event)
+app.add_middleware(ConditionalGetMiddleware)
+
+# Scopes each request to its tenant; outside the response cache, whose keys
+# include the tenant
+app.add_middleware(TenantMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -20,112 +83,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-# MongoDB connection
-MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-client = MongoClient(MONGO_URL)
-db = client.persian_todo
-
-# Collections
-tasks_collection = db.tasks
-lists_collection = db.lists
-tags_collection = db.tags
-settings_collection = db.settings
-
-class Priority(str, Enum):
-    LOW = "کم"
-    MEDIUM = "متوسط"
-    HIGH = "بالا"
-
-class TaskStatus(str, Enum):
-    PENDING = "در انتظار"
-    COMPLETED = "تکمیل شده"
-    CANCELLED = "لغو شده"
-
-# Pydantic models
-class TaskModel(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    title: str
-    description: Optional[str] = None
-    priority: Priority = Priority.MEDIUM
-    status: TaskStatus = TaskStatus.PENDING
-    due_date: Optional[date] = None
-    due_time: Optional[str] = None
-    list_id: Optional[str] = None
-    tags: List[str] = []
-    subtasks: List[Dict[str, Any]] = []
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
-    completed_at: Optional[datetime] = None
-
-class TaskCreate(BaseModel):
-    title: str
-    description: Optional[str] = None
-    priority: Priority = Priority.MEDIUM
-    due_date: Optional[date] = None
-    due_time: Optional[str] = None
-    list_id: Optional[str] = None
-    tags: List[str] = []
-
-class TaskUpdate(BaseModel):
-    title: Optional[str] = None
-    description: Optional[str] = None
-    priority: Optional[Priority] = None
-    status: Optional[TaskStatus] = None
-    due_date: Optional[date] = None
-    due_time: Optional[str] = None
-    list_id: Optional[str] = None
-    tags: Optional[List[str]] = None
-
-class ListModel(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    color: str = "#3B82F6"
-    icon: str = "📋"
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    task_count: int = 0
-
-class ListCreate(BaseModel):
-    name: str
-    color: str = "#3B82F6"
-    icon: str = "📋"
-
-class TagModel(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    color: str = "#10B981"
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-class TagCreate(BaseModel):
-    name: str
-    color: str = "#10B981"
-
-class SubtaskModel(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    title: str
-    completed: bool = False
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+# Added last so it is outermost and times every request, including cache hits
+app.add_middleware(MetricsMiddleware)
 
 # Helper functions
-def task_dict_to_model(task_dict: dict) -> dict:
-    """Convert MongoDB document to API response format"""
-    if task_dict:
-        task_dict['_id'] = str(task_dict['_id'])
-        # Convert datetime to ISO format
-        if 'created_at' in task_dict:
-            task_dict['created_at'] = task_dict['created_at'].isoformat()
-        if 'updated_at' in task_dict:
-            task_dict['updated_at'] = task_dict['updated_at'].isoformat()
-        if 'completed_at' in task_dict and task_dict['completed_at']:
-            task_dict['completed_at'] = task_dict['completed_at'].isoformat()
-        # due_date is already stored as string, no conversion needed
-    return task_dict
-
 def get_today_persian():
     """Get today's date in Persian calendar format"""
-    today_persian = khayyam.JalaliDatetime.now()
-    return today_persian.date()
+    return khayyam.JalaliDate(*calendar_service.to_jalali(calendar_service.today()))
 
 def convert_persian_to_gregorian(persian_date_str):
     """Convert Persian date string to Gregorian date"""
@@ -148,8 +115,7 @@ def is_today_persian(date_obj):
     if not date_obj:
         return False
         
-    today = datetime.utcnow().date()
-    return date_obj == today
+    return date_obj == calendar_service.today()
 
 # API Routes
 
@@ -161,19 +127,10 @@ async def root():
 async def get_persian_date():
     """Get current Persian date information"""
     try:
-        now = khayyam.JalaliDatetime.now()
-        today = datetime.utcnow().date()
-        
+        # Day fields are cached until Tehran midnight; only the time is fresh
         return {
-            "persian_date": now.strftime('%Y/%m/%d'),
-            "persian_date_long": now.strftime('%A، %d %B %Y'),
-            "persian_time": now.strftime('%H:%M'),
-            "gregorian_date": today.isoformat(),
-            "day_name": now.strftime('%A'),
-            "month_name": now.strftime('%B'),
-            "year": now.year,
-            "month": now.month,
-            "day": now.day
+            **calendar_service.today_info(),
+            "persian_time": calendar_service.now().strftime('%H:%M'),
         }
     except Exception as e:
         return {
@@ -182,15 +139,35 @@ async def get_persian_date():
         }
 
 # Tasks endpoints
-@app.get("/api/tasks", response_model=List[dict])
+@app.get("/api/tasks")
 async def get_tasks(
     list_id: Optional[str] = None,
     status: Optional[TaskStatus] = None,
     priority: Optional[Priority] = None,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    tags: Optional[str] = None,
+    tag_match: TagMatch = TagMatch.ANY,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    include_archived: bool = False
 ):
-    """Get all tasks with optional filtering"""
+    """Get a page of tasks with optional filtering.
+
+    Pages are ordered by (created_at, id), newest first. When more tasks
+    follow, the cursor for the next page is returned in X-Next-Cursor.
+    Searches are ranked by relevance before recency. `tags` is a comma
+    separated list of tag ids matched with `tag_match` (any/all), and
+    `expand=tags,list` embeds tag and list summaries in each task.
+    `include_archived=true` merges archived tasks into the pages.
+    """
     query = {}
+    projection = parse_fields(fields, list(TaskModel.model_fields))
+    expansions = parse_expand(expand)
+    if projection:
+        # Expansions join on these fields, so they must survive the projection
+        projection.update({EXPAND_SOURCE_FIELDS[name]: 1 for name in expansions})
     
     if list_id:
         query["list_id"] = list_id
@@ -198,101 +175,156 @@ async def get_tasks(
         query["status"] = status
     if priority:
         query["priority"] = priority
-    if search:
-        query["$or"] = [
-            {"title": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
+    tag_ids = [tag_id for tag_id in (tags or "").split(",") if tag_id]
+    if tag_ids:
+        query["tags"] = {"$all" if tag_match == TagMatch.ALL else "$in": tag_ids}
+    position = decode_cursor(cursor) if cursor else None
+    repositories = [task_repository, archive_repository] if include_archived else [task_repository]
     
-    tasks = list(tasks_collection.find(query).sort("created_at", -1))
-    return [task_dict_to_model(task) for task in tasks]
+    # Fetch one extra task to learn whether another page follows
+    tasks = []
+    if search:
+        tokens = query_tokens(search)
+        if not tokens:
+            return json_response([])
+        if position and "score" not in position:
+            raise HTTPException(status_code=400, detail="مکان‌نمای صفحه‌بندی نامعتبر است")
+        for repository in repositories:
+            tasks += await repository.search(
+                build_search_pipeline(query, tokens, limit + 1, position, projection)
+                + expand_stages(expansions)
+            )
+        sort_key = lambda task: (task["search_score"], task["created_at"], task["id"])
+    else:
+        if position:
+            query = {"$and": [query, after_cursor(position)]} if query else after_cursor(position)
+        for repository in repositories:
+            tasks += await repository.find_page(query, limit + 1, projection,
+                                                expand_stages(expansions))
+        sort_key = lambda task: (task["created_at"], task["id"])
+    if len(repositories) > 1:
+        tasks.sort(key=sort_key, reverse=True)
+    headers = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        headers = {"X-Next-Cursor": encode_cursor(tasks[-1])}
+    if search:
+        # Only needed for ordering and the cursor
+        for task in tasks:
+            task.pop("search_score", None)
+    return json_response(tasks, headers)
+
+@app.post("/api/tasks/batch")
+async def batch_tasks(batch: TaskBatchRequest):
+    """Apply many task updates and deletes in a single bulk write"""
+    return await execute_batch(batch, publish=event_bus.publish)
+
+# Delta sync endpoints
+@app.get("/api/sync")
+async def sync_changes(since: int = Query(0, ge=0), limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=1000)):
+    """Get the tasks, lists, tags and deletions changed after a sync cursor"""
+    return json_response(await changes_since(since, limit))
+
+@app.post("/api/sync/push")
+async def sync_push(request: SyncPushRequest):
+    """Apply task edits a client queued while offline"""
+    return await push(request)
 
 @app.get("/api/tasks/{task_id}")
-async def get_task(task_id: str):
+async def get_task(task_id: str, include_archived: bool = False):
     """Get a specific task by ID"""
-    task = tasks_collection.find_one({"id": task_id})
+    task = await task_repository.get(task_id)
+    if not task and include_archived:
+        task = await archive_repository.get(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="تسک پیدا نشد")
-    return task_dict_to_model(task)
+    return task
 
 @app.post("/api/tasks", response_model=dict)
 async def create_task(task: TaskCreate):
     """Create a new task"""
-    task_dict = task.dict()
-    task_dict["id"] = str(uuid.uuid4())
-    task_dict["status"] = TaskStatus.PENDING
-    task_dict["created_at"] = datetime.utcnow()
-    task_dict["updated_at"] = datetime.utcnow()
-    task_dict["subtasks"] = []
-    
-    # Convert date to string if provided
-    if task_dict.get("due_date"):
-        if isinstance(task_dict["due_date"], date):
-            task_dict["due_date"] = task_dict["due_date"].isoformat()
-    
-    result = tasks_collection.insert_one(task_dict)
-    if result.inserted_id:
-        # Update list task count
-        if task.list_id:
-            lists_collection.update_one(
-                {"id": task.list_id},
-                {"$inc": {"task_count": 1}}
-            )
-        return task_dict_to_model(task_dict)
+    try:
+        task_dict = build_created_task(task)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    created_task = await insert_task(task_dict)
+    if created_task:
+        return created_task
     raise HTTPException(status_code=500, detail="خطا در ایجاد تسک")
 
 @app.put("/api/tasks/{task_id}")
 async def update_task(task_id: str, task_update: TaskUpdate):
     """Update an existing task"""
-    update_data = {k: v for k, v in task_update.dict().items() if v is not None}
-    update_data["updated_at"] = datetime.utcnow()
+    if status_buffer.enabled and is_status_flip(task_update):
+        # Coalesced with other status flips into one batch write
+        updated_task = await status_buffer.submit(task_id, task_update)
+        if updated_task is None:
+            raise HTTPException(status_code=404, detail="تسک پیدا نشد")
+        return updated_task
+
+    update_data = task_update.to_update_data()
+    if update_data.get("recurrence"):
+        current = await task_repository.get(task_id) if "due_date" not in update_data else None
+        try:
+            prepare_recurrence(update_data, current.get("due_date") if current else None)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    stored_data = dict(update_data)
+    # With both texts known the search fields go into the same update
+    rewrites_text = "title" in update_data and "description" in update_data
+    if rewrites_text:
+        stored_data.update(search_document_fields(update_data["title"], update_data["description"]))
     
-    # Convert date to string if provided
-    if update_data.get("due_date"):
-        if isinstance(update_data["due_date"], date):
-            update_data["due_date"] = update_data["due_date"].isoformat()
-    
-    # Handle status change to completed
-    if update_data.get("status") == TaskStatus.COMPLETED:
-        update_data["completed_at"] = datetime.utcnow()
-    elif update_data.get("status") == TaskStatus.PENDING:
-        update_data["completed_at"] = None
-    
-    result = tasks_collection.update_one(
-        {"id": task_id},
-        {"$set": update_data}
-    )
-    
-    if result.matched_count == 0:
+    async def update(session):
+        before = await task_repository.update(task_id, stored_data, session=session)
+        return before, {**before, **update_data} if before else None
+
+    # Moving the task to another list or retagging it adjusts both counts
+    previous_task, updated_task, list_delta, tag_delta = await write_task(update)
+    if not previous_task:
         raise HTTPException(status_code=404, detail="تسک پیدا نشد")
     
-    updated_task = tasks_collection.find_one({"id": task_id})
-    return task_dict_to_model(updated_task)
+    if not rewrites_text and ("title" in update_data or "description" in update_data):
+        await task_repository.update_search_fields(task_id, search_document_fields(
+            updated_task.get("title"), updated_task.get("description")
+        ))
+    stats_delta = await record_task_change(previous_task, updated_task)
+    event_bus.publish("task.updated", updated_task, stats=stats_delta,
+                      lists=list_delta, tags=tag_delta)
+    await roll_completed([(previous_task, updated_task)])
+    return updated_task
 
 @app.delete("/api/tasks/{task_id}")
 async def delete_task(task_id: str):
     """Delete a task"""
-    task = tasks_collection.find_one({"id": task_id})
+    async def delete(session):
+        return await task_repository.delete(task_id, session=session), None
+
+    task, _, list_delta, tag_delta = await write_task(delete)
     if not task:
         raise HTTPException(status_code=404, detail="تسک پیدا نشد")
     
-    result = tasks_collection.delete_one({"id": task_id})
-    if result.deleted_count == 1:
-        # Update list task count
-        if task.get("list_id"):
-            lists_collection.update_one(
-                {"id": task["list_id"]},
-                {"$inc": {"task_count": -1}}
-            )
-        return {"message": "تسک با موفقیت حذف شد"}
-    raise HTTPException(status_code=500, detail="خطا در حذف تسک")
+    await delete_task_subtasks([task_id])
+    stats_delta = await record_task_change(task, None)
+    event_bus.publish("task.deleted", {"id": task_id}, stats=stats_delta,
+                      lists=list_delta, tags=tag_delta)
+    return {"message": "تسک با موفقیت حذف شد"}
+
+@app.post("/api/tasks/{task_id}/restore")
+async def restore_archived_task(task_id: str):
+    """Move an archived task back to the active tasks"""
+    task = await restore_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="تسک بایگانی‌شده پیدا نشد")
+    return task
 
 # Lists endpoints
-@app.get("/api/lists", response_model=List[dict])
+@app.get("/api/lists")
 async def get_lists():
     """Get all lists"""
-    lists = list(lists_collection.find().sort("created_at", -1))
-    return [task_dict_to_model(lst) for lst in lists]
+    lists = await list_repository.find_all()
+    return json_response(lists)
 
 @app.post("/api/lists", response_model=dict)
 async def create_list(list_data: ListCreate):
@@ -302,9 +334,10 @@ async def create_list(list_data: ListCreate):
     list_dict["created_at"] = datetime.utcnow()
     list_dict["task_count"] = 0
     
-    result = lists_collection.insert_one(list_dict)
-    if result.inserted_id:
-        return task_dict_to_model(list_dict)
+    if await list_repository.insert(list_dict):
+        created_list = to_response(list_dict)
+        event_bus.publish("list.created", created_list, stats={"total_lists": 1})
+        return created_list
     raise HTTPException(status_code=500, detail="خطا در ایجاد لیست")
 
 @app.put("/api/lists/{list_id}")
@@ -312,39 +345,29 @@ async def update_list(list_id: str, list_update: ListCreate):
     """Update an existing list"""
     update_data = list_update.dict()
     
-    result = lists_collection.update_one(
-        {"id": list_id},
-        {"$set": update_data}
-    )
-    
-    if result.matched_count == 0:
+    if not await list_repository.update(list_id, update_data):
         raise HTTPException(status_code=404, detail="لیست پیدا نشد")
     
-    updated_list = lists_collection.find_one({"id": list_id})
-    return task_dict_to_model(updated_list)
+    updated_list = await list_repository.get(list_id)
+    event_bus.publish("list.updated", updated_list)
+    return updated_list
 
 @app.delete("/api/lists/{list_id}")
 async def delete_list(list_id: str):
-    """Delete a list and all its tasks"""
-    list_obj = lists_collection.find_one({"id": list_id})
-    if not list_obj:
+    """Delete a list; its tasks are removed by a background job"""
+    if not await list_repository.mark_deleted(list_id):
         raise HTTPException(status_code=404, detail="لیست پیدا نشد")
     
-    # Delete all tasks in this list
-    tasks_collection.delete_many({"list_id": list_id})
-    
-    # Delete the list
-    result = lists_collection.delete_one({"id": list_id})
-    if result.deleted_count == 1:
-        return {"message": "لیست و تمام تسک‌های آن با موفقیت حذف شد"}
-    raise HTTPException(status_code=500, detail="خطا در حذف لیست")
+    job = await job_queue.enqueue("delete_list", list_id)
+    event_bus.publish("list.deleted", {"id": list_id, "job_id": job["id"]}, stats={"total_lists": -1})
+    return {"message": "لیست حذف شد و تسک‌های آن در حال حذف هستند", "job_id": job["id"]}
 
 # Tags endpoints
-@app.get("/api/tags", response_model=List[dict])
+@app.get("/api/tags")
 async def get_tags():
     """Get all tags"""
-    tags = list(tags_collection.find().sort("created_at", -1))
-    return [task_dict_to_model(tag) for tag in tags]
+    tags = await tag_repository.find_all()
+    return json_response(tags)
 
 @app.post("/api/tags", response_model=dict)
 async def create_tag(tag: TagCreate):
@@ -352,25 +375,33 @@ async def create_tag(tag: TagCreate):
     tag_dict = tag.dict()
     tag_dict["id"] = str(uuid.uuid4())
     tag_dict["created_at"] = datetime.utcnow()
+    tag_dict["task_count"] = 0
     
-    result = tags_collection.insert_one(tag_dict)
-    if result.inserted_id:
-        return task_dict_to_model(tag_dict)
+    if await tag_repository.insert(tag_dict):
+        created_tag = to_response(tag_dict)
+        event_bus.publish("tag.created", created_tag)
+        return created_tag
     raise HTTPException(status_code=500, detail="خطا در ایجاد برچسب")
 
 @app.delete("/api/tags/{tag_id}")
 async def delete_tag(tag_id: str):
-    """Delete a tag"""
-    tag = tags_collection.find_one({"id": tag_id})
-    if not tag:
+    """Delete a tag; it is removed from tasks by a background job"""
+    if not await tag_repository.mark_deleted(tag_id):
         raise HTTPException(status_code=404, detail="برچسب پیدا نشد")
     
-    result = tags_collection.delete_one({"id": tag_id})
-    if result.deleted_count == 1:
-        return {"message": "برچسب با موفقیت حذف شد"}
-    raise HTTPException(status_code=500, detail="خطا در حذف برچسب")
+    job = await job_queue.enqueue("delete_tag", tag_id)
+    event_bus.publish("tag.deleted", {"id": tag_id, "job_id": job["id"]})
+    return {"message": "برچسب با موفقیت حذف شد", "job_id": job["id"]}
 
 # Subtasks endpoints
+@app.get("/api/tasks/{task_id}/subtasks")
+async def list_subtasks(task_id: str):
+    """Get a task's subtasks"""
+    subtasks = await get_subtasks(task_id)
+    if subtasks is None:
+        raise HTTPException(status_code=404, detail="تسک پیدا نشد")
+    return json_response(subtasks)
+
 @app.post("/api/tasks/{task_id}/subtasks")
 async def add_subtask(task_id: str, subtask: SubtaskModel):
     """Add a subtask to a task"""
@@ -378,81 +409,167 @@ async def add_subtask(task_id: str, subtask: SubtaskModel):
     subtask_dict["id"] = str(uuid.uuid4())
     subtask_dict["created_at"] = datetime.utcnow()
     
-    result = tasks_collection.update_one(
-        {"id": task_id},
-        {"$push": {"subtasks": subtask_dict}}
-    )
-    
-    if result.matched_count == 0:
+    counters = await store_subtask(task_id, subtask_dict)
+    if counters is None:
         raise HTTPException(status_code=404, detail="تسک پیدا نشد")
     
-    return {"message": "زیر تسک با موفقیت اضافه شد", "subtask": subtask_dict}
+    event_bus.publish("subtask.added", {"task_id": task_id, "subtask": subtask_dict, **counters})
+    return {"message": "زیر تسک با موفقیت اضافه شد", "subtask": subtask_dict, **counters}
 
 @app.put("/api/tasks/{task_id}/subtasks/{subtask_id}")
 async def update_subtask(task_id: str, subtask_id: str, completed: bool):
     """Update subtask completion status"""
-    result = tasks_collection.update_one(
-        {"id": task_id, "subtasks.id": subtask_id},
-        {"$set": {"subtasks.$.completed": completed}}
-    )
-    
-    if result.matched_count == 0:
+    if subtask_buffer.enabled:
+        # Written and published together with other toggles in the window
+        counters = await subtask_buffer.submit((task_id, subtask_id), completed)
+        if counters is None:
+            raise HTTPException(status_code=404, detail="تسک یا زیر تسک پیدا نشد")
+        return {"message": "وضعیت زیر تسک به‌روزرسانی شد", **counters}
+
+    counters = await set_subtask_completed(task_id, subtask_id, completed)
+    if counters is None:
         raise HTTPException(status_code=404, detail="تسک یا زیر تسک پیدا نشد")
     
-    return {"message": "وضعیت زیر تسک به‌روزرسانی شد"}
+    event_bus.publish("subtask.updated", {
+        "task_id": task_id, "subtask": {"id": subtask_id, "completed": completed}, **counters
+    })
+    return {"message": "وضعیت زیر تسک به‌روزرسانی شد", **counters}
 
 @app.delete("/api/tasks/{task_id}/subtasks/{subtask_id}")
 async def delete_subtask(task_id: str, subtask_id: str):
     """Delete a subtask"""
-    result = tasks_collection.update_one(
-        {"id": task_id},
-        {"$pull": {"subtasks": {"id": subtask_id}}}
-    )
-    
-    if result.matched_count == 0:
+    counters = await remove_subtask(task_id, subtask_id)
+    if counters is None:
         raise HTTPException(status_code=404, detail="تسک یا زیر تسک پیدا نشد")
     
-    return {"message": "زیر تسک با موفقیت حذف شد"}
+    event_bus.publish("subtask.deleted", {
+        "task_id": task_id, "subtask": {"id": subtask_id}, **counters
+    })
+    return {"message": "زیر تسک با موفقیت حذف شد", **counters}
 
 # Statistics endpoints
 @app.get("/api/stats")
 async def get_stats():
     """Get dashboard statistics"""
-    total_tasks = tasks_collection.count_documents({})
-    completed_tasks = tasks_collection.count_documents({"status": TaskStatus.COMPLETED})
-    pending_tasks = tasks_collection.count_documents({"status": TaskStatus.PENDING})
-    total_lists = lists_collection.count_documents({})
-    
-    # Tasks by priority
-    high_priority = tasks_collection.count_documents({"priority": Priority.HIGH, "status": TaskStatus.PENDING})
-    medium_priority = tasks_collection.count_documents({"priority": Priority.MEDIUM, "status": TaskStatus.PENDING})
-    low_priority = tasks_collection.count_documents({"priority": Priority.LOW, "status": TaskStatus.PENDING})
+    # Counters are maintained incrementally by the task mutation routes
+    counters = await get_counters()
+    # Archived tasks are all finished, so they only add to these totals
+    archived = await get_counters(ARCHIVE_STATS_ID)
+    total_tasks = counters.get("total_tasks", 0) + archived.get("total_tasks", 0)
+    completed_tasks = counters.get("completed_tasks", 0) + archived.get("completed_tasks", 0)
+    pending_tasks = counters.get("pending_tasks", 0)
+    total_lists = await list_repository.count()
     
     # Tasks due today (Persian calendar)
-    today = datetime.utcnow().date()
-    due_today = tasks_collection.count_documents({
-        "due_date": today.isoformat(),
-        "status": TaskStatus.PENDING
-    })
+    due_today = counters.get("due_pending", {}).get(current_due_date(), 0)
     
     # Recent tasks
-    recent_tasks = list(tasks_collection.find({"status": TaskStatus.PENDING})
-                       .sort("created_at", -1)
-                       .limit(5))
+    recent_tasks = await task_repository.find({"status": TaskStatus.PENDING}, limit=5)
     
-    return {
+    return json_response({
         "total_tasks": total_tasks,
         "completed_tasks": completed_tasks,
         "pending_tasks": pending_tasks,
         "total_lists": total_lists,
-        "high_priority": high_priority,
-        "medium_priority": medium_priority,
-        "low_priority": low_priority,
+        "high_priority": counters.get("high_priority", 0),
+        "medium_priority": counters.get("medium_priority", 0),
+        "low_priority": counters.get("low_priority", 0),
         "due_today": due_today,
-        "recent_tasks": [task_dict_to_model(task) for task in recent_tasks],
+        "archived_tasks": archived.get("total_tasks", 0),
+        "recent_tasks": recent_tasks,
         "completion_rate": round((completed_tasks / total_tasks * 100) if total_tasks > 0 else 0, 1)
-    }
+    })
 
+@app.get("/api/calendar/due-buckets")
+async def get_due_buckets(list_id: Optional[str] = None):
+    """Count pending tasks that are overdue or due today, this week or this Jalali month"""
+    return await due_buckets(list_id)
+
+@app.get("/api/calendar/occurrences")
+async def get_occurrences(start: date, end: date, list_id: Optional[str] = None):
+    """Pending tasks due between two dates, with the upcoming occurrences of recurring tasks"""
+    return json_response(await occurrences_between(start, end, list_id))
+
+@app.get("/api/reminders/upcoming")
+async def get_upcoming_reminders(limit: int = Query(20, ge=1, le=500)):
+    """Get the next reminders the scheduler will send"""
+    return json_response({"scheduled": reminder_scheduler.count(), "upcoming": reminder_scheduler.upcoming(limit)})
+
+# Background jobs
+@app.get("/api/jobs")
+async def get_jobs(limit: int = Query(20, ge=1, le=100)):
+    """Get the most recent background jobs"""
+    return await recent_jobs(limit)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the status and progress of a background job"""
+    job = await job_repository.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="کار پیدا نشد")
+    return job
+
+@app.post("/api/archive/run")
+async def run_archive(older_than_days: float = Query(ARCHIVE_AFTER_DAYS, ge=0)):
+    """Start a background job archiving tasks finished more than `older_than_days` ago"""
+    return await job_queue.enqueue("archive_tasks", archive_cutoff(older_than_days).isoformat())
+
+# Import / export endpoints
+@app.get("/api/export")
+async def export_data():
+    """Stream all lists, tags and tasks as NDJSON"""
+    return StreamingResponse(
+        export_ndjson(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="persian-todo-export.ndjson"'}
+    )
+
+@app.post("/api/import")
+async def import_data(request: Request):
+    """Import lists, tags and tasks from a streamed NDJSON upload"""
+    result = await import_ndjson(request.stream())
+    # Imports touch arbitrary records, so clients reload instead of patching
+    event_bus.publish("resync")
+    return result
+
+# Change feed
+@app.get("/api/events")
+async def stream_events(request: Request):
+    """Server-Sent Events stream of task, list, tag and stats changes"""
+    return StreamingResponse(
+        sse_stream(request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Instrumentation
+@app.get("/api/metrics")
+async def get_metrics():
+    """Request latency and Mongo command metrics in Prometheus text format"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+# Production entry point:
+#
+#     python server.py --workers 4      (or WEB_CONCURRENCY=4)
+#
+# runs uvicorn worker processes sharing the port; gunicorn works as well
+# (gunicorn -k uvicorn.workers.UvicornWorker -w 4 server:app, with
+# CACHE_SYNC=mongo). Response caches and background jobs coordinate through
+# Mongo; the SSE stream and /api/metrics only cover the worker serving them.
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="Run the Persian Todo API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")))
+    args = parser.parse_args()
+    if args.workers > 1:
+        if database.MONGO_URL.startswith(database.MOCK_URL_PREFIX):
+            parser.error("the in-memory database cannot be shared by several workers")
+        # Set before the workers start so each one shares cache versions through Mongo
+        os.environ.setdefault("CACHE_SYNC", "mongo")
+        uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
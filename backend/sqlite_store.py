@@ -0,0 +1,1571 @@
+"""Embedded SQLite storage behind the Motor collection API.
+
+Selected with MONGO_URL=sqlite:///path/to/todo.db (or sqlite://:memory:),
+so small installs, CI and edge deployments run without a MongoDB server.
+The repositories stay the storage interface: this module implements the
+part of the Motor client, database, collection and cursor API that they,
+the indexes module and the CLIs use, and the same test suite and load
+benchmark run against both backends.
+
+Each collection is a table of JSON documents. The indexes declared in
+indexes.py become SQLite expression indexes, and array values of indexed
+fields (tags, search_terms) are also written to a per-collection keys
+table, the equivalent of a Mongo multikey index. Filters are pushed down
+to SQL where they can use those indexes, and whatever SQL cannot express
+exactly is re-checked in Python with Mongo semantics; updates and the
+aggregation stages the app uses are applied in Python. Search rankings read only the fields they score on
+and decode just the documents that make the page.
+
+The database runs in WAL mode. Every write runs in its own IMMEDIATE
+transaction on one writer thread per process, reads run in snapshot
+transactions on SQLITE_READ_THREADS reader threads, and several worker
+processes can share one file. Multi-document transactions (sessions) are
+not supported, so the app runs its transactional paths without them.
+"""
+import asyncio
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+from pymongo import ASCENDING, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+URL_PREFIX = 'sqlite://'
+BUSY_TIMEOUT_MS = 10000
+# Threads (each with its own connection) serving reads in every process
+READ_THREADS = int(os.environ.get('SQLITE_READ_THREADS', '4'))
+KEYS_SUFFIX = "$keys"
+
+_MISSING = object()
+# Datetimes are stored as tagged ISO strings, which sort chronologically
+_DATETIME_TAG = ""
+
+# Encoding
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return _DATETIME_TAG + value.isoformat(timespec="microseconds")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {key: _encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(item) for item in value]
+    return value
+
+def _decode_value(value):
+    if type(value) is str:
+        return datetime.fromisoformat(value[1:]) if value[:1] == _DATETIME_TAG else value
+    if type(value) in (dict, list):
+        _decode_in_place(value)
+    return value
+
+def _decode_in_place(container):
+    # Runs for every document read, so it only descends into containers
+    # and skips lists of plain strings (tags, search terms) in one call
+    if type(container) is dict:
+        items = container.items()
+    else:
+        try:
+            if _DATETIME_TAG not in "".join(container):
+                return
+        except TypeError:
+            pass
+        items = enumerate(container)
+    for key, item in items:
+        kind = type(item)
+        if kind is str:
+            if item[:1] == _DATETIME_TAG:
+                container[key] = datetime.fromisoformat(item[1:])
+        elif kind is dict or kind is list:
+            _decode_in_place(item)
+
+def _encode_default(value):
+    # orjson hands datetimes here with OPT_PASSTHROUGH_DATETIME
+    if isinstance(value, (datetime, date)):
+        return _encode_value(value)
+    raise TypeError(f"cannot store {type(value).__name__}")
+
+def _dumps(document: dict) -> str:
+    return orjson.dumps(document, default=_encode_default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode()
+
+def _loads(text: str) -> dict:
+    document = orjson.loads(text)
+    _decode_in_place(document)
+    return document
+
+def _sql_scalar(value):
+    """A Python value as SQLite compares it with json_extract results"""
+    value = _encode_value(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+def _is_scalar(value) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool, datetime, date))
+
+# Documents and paths
+
+def _get_values(document, path: str) -> List[Any]:
+    """Every value at a dotted path, descending into arrays like Mongo"""
+    values = [document]
+    for part in path.split("."):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit():
+                    if int(part) < len(value):
+                        found.append(value[int(part)])
+                else:
+                    found.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+        values = found
+    return values
+
+def _get(document: dict, path: str, default=None):
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return default
+    return value
+
+def _parent(document: dict, path: str, create: bool = True):
+    parts = path.split(".")
+    target = document
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)]
+            continue
+        if part not in target or target[part] is None:
+            if not create:
+                return None, parts[-1]
+            target[part] = {}
+        target = target[part]
+    return target, parts[-1]
+
+def _set(document: dict, path: str, value):
+    target, key = _parent(document, path)
+    if isinstance(target, list):
+        target[int(key)] = value
+    else:
+        target[key] = value
+
+def _unset(document: dict, path: str):
+    target, key = _parent(document, path, create=False)
+    if isinstance(target, dict):
+        target.pop(key, None)
+
+# Mongo ordering: null < numbers < strings < objects < arrays < booleans < dates
+
+_TYPE_ORDERS = {type(None): 0, bool: 5, int: 1, float: 1, str: 2, dict: 3, list: 4, datetime: 6}
+
+def _type_order(value) -> int:
+    order = _TYPE_ORDERS.get(type(value))
+    if order is not None:
+        return order
+    if value is None or value is _MISSING:
+        return 0
+    if isinstance(value, bool):
+        return 5
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, datetime):
+        return 6
+    return 7
+
+def _sort_value(value):
+    if isinstance(value, dict):
+        return (3, sorted((key, _sort_value(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return (4, [_sort_value(item) for item in value])
+    order = _type_order(value)
+    return (order, None if order == 0 else value)
+
+def _compare(left, right) -> Optional[int]:
+    """-1/0/1, or None when the values are of different types"""
+    if _type_order(left) != _type_order(right):
+        return None
+    if left is None or left is _MISSING:
+        return 0
+    try:
+        return (left > right) - (left < right)
+    except TypeError:
+        return None
+
+class _Descending:
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+def _sort_key(spec: List[Tuple[str, int]]):
+    def key(document):
+        parts = []
+        for field, direction in spec:
+            value = _get(document, field)
+            if isinstance(value, list) and value:
+                # Arrays sort by their smallest element ascending, largest descending
+                values = [_sort_value(item) for item in value]
+                value = min(values) if direction == ASCENDING else max(values)
+            else:
+                value = _sort_value(value)
+            parts.append(value if direction == ASCENDING else _Descending(value))
+        return parts
+    return key
+
+def _normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or ASCENDING)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+# Query matching
+
+def _matches_operator(values: List[Any], operator: str, argument) -> bool:
+    # `values` holds what the path resolved to; arrays also match by element
+    candidates = []
+    for value in values:
+        candidates.append(value)
+        if isinstance(value, list):
+            candidates.extend(value)
+    if operator == "$eq":
+        return _matches_equal(values, argument)
+    if operator == "$ne":
+        return not _matches_equal(values, argument)
+    if operator == "$in":
+        return any(_matches_equal(values, item) for item in argument)
+    if operator == "$nin":
+        return not any(_matches_equal(values, item) for item in argument)
+    if operator in ("$lt", "$lte", "$gt", "$gte"):
+        for candidate in candidates:
+            result = _compare(candidate, argument)
+            if result is None:
+                continue
+            if ((operator == "$lt" and result < 0) or (operator == "$lte" and result <= 0)
+                    or (operator == "$gt" and result > 0) or (operator == "$gte" and result >= 0)):
+                return True
+        return False
+    if operator == "$all":
+        return all(_matches_equal(values, item) for item in argument)
+    if operator == "$exists":
+        return bool(values) == bool(argument)
+    if operator == "$not":
+        return not _matches_condition(values, argument)
+    if operator == "$elemMatch":
+        return any(
+            isinstance(item, list) and any(
+                _matches(element, argument) if isinstance(element, dict)
+                else _matches_condition([element], argument)
+                for element in item
+            )
+            for item in values
+        )
+    if operator == "$size":
+        return any(isinstance(item, list) and len(item) == argument for item in values)
+    raise OperationFailure(f"unsupported query operator {operator}")
+
+def _matches_equal(values: List[Any], argument) -> bool:
+    if not values:
+        return argument is None
+    for value in values:
+        if _equal(value, argument):
+            return True
+        if type(value) is list:
+            # Strings only equal strings, so `in` is exact for them
+            if type(argument) is str:
+                if argument in value:
+                    return True
+            elif any(_equal(item, argument) for item in value):
+                return True
+    return False
+
+def _equal(left, right) -> bool:
+    if type(left) is type(right):
+        return left == right
+    if _type_order(left) != _type_order(right):
+        return False
+    return left == right
+
+def _matches_condition(values: List[Any], condition) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        if "$regex" in condition:
+            flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+            pattern = re.compile(condition["$regex"], flags)
+            condition = {key: value for key, value in condition.items() if key not in ("$regex", "$options")}
+            strings = [item for value in values for item in (value if isinstance(value, list) else [value])
+                       if isinstance(item, str)]
+            if not any(pattern.search(item) for item in strings):
+                return False
+        return all(_matches_operator(values, operator, argument) for operator, argument in condition.items())
+    return _matches_equal(values, condition)
+
+def _matches(document: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(_matches(document, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(document, clause) for clause in condition):
+                return False
+        elif key == "$nor":
+            if any(_matches(document, clause) for clause in condition):
+                return False
+        elif not _matches_condition(_get_values(document, key), condition):
+            return False
+    return True
+
+# Updates
+
+def _positional_index(document: dict, query: dict, array_field: str) -> int:
+    """Index of the first array element the query matched, for `field.$` updates"""
+    array = document.get(array_field) or []
+    for key, condition in query.items():
+        if key == array_field and isinstance(condition, dict) and "$elemMatch" in condition:
+            for index, element in enumerate(array):
+                if isinstance(element, dict) and _matches(element, condition["$elemMatch"]):
+                    return index
+        elif key.startswith(array_field + "."):
+            sub_path = key[len(array_field) + 1:]
+            for index, element in enumerate(array):
+                if _matches_condition(_get_values(element, sub_path), condition):
+                    return index
+    raise OperationFailure("The positional operator did not find the match needed from the query.")
+
+def _resolve_path(document: dict, path: str, query: dict) -> str:
+    if ".$." in path or path.endswith(".$"):
+        array_field = path.split(".$")[0]
+        return path.replace(".$", f".{_positional_index(document, query, array_field)}", 1)
+    return path
+
+def _apply_update(document: dict, update: dict, query: dict, inserting: bool = False) -> dict:
+    document = copy.deepcopy(document)
+    for operator, fields in update.items():
+        if operator == "$setOnInsert":
+            if inserting:
+                for path, value in fields.items():
+                    _set(document, path, copy.deepcopy(value))
+            continue
+        for path, value in fields.items():
+            path = _resolve_path(document, path, query)
+            if operator == "$set":
+                _set(document, path, copy.deepcopy(value))
+            elif operator == "$unset":
+                _unset(document, path)
+            elif operator == "$inc":
+                current = _get(document, path)
+                _set(document, path, (current or 0) + value)
+            elif operator == "$max":
+                current = _get(document, path, _MISSING)
+                if current is _MISSING or current is None or (_compare(value, current) or 0) > 0:
+                    _set(document, path, value)
+            elif operator in ("$push", "$addToSet"):
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                array = list(_get(document, path) or [])
+                for item in items:
+                    if operator == "$push" or not any(_equal(existing, item) for existing in array):
+                        array.append(copy.deepcopy(item))
+                _set(document, path, array)
+            elif operator == "$pull":
+                array = _get(document, path)
+                if isinstance(array, list):
+                    if isinstance(value, dict) and not any(key.startswith("$") for key in value):
+                        kept = [item for item in array if not (isinstance(item, dict) and _matches(item, value))]
+                    else:
+                        kept = [item for item in array if not _matches_condition([item], value)]
+                    _set(document, path, kept)
+            else:
+                raise OperationFailure(f"unsupported update operator {operator}")
+    return document
+
+def _upsert_base(query: dict) -> dict:
+    """The equality fields of a filter, which an upserted document starts with"""
+    document = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            if "$eq" in condition:
+                _set(document, key, condition["$eq"])
+            continue
+        _set(document, key, copy.deepcopy(condition))
+    return document
+
+# Projections
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return document
+    include_id = projection.get("_id", 1)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    if fields and all(not isinstance(value, dict) and value for value in fields.values()):
+        projected = {}
+        for path in fields:
+            _include(document, projected, path.split("."))
+        if include_id and "_id" in document:
+            projected["_id"] = document["_id"]
+        return projected
+    projected = copy.copy(document)
+    for path, value in fields.items():
+        if not value:
+            if "." in path:
+                projected = copy.deepcopy(projected)
+                _unset(projected, path)
+            else:
+                projected.pop(path, None)
+    if not include_id:
+        projected.pop("_id", None)
+    return projected
+
+def _referenced_fields(value, fields: Optional[set] = None) -> set:
+    """Top-level fields a filter, sort or pipeline stage refers to"""
+    fields = set() if fields is None else fields
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if not key.startswith("$"):
+                fields.add(key.split(".")[0])
+            _referenced_fields(item, fields)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _referenced_fields(item, fields)
+    elif isinstance(value, str) and value.startswith("$") and not value.startswith("$$"):
+        fields.add(value[1:].split(".")[0])
+    return fields
+
+def _prunable_fields(projection: Optional[dict], referenced: set) -> List[str]:
+    """Fields an exclusion projection drops that nothing else needs, so
+    they can be left out before documents are decoded"""
+    if not projection or any(value for key, value in projection.items() if key != "_id"):
+        return []
+    return [field for field, value in projection.items()
+            if not value and "." not in field and field not in referenced]
+
+def _include(source, target: dict, parts: List[str]):
+    key = parts[0]
+    if not isinstance(source, dict) or key not in source:
+        return
+    value = source[key]
+    if len(parts) == 1:
+        target[key] = value
+    elif isinstance(value, list):
+        existing = target.get(key) or [{} for _ in value]
+        for item, projected in zip(value, existing):
+            _include(item, projected, parts[1:])
+        target[key] = existing
+    elif isinstance(value, dict):
+        target.setdefault(key, {})
+        _include(value, target[key], parts[1:])
+
+# Aggregation expressions
+
+def _compile(expression):
+    """Turn an aggregation expression into a function of (document, variables),
+    so a stage resolves its operators once rather than once per document"""
+    if isinstance(expression, str) and expression.startswith("$$"):
+        name, _, path = expression[2:].partition(".")
+        if path:
+            return lambda document, variables: _get(variables.get(name), path)
+        return lambda document, variables: variables.get(name)
+    if isinstance(expression, str) and expression.startswith("$"):
+        path = expression[1:]
+        return lambda document, variables: _get(document, path)
+    if isinstance(expression, list):
+        items = [_compile(item) for item in expression]
+        return lambda document, variables: [item(document, variables) for item in items]
+    if not isinstance(expression, dict):
+        return lambda document, variables: expression
+    if len(expression) != 1 or not next(iter(expression)).startswith("$"):
+        fields = [(key, _compile(value)) for key, value in expression.items()]
+        return lambda document, variables: {key: value(document, variables) for key, value in fields}
+    operator, argument = next(iter(expression.items()))
+    if operator == "$literal":
+        return lambda document, variables: argument
+    if operator in ("$map", "$filter", "$let"):
+        return _compile_scoped(operator, argument)
+    if operator == "$cond":
+        condition, then, otherwise = (_compile(part) for part in (
+            argument if isinstance(argument, list) else (argument["if"], argument["then"], argument["else"])))
+        return lambda document, variables: (
+            then(document, variables) if condition(document, variables) else otherwise(document, variables))
+    if operator == "$size":
+        value = _compile(argument)
+        return lambda document, variables: len(value(document, variables) or [])
+    if operator not in _EXPRESSION_OPERATORS:
+        raise OperationFailure(f"unsupported expression operator {operator}")
+    function = _EXPRESSION_OPERATORS[operator]
+    arguments = [_compile(item) for item in argument]
+    return lambda document, variables: function(*[item(document, variables) for item in arguments])
+
+def _compile_scoped(operator: str, argument: dict):
+    if operator == "$let":
+        bound = [(name, _compile(value)) for name, value in argument["vars"].items()]
+        body = _compile(argument["in"])
+        return lambda document, variables: body(document, {
+            **variables, **{name: value(document, variables) for name, value in bound}})
+    name = argument.get("as", "this")
+    source = _compile(argument["input"])
+    if operator == "$map":
+        body = _compile(argument["in"])
+        return lambda document, variables: [
+            body(document, {**variables, name: item}) for item in source(document, variables) or []]
+    condition = _compile(argument["cond"])
+    return lambda document, variables: [
+        item for item in source(document, variables) or []
+        if condition(document, {**variables, name: item})]
+
+def _ordered(left, right) -> int:
+    result = _compare(left, right)
+    if result is None:
+        result = (_type_order(left) > _type_order(right)) - (_type_order(left) < _type_order(right))
+    return result
+
+def _contains(value, array) -> bool:
+    if type(value) is str and type(array) is list:
+        return value in array
+    return any(_equal(value, item) for item in array or [])
+
+def _element_at(array, index):
+    return array[index] if array and -len(array) <= index < len(array) else None
+
+_EXPRESSION_OPERATORS = {
+    "$add": lambda *values: sum(value or 0 for value in values),
+    "$eq": _equal,
+    "$ne": lambda left, right: not _equal(left, right),
+    "$lt": lambda left, right: _ordered(left, right) < 0,
+    "$lte": lambda left, right: _ordered(left, right) <= 0,
+    "$gt": lambda left, right: _ordered(left, right) > 0,
+    "$gte": lambda left, right: _ordered(left, right) >= 0,
+    "$and": lambda *values: all(values),
+    "$or": lambda *values: any(values),
+    "$in": _contains,
+    "$ifNull": lambda value, fallback: fallback if value is None else value,
+    "$arrayElemAt": _element_at,
+}
+
+# SQL pushdown
+
+# Carries a row's id through the ranking stages of an aggregation
+_ROWID = "\0rowid"
+
+def _field_sql(field: str) -> str:
+    return f"json_extract(doc, '$.{field}')"
+
+_COMPARISONS = {"$lt": "<", "$lte": "<=", "$gt": ">", "$gte": ">="}
+
+class _QueryCompiler:
+    """Translates the indexable part of a filter into SQL.
+
+    The SQL selects a superset of the matching documents; `exact` tells
+    whether it selects exactly them, so limits and counts can run in SQL.
+    """
+
+    def __init__(self, table: str, indexed: set, multikey: set, columns: Optional[Dict[str, str]] = None):
+        self.keys_table = _quote(table + KEYS_SUFFIX)
+        self.indexed = indexed
+        self.multikey = multikey
+        # Fields computed by earlier pipeline stages, as SQL expressions
+        self.columns = columns or {}
+        self.exact = True
+
+    def column(self, field: str) -> str:
+        return self.columns.get(field) or _field_sql(field)
+
+    def compile(self, query: dict) -> Tuple[str, list]:
+        clauses, params = [], []
+        for key, condition in query.items():
+            if key in ("$and", "$or"):
+                parts = [self.compile(clause) for clause in condition]
+                joiner = " AND " if key == "$and" else " OR "
+                clauses.append("(" + joiner.join(f"({sql})" for sql, _ in parts) + ")")
+                params.extend(param for _, part_params in parts for param in part_params)
+                continue
+            sql = self._field(key, condition, params)
+            if sql:
+                clauses.append(sql)
+        return (" AND ".join(clauses) or "1"), params
+
+    def _field(self, field: str, condition, params: list) -> Optional[str]:
+        if field.startswith("$") or (field not in self.indexed and field not in self.columns):
+            self.exact = False
+            return None
+        if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            clauses = [self._operator(field, operator, argument, params) for operator, argument in condition.items()]
+            clauses = [clause for clause in clauses if clause]
+            return " AND ".join(clauses) if clauses else None
+        return self._operator(field, "$eq", condition, params)
+
+    def _operator(self, field: str, operator: str, argument, params: list) -> Optional[str]:
+        column = self.column(field)
+        if operator == "$eq" and argument is None:
+            if field in self.multikey:
+                self.exact = False
+            return f"{column} IS NULL"
+        if operator == "$eq" and _is_scalar(argument):
+            return self._either(field, "= ?", [_sql_scalar(argument)], params)
+        if operator in ("$in", "$all") and all(_is_scalar(item) for item in argument) and None not in argument:
+            values = [_sql_scalar(item) for item in argument]
+            if not values:
+                return "0" if operator == "$in" else None
+            placeholders = ", ".join("?" for _ in values)
+            if operator == "$in":
+                return self._either(field, f"IN ({placeholders})", values, params)
+            # Every value must be present: one indexed lookup per value
+            return " AND ".join(self._either(field, "= ?", [value], params) for value in values)
+        if operator in _COMPARISONS and _is_scalar(argument) and argument is not None:
+            if field in self.multikey or isinstance(argument, bool):
+                self.exact = False
+            clause = self._either(field, f"{_COMPARISONS[operator]} ?", [_sql_scalar(argument)], params)
+            if field in self.multikey:
+                return clause
+            # Like Mongo, only compare values of the same type
+            if isinstance(argument, datetime):
+                params.append(_DATETIME_TAG)
+                return f"{clause} AND {column} >= ?"
+            if isinstance(argument, (str, date)):
+                params.append(_DATETIME_TAG)
+                return f"{clause} AND typeof({column}) = 'text' AND {column} < ?"
+            return f"{clause} AND typeof({column}) IN ('integer', 'real')"
+        self.exact = False
+        return None
+
+    def _either(self, field: str, predicate: str, values: list, params: list) -> str:
+        column = self.column(field)
+        if field not in self.multikey:
+            params.extend(values)
+            return f"{column} {predicate}"
+        params.extend(values)
+        params.append(field)
+        params.extend(values)
+        return (f"({column} {predicate} OR rowid IN "
+                f"(SELECT row FROM {self.keys_table} WHERE field = ? AND value {predicate}))")
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _literal(value) -> str:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise _NotPushable
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+class _NotPushable(Exception):
+    """An aggregation expression with no SQL translation"""
+
+def _expression_sql(expression, columns: Dict[str, str]) -> str:
+    """SQL computing the aggregation expressions search ranking uses"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        field = expression[1:]
+        if field in columns:
+            return columns[field]
+        raise _NotPushable
+    if not isinstance(expression, dict) or len(expression) != 1:
+        return _literal(expression)
+    operator, argument = next(iter(expression.items()))
+    if operator == "$add":
+        return "(" + " + ".join(f"coalesce({_expression_sql(item, columns)}, 0)" for item in argument) + ")"
+    if operator == "$cond":
+        condition, then, otherwise = argument if isinstance(argument, list) else (
+            argument["if"], argument["then"], argument["else"])
+        return (f"(CASE WHEN {_expression_sql(condition, columns)} THEN {_expression_sql(then, columns)} "
+                f"ELSE {_expression_sql(otherwise, columns)} END)")
+    if operator == "$in":
+        value, array = argument
+        if not (isinstance(array, str) and array.startswith("$") and not array.startswith("$$")
+                and array[1:] not in columns):
+            raise _NotPushable
+        return (f"EXISTS (SELECT 1 FROM json_each(doc, '$.{array[1:]}') "
+                f"WHERE value = {_literal(value)})")
+    raise _NotPushable
+
+# Results
+
+class _Result(SimpleNamespace):
+    acknowledged = True
+
+def _duplicate_key_error(error: sqlite3.IntegrityError, index: int = 0) -> DuplicateKeyError:
+    message = f"E11000 duplicate key error: {error}"
+    return DuplicateKeyError(message, 11000, {"index": index, "code": 11000, "errmsg": message})
+
+class _AfterCommit(Exception):
+    """Raises `error` once the writes that did succeed are committed, like
+    the partial failures of Mongo's bulk writes"""
+
+    def __init__(self, error: Exception):
+        super().__init__(error)
+        self.error = error
+
+# Engine
+
+class _Engine:
+    """Connections to one database file.
+
+    Writes run one at a time on a dedicated thread. Reads run on a small
+    pool of threads with their own connections, each inside a read
+    transaction, so in WAL mode they see a consistent snapshot and neither
+    wait for writes nor hold them up.
+    """
+
+    def __init__(self, path: str, read_threads: int = READ_THREADS):
+        self.path = path
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-store-write")
+        # Every connection to ":memory:" is a separate database
+        self._readers = (self._writer if path == ":memory:" else
+                         ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix="sqlite-store-read"))
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        # Tables (with their keys tables) known to exist
+        self._tables: set = set()
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's connection"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            if self.path != ":memory:":
+                connection.execute("PRAGMA journal_mode = WAL")
+                connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS _collection_meta "
+                "(collection TEXT, kind TEXT, field TEXT, info TEXT, PRIMARY KEY (collection, kind, field))"
+            )
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    async def read(self, table: Optional[str], function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._in_transaction, "BEGIN", table, function, args)
+
+    async def write(self, table: str, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._in_transaction, "BEGIN IMMEDIATE", table, function, args)
+
+    def _in_transaction(self, begin: str, table: Optional[str], function, args):
+        connection = self.connection
+        if table is not None:
+            self.ensure_table(table)
+        connection.execute(begin)
+        try:
+            result = function(*args)
+        except _AfterCommit as e:
+            connection.execute("COMMIT")
+            raise e.error
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    def close(self):
+        for executor in {self._readers, self._writer}:
+            executor.shutdown(wait=True)
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._tables.clear()
+
+    def ensure_table(self, table: str):
+        if table in self._tables:
+            return
+        connection = self.connection
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} (_id TEXT PRIMARY KEY, doc TEXT NOT NULL)")
+        keys = _quote(table + KEYS_SUFFIX)
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {keys} (row INTEGER NOT NULL, field TEXT NOT NULL, value)")
+        connection.execute(f"CREATE INDEX IF NOT EXISTS {_quote(table + '$keys_lookup')} ON {keys} (field, value, row)")
+        connection.execute(f"CREATE INDEX IF NOT EXISTS {_quote(table + '$keys_row')} ON {keys} (row)")
+        self._tables.add(table)
+
+    def schema(self, table: str) -> dict:
+        """Indexed fields, multikey fields and TTL settings of a collection"""
+        self.ensure_table(table)
+        rows = self.connection.execute(
+            "SELECT kind, field, info FROM _collection_meta WHERE collection = ?", (table,)
+        ).fetchall()
+        schema = {"indexed": set(), "multikey": set(), "ttl": {}, "indexes": {}}
+        for kind, field, info in rows:
+            if kind == "index":
+                definition = json.loads(info)
+                schema["indexes"][field] = definition
+                schema["indexed"].update(name for name, _ in definition["key"])
+                if definition.get("expireAfterSeconds") is not None:
+                    schema["ttl"][definition["key"][0][0]] = definition["expireAfterSeconds"]
+            elif kind == "multikey":
+                schema["multikey"].add(field)
+        return schema
+
+class SQLiteCursor:
+    """The parts of a Motor cursor the repositories use"""
+
+    def __init__(self, collection: "SQLiteCollection", query: dict, projection: Optional[dict]):
+        self.collection = collection
+        self.query = query or {}
+        self.projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._limit = 0
+        self._skip = 0
+        self._results: Optional[List[dict]] = None
+
+    def sort(self, key_or_list, direction=None) -> "SQLiteCursor":
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def limit(self, limit: int) -> "SQLiteCursor":
+        self._limit = limit
+        return self
+
+    def skip(self, skip: int) -> "SQLiteCursor":
+        self._skip = skip
+        return self
+
+    def batch_size(self, batch_size: int) -> "SQLiteCursor":
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = await self.collection._engine.read(
+            self.collection.table, self.collection._find, self.query, self.projection, self._sort, self._skip, self._limit
+        )
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in await self.to_list():
+            yield document
+
+    async def explain(self) -> dict:
+        plan = await self.collection._engine.read(self.collection.table, self.collection._explain, self.query, self._sort)
+        return {"queryPlanner": {"winningPlan": plan}}
+
+class SQLiteAggregationCursor:
+    def __init__(self, collection: "SQLiteCollection", pipeline: List[dict]):
+        self.collection = collection
+        self.pipeline = pipeline
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = await self.collection._engine.read(self.collection.table, self.collection._aggregate, self.pipeline)
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in await self.to_list():
+            yield document
+
+class SQLiteCollection:
+    def __init__(self, database: "SQLiteDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.table = f"{database.name}.{name}"
+        self._engine = database.client._engine
+
+    # Reads
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs) -> SQLiteCursor:
+        cursor = SQLiteCursor(self, filter or {}, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None,
+                       session=None, **kwargs) -> Optional[dict]:
+        results = await self.find(filter, projection, **kwargs).limit(1).to_list()
+        return results[0] if results else None
+
+    async def count_documents(self, filter: dict, session=None, **kwargs) -> int:
+        return await self._engine.read(self.table, self._count, filter)
+
+    def aggregate(self, pipeline: List[dict], session=None, **kwargs) -> SQLiteAggregationCursor:
+        return SQLiteAggregationCursor(self, pipeline)
+
+    # Writes
+
+    async def insert_one(self, document: dict, session=None, **kwargs):
+        document.setdefault("_id", uuid.uuid4().hex)
+        try:
+            await self._engine.write(self.table, self._insert_many, [document], True)
+        except BulkWriteError as e:
+            raise DuplicateKeyError(e.details["writeErrors"][0]["errmsg"], 11000)
+        return _Result(inserted_id=document["_id"])
+
+    async def insert_many(self, documents: Iterable[dict], ordered: bool = True, session=None, **kwargs):
+        documents = list(documents)
+        for document in documents:
+            document.setdefault("_id", uuid.uuid4().hex)
+        await self._engine.write(self.table, self._insert_many, documents, ordered)
+        return _Result(inserted_ids=[document["_id"] for document in documents])
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, session=None, **kwargs):
+        return await self._engine.write(self.table, self._update, filter, update, upsert, False)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, session=None, **kwargs):
+        return await self._engine.write(self.table, self._update, filter, update, upsert, True)
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, session=None, **kwargs):
+        return await self._engine.write(self.table, self._replace, filter, replacement, upsert)
+
+    async def delete_one(self, filter: dict, session=None, **kwargs):
+        return await self._engine.write(self.table, self._delete, filter, False)
+
+    async def delete_many(self, filter: dict, session=None, **kwargs):
+        return await self._engine.write(self.table, self._delete, filter, True)
+
+    async def find_one_and_update(self, filter: dict, update: dict, projection: Optional[dict] = None,
+                                  upsert: bool = False, return_document=ReturnDocument.BEFORE,
+                                  session=None, **kwargs) -> Optional[dict]:
+        return await self._engine.write(
+            self.table, self._find_and_modify, filter, update, projection, upsert, return_document
+        )
+
+    async def find_one_and_delete(self, filter: dict, projection: Optional[dict] = None,
+                                  session=None, **kwargs) -> Optional[dict]:
+        return await self._engine.write(self.table, self._find_and_delete, filter, projection)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, session=None, **kwargs):
+        return await self._engine.write(self.table, self._bulk_write, requests, ordered)
+
+    # Indexes
+
+    async def create_indexes(self, models: List[Any], **kwargs) -> List[str]:
+        return await self._engine.write(self.table, self._create_indexes, models)
+
+    async def create_index(self, keys, **kwargs) -> str:
+        from pymongo import IndexModel
+        return (await self.create_indexes([IndexModel(keys, **kwargs)]))[0]
+
+    async def index_information(self) -> dict:
+        schema = await self._engine.read(self.table, self._engine.schema, self.table)
+        information = {"_id_": {"key": [("_id", 1)]}}
+        information.update(schema["indexes"])
+        return information
+
+    async def drop(self):
+        await self._engine.write(self.table, self._drop)
+
+    # Implementation, run on the engine thread
+
+    def _select(self, query: dict, sort: List[Tuple[str, int]], prune: Iterable[str] = ()):
+        """Rows possibly matching `query`, in `sort` order where SQL can
+        sort them, without the `prune` fields; returns (rows, exact, sorted, statement)"""
+        schema = self._engine.schema(self.table)
+        compiler = _QueryCompiler(self.table, schema["indexed"], schema["multikey"])
+        where, params = compiler.compile(query)
+        if not compiler.exact:
+            # The documents are matched again in Python
+            prune = [field for field in prune if field not in _referenced_fields(query)]
+        document = "doc"
+        if prune:
+            # Large unused fields (search terms) are not worth decoding
+            document = "json_remove(doc, " + ", ".join(f"'$.{field}'" for field in prune) + ")"
+        sql = f"SELECT rowid, {document} FROM {_quote(self.table)} WHERE {where}"
+        sql_sorted = all(field in schema["indexed"] and field not in schema["multikey"] for field, _ in sort)
+        if sort and sql_sorted:
+            sql += " ORDER BY " + ", ".join(
+                f"{_field_sql(field)} {'ASC' if direction == ASCENDING else 'DESC'}" for field, direction in sort
+            )
+        return self._engine.connection.execute(sql, params), compiler.exact, sql_sorted or not sort, (sql, params)
+
+    def _matching(self, query: dict, sort: List[Tuple[str, int]] = (), prune: Iterable[str] = ()):
+        """(rowid, document) pairs matching `query`, in `sort` order"""
+        rows, exact, sql_sorted, _ = self._select(query, list(sort), prune)
+        if sort and not sql_sorted:
+            matches = [(rowid, document) for rowid, document in
+                       ((rowid, _loads(text)) for rowid, text in rows) if exact or _matches(document, query)]
+            rows.close()
+            yield from sorted(matches, key=lambda pair: _sort_key(list(sort))(pair[1]))
+            return
+        try:
+            for rowid, text in rows:
+                document = _loads(text)
+                if exact or _matches(document, query):
+                    yield rowid, document
+        finally:
+            # Callers stop at a limit; do not leave the statement open
+            rows.close()
+
+    def _find(self, query: dict, projection: Optional[dict], sort, skip: int, limit: int,
+              prune: Optional[List[str]] = None) -> List[dict]:
+        if prune is None:
+            prune = _prunable_fields(projection, _referenced_fields([field for field, _ in sort]))
+        results = []
+        for _, document in self._matching(query, sort, prune):
+            if skip:
+                skip -= 1
+                continue
+            results.append(_project(document, projection))
+            if limit and len(results) >= limit:
+                break
+        return results
+
+    def _count(self, query: dict) -> int:
+        rows, exact, _, (sql, params) = self._select(query, [])
+        if exact:
+            rows.close()
+            return self._engine.connection.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+        return sum(1 for _, text in rows if _matches(_loads(text), query))
+
+    def _explain(self, query: dict, sort) -> dict:
+        rows, _, _, (sql, params) = self._select(query, list(sort))
+        rows.close()
+        details = [row[-1] for row in self._engine.connection.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        indexed = any("USING INDEX" in detail or "USING COVERING INDEX" in detail
+                      or "USING ROWID" in detail or "PRIMARY KEY" in detail for detail in details)
+        stage = "IXSCAN" if indexed else "COLLSCAN"
+        stages = {"stage": "FETCH", "inputStage": {"stage": stage, "details": details}}
+        if any("TEMP B-TREE" in detail for detail in details):
+            stages = {"stage": "SORT", "inputStage": stages}
+        return stages
+
+    def _store(self, rowid: Optional[int], document: dict, schema: dict) -> int:
+        connection = self._engine.connection
+        table = _quote(self.table)
+        text = _dumps(document)
+        document_id = json.dumps(_encode_value(document["_id"]))
+        try:
+            if rowid is None:
+                rowid = connection.execute(
+                    f"INSERT INTO {table} (_id, doc) VALUES (?, ?)", (document_id, text)
+                ).lastrowid
+            else:
+                connection.execute(f"UPDATE {table} SET _id = ?, doc = ? WHERE rowid = ?",
+                                   (document_id, text, rowid))
+        except sqlite3.IntegrityError as e:
+            raise _duplicate_key_error(e)
+        self._store_keys(rowid, document, schema)
+        return rowid
+
+    def _store_keys(self, rowid: int, document: dict, schema: dict):
+        connection = self._engine.connection
+        keys = _quote(self.table + KEYS_SUFFIX)
+        connection.execute(f"DELETE FROM {keys} WHERE row = ?", (rowid,))
+        entries = []
+        for field in schema["indexed"]:
+            value = _get(document, field)
+            if not isinstance(value, list):
+                continue
+            if field not in schema["multikey"]:
+                connection.execute(
+                    "INSERT OR IGNORE INTO _collection_meta (collection, kind, field, info) VALUES (?, 'multikey', ?, '')",
+                    (self.table, field)
+                )
+                schema["multikey"].add(field)
+            entries.extend((rowid, field, _sql_scalar(item)) for item in {
+                json.dumps(_encode_value(item)): item for item in value if _is_scalar(item)
+            }.values())
+        if entries:
+            connection.executemany(f"INSERT INTO {keys} (row, field, value) VALUES (?, ?, ?)", entries)
+
+    def _remove(self, rowid: int):
+        connection = self._engine.connection
+        connection.execute(f"DELETE FROM {_quote(self.table)} WHERE rowid = ?", (rowid,))
+        connection.execute(f"DELETE FROM {_quote(self.table + KEYS_SUFFIX)} WHERE row = ?", (rowid,))
+
+    def _expire(self, schema: dict):
+        """Remove documents past a TTL index's expiry, like Mongo's TTL monitor"""
+        for field, seconds in schema["ttl"].items():
+            cutoff = datetime.utcnow() - timedelta(seconds=seconds)
+            for rowid, _ in list(self._matching({field: {"$lt": cutoff}})):
+                self._remove(rowid)
+
+    def _insert_many(self, documents: List[dict], ordered: bool):
+        schema = self._engine.schema(self.table)
+        if schema["ttl"]:
+            self._expire(schema)
+        errors = []
+        inserted = 0
+        for index, document in enumerate(documents):
+            try:
+                self._store(None, document, schema)
+                inserted += 1
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise _AfterCommit(BulkWriteError({"writeErrors": errors, "nInserted": inserted, "nMatched": 0,
+                                  "nModified": 0, "nRemoved": 0, "nUpserted": 0, "upserted": []}))
+
+    def _update(self, query: dict, update: dict, upsert: bool, multi: bool):
+        schema = self._engine.schema(self.table)
+        matched = modified = 0
+        for rowid, document in list(self._matching(query)):
+            matched += 1
+            updated = _apply_update(document, update, query)
+            if updated != document:
+                self._store(rowid, updated, schema)
+                modified += 1
+            if not multi:
+                break
+        upserted_id = None
+        if not matched and upsert:
+            document = _apply_update(_upsert_base(query), update, query, inserting=True)
+            document.setdefault("_id", uuid.uuid4().hex)
+            self._store(None, document, schema)
+            upserted_id = document["_id"]
+        return _Result(matched_count=matched, modified_count=modified, upserted_id=upserted_id)
+
+    def _replace(self, query: dict, replacement: dict, upsert: bool):
+        schema = self._engine.schema(self.table)
+        for rowid, document in self._matching(query):
+            replacement = {**replacement, "_id": document["_id"]}
+            self._store(rowid, replacement, schema)
+            return _Result(matched_count=1, modified_count=int(replacement != document), upserted_id=None)
+        if upsert:
+            document = {**_upsert_base(query), **replacement}
+            document.setdefault("_id", uuid.uuid4().hex)
+            self._store(None, document, schema)
+            return _Result(matched_count=0, modified_count=0, upserted_id=document["_id"])
+        return _Result(matched_count=0, modified_count=0, upserted_id=None)
+
+    def _delete(self, query: dict, multi: bool):
+        deleted = 0
+        for rowid, _ in list(self._matching(query)):
+            self._remove(rowid)
+            deleted += 1
+            if not multi:
+                break
+        return _Result(deleted_count=deleted)
+
+    def _find_and_modify(self, query: dict, update: dict, projection: Optional[dict],
+                         upsert: bool, return_document) -> Optional[dict]:
+        schema = self._engine.schema(self.table)
+        for rowid, document in self._matching(query):
+            updated = _apply_update(document, update, query)
+            self._store(rowid, updated, schema)
+            return _project(updated if return_document == ReturnDocument.AFTER else document, projection)
+        if not upsert:
+            return None
+        document = _apply_update(_upsert_base(query), update, query, inserting=True)
+        document.setdefault("_id", uuid.uuid4().hex)
+        self._store(None, document, schema)
+        return _project(document, projection) if return_document == ReturnDocument.AFTER else None
+
+    def _find_and_delete(self, query: dict, projection: Optional[dict]) -> Optional[dict]:
+        for rowid, document in self._matching(query):
+            self._remove(rowid)
+            return _project(document, projection)
+        return None
+
+    def _bulk_write(self, requests: List[Any], ordered: bool):
+        counts = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0}
+        upserted = []
+        errors = []
+        for index, request in enumerate(requests):
+            connection = self._engine.connection
+            connection.execute("SAVEPOINT bulk_operation")
+            try:
+                if isinstance(request, InsertOne):
+                    request._doc.setdefault("_id", uuid.uuid4().hex)
+                    self._store(None, request._doc, self._engine.schema(self.table))
+                    counts["nInserted"] += 1
+                elif isinstance(request, DeleteOne):
+                    counts["nRemoved"] += self._delete(request._filter, False).deleted_count
+                else:
+                    if isinstance(request, ReplaceOne):
+                        result = self._replace(request._filter, request._doc, request._upsert)
+                    elif isinstance(request, UpdateOne):
+                        result = self._update(request._filter, request._doc, request._upsert, False)
+                    else:
+                        result = self._update(request._filter, request._doc, request._upsert, True)
+                    counts["nMatched"] += result.matched_count
+                    counts["nModified"] += result.modified_count
+                    if result.upserted_id is not None:
+                        counts["nUpserted"] += 1
+                        upserted.append({"index": index, "_id": result.upserted_id})
+                connection.execute("RELEASE bulk_operation")
+            except DuplicateKeyError as e:
+                connection.execute("ROLLBACK TO bulk_operation")
+                connection.execute("RELEASE bulk_operation")
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise _AfterCommit(BulkWriteError({"writeErrors": errors, "upserted": upserted, **counts}))
+        return _Result(
+            inserted_count=counts["nInserted"], matched_count=counts["nMatched"],
+            modified_count=counts["nModified"], deleted_count=counts["nRemoved"],
+            upserted_count=counts["nUpserted"], upserted_ids={entry["index"]: entry["_id"] for entry in upserted},
+        )
+
+    def _create_indexes(self, models: List[Any]) -> List[str]:
+        connection = self._engine.connection
+        table = _quote(self.table)
+        names = []
+        for model in models:
+            document = model.document
+            name = document["name"]
+            keys = list(document["key"].items())
+            columns = ", ".join(
+                f"{_field_sql(field)}{' DESC' if direction == -1 else ''}" for field, direction in keys
+            )
+            conditions = []
+            if document.get("sparse"):
+                conditions += [f"{_field_sql(field)} IS NOT NULL" for field, _ in keys]
+            partial = document.get("partialFilterExpression", {})
+            for field, condition in partial.items():
+                if condition != {"$exists": True}:
+                    raise OperationFailure(f"unsupported partial index filter on {field}")
+                conditions.append(f"{_field_sql(field)} IS NOT NULL")
+            where = " WHERE " + " AND ".join(conditions) if conditions else ""
+            unique = "UNIQUE " if document.get("unique") else ""
+            try:
+                connection.execute(
+                    f"CREATE {unique}INDEX IF NOT EXISTS {_quote(self.table + '.' + name)} ON {table} ({columns}){where}"
+                )
+            except sqlite3.IntegrityError as e:
+                raise _duplicate_key_error(e)
+            info = {"key": keys, "unique": bool(document.get("unique")), "sparse": bool(document.get("sparse"))}
+            if partial:
+                info["partialFilterExpression"] = partial
+            if document.get("expireAfterSeconds") is not None:
+                info["expireAfterSeconds"] = document["expireAfterSeconds"]
+            connection.execute(
+                "INSERT OR REPLACE INTO _collection_meta (collection, kind, field, info) VALUES (?, 'index', ?, ?)",
+                (self.table, name, json.dumps(info))
+            )
+            names.append(name)
+        # Index the array values of documents stored before the index existed
+        schema = self._engine.schema(self.table)
+        for rowid, text in list(connection.execute(f"SELECT rowid, doc FROM {table}")):
+            document = _loads(text)
+            if any(isinstance(_get(document, field), list) for field in schema["indexed"]):
+                self._store_keys(rowid, document, schema)
+        return names
+
+    def _drop(self):
+        connection = self._engine.connection
+        for index_name, in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (self.table,)
+        ).fetchall():
+            connection.execute(f"DROP INDEX IF EXISTS {_quote(index_name)}")
+        connection.execute(f"DROP TABLE IF EXISTS {_quote(self.table)}")
+        connection.execute(f"DROP TABLE IF EXISTS {_quote(self.table + KEYS_SUFFIX)}")
+        connection.execute("DELETE FROM _collection_meta WHERE collection = ?", (self.table,))
+        self._engine._tables.discard(self.table)
+
+    # Aggregation
+
+    def _aggregate(self, pipeline: List[dict]) -> List[dict]:
+        stages = list(pipeline)
+        if stages and "$indexStats" in stages[0]:
+            raise OperationFailure("$indexStats is not supported by the SQLite backend")
+        query = stages.pop(0)["$match"] if stages and "$match" in stages[0] else {}
+        # A sort and limit right after the match run like a find
+        sort: List[Tuple[str, int]] = []
+        limit = 0
+        if stages and "$sort" in stages[0]:
+            sort = _normalize_sort(stages.pop(0)["$sort"])
+            if stages and "$limit" in stages[0]:
+                limit = stages.pop(0)["$limit"]
+        prune = []
+        if stages and "$project" in stages[-1]:
+            referenced = _referenced_fields([[field for field, _ in sort], stages[:-1]])
+            prune = _prunable_fields(stages[-1]["$project"], referenced)
+        if not sort:
+            ranked = self._ranked(query, stages, prune)
+            if ranked is not None:
+                return ranked
+        documents = self._find(query, None, sort, 0, limit, prune)
+        return self._run_stages(documents, stages)
+
+    def _ranked(self, query: dict, stages: List[dict], prune: List[str]) -> Optional[List[dict]]:
+        """Run `$addFields`/`$match` stages followed by `$sort` and `$limit`
+        (search ranking) on just the fields they read, then decode the full
+        documents of the rows that made the limit. None for other pipelines."""
+        end = 0
+        while end < len(stages) and next(iter(stages[end])) in ("$addFields", "$match"):
+            end += 1
+        if not (0 < end and end + 1 < len(stages)
+                and "$sort" in stages[end] and "$limit" in stages[end + 1]):
+            return None
+        ranking = stages[:end + 2]
+        try:
+            documents = self._ranked_in_sql(query, ranking, prune)
+        except _NotPushable:
+            documents = self._ranked_in_python(query, ranking, prune)
+        return self._run_stages(documents, stages[end + 2:])
+
+    def _ranked_in_sql(self, query: dict, ranking: List[dict], prune: List[str]) -> List[dict]:
+        """Compute, filter, sort and limit in one statement"""
+        schema = self._engine.schema(self.table)
+        columns: Dict[str, str] = {}
+        where, params = [], []
+        for stage in ranking[:-2]:
+            if "$addFields" in stage:
+                for field, expression in stage["$addFields"].items():
+                    columns[field] = _expression_sql(expression, columns)
+                continue
+            compiler = _QueryCompiler(self.table, schema["indexed"], schema["multikey"], columns)
+            sql, stage_params = compiler.compile(stage["$match"])
+            if not compiler.exact:
+                raise _NotPushable
+            where.append(sql)
+            params.extend(stage_params)
+        compiler = _QueryCompiler(self.table, schema["indexed"], schema["multikey"])
+        sql, query_params = compiler.compile(query)
+        if not compiler.exact:
+            raise _NotPushable
+        order = []
+        for field, direction in _normalize_sort(ranking[-2]["$sort"]):
+            if field not in columns and (field not in schema["indexed"] or field in schema["multikey"]):
+                raise _NotPushable
+            order.append(f"{columns.get(field) or _field_sql(field)} {'ASC' if direction == ASCENDING else 'DESC'}")
+        document_sql = "doc"
+        if prune:
+            document_sql = "json_remove(doc, " + ", ".join(f"'$.{field}'" for field in prune) + ")"
+        added = list(columns)
+        rows = self._engine.connection.execute(
+            f"SELECT {', '.join([document_sql] + [columns[field] for field in added])} "
+            f"FROM {_quote(self.table)} WHERE {' AND '.join([sql] + where)} "
+            f"ORDER BY {', '.join(order)} LIMIT ?",
+            query_params + params + [ranking[-1]["$limit"]]
+        )
+        documents = []
+        for text, *values in rows:
+            document = _loads(text)
+            document.update(zip(added, values))
+            documents.append(document)
+        return documents
+
+    def _ranked_in_python(self, query: dict, ranking: List[dict], prune: List[str]) -> List[dict]:
+        """Rank on the fields the ranking reads, then decode the winners"""
+        added = {field for stage in ranking if "$addFields" in stage for field in stage["$addFields"]}
+        fields = _referenced_fields(ranking) - added
+        schema = self._engine.schema(self.table)
+        compiler = _QueryCompiler(self.table, schema["indexed"], schema["multikey"])
+        where, params = compiler.compile(query)
+        if not compiler.exact:
+            fields |= _referenced_fields(query)
+        columns = ", ".join(f"'{field}', json_extract(doc, '$.{field}')" for field in sorted(fields))
+        rows = self._engine.connection.execute(
+            f"SELECT rowid, json_object({columns}) FROM {_quote(self.table)} WHERE {where}", params
+        )
+        partial = []
+        for rowid, text in rows:
+            document = _loads(text)
+            if compiler.exact or _matches(document, query):
+                document[_ROWID] = rowid
+                partial.append(document)
+        partial = self._run_stages(partial, ranking)
+        full = {}
+        rowids = [document[_ROWID] for document in partial]
+        document_sql = "doc"
+        if prune:
+            document_sql = "json_remove(doc, " + ", ".join(f"'$.{field}'" for field in prune) + ")"
+        for start in range(0, len(rowids), 500):
+            chunk = rowids[start:start + 500]
+            full.update(self._engine.connection.execute(
+                f"SELECT rowid, {document_sql} FROM {_quote(self.table)} "
+                f"WHERE rowid IN ({', '.join('?' for _ in chunk)})", chunk
+            ))
+        return [
+            {**_loads(full[document[_ROWID]]), **{field: document[field] for field in added if field in document}}
+            for document in partial
+        ]
+
+    def _run_stages(self, documents: List[dict], stages: List[dict]) -> List[dict]:
+        for stage in stages:
+            (name, argument), = stage.items()
+            if name == "$match":
+                documents = [document for document in documents if _matches(document, argument)]
+            elif name == "$sort":
+                documents.sort(key=_sort_key(_normalize_sort(argument)))
+            elif name == "$limit":
+                documents = documents[:argument]
+            elif name == "$skip":
+                documents = documents[argument:]
+            elif name == "$project":
+                documents = self._project_stage(documents, argument)
+            elif name == "$addFields":
+                fields = [(field, _compile(expression)) for field, expression in argument.items()]
+                documents = [
+                    {**document, **{field: value(document, {}) for field, value in fields}}
+                    for document in documents
+                ]
+            elif name == "$unwind":
+                path = (argument if isinstance(argument, str) else argument["path"])[1:]
+                unwound = []
+                for document in documents:
+                    values = _get(document, path)
+                    if isinstance(values, list):
+                        for value in values:
+                            item = copy.copy(document)
+                            _set(item, path, value)
+                            unwound.append(item)
+                    elif values is not None:
+                        unwound.append(document)
+                documents = unwound
+            elif name == "$group":
+                documents = self._group(documents, argument)
+            elif name == "$facet":
+                documents = [{
+                    field: self._run_stages(list(documents), sub_pipeline)
+                    for field, sub_pipeline in argument.items()
+                }]
+            elif name == "$lookup":
+                documents = self._lookup(documents, argument)
+            elif name == "$count":
+                documents = [{argument: len(documents)}] if documents else []
+            else:
+                raise OperationFailure(f"unsupported aggregation stage {name}")
+        return documents
+
+    @staticmethod
+    def _project_stage(documents: List[dict], projection: dict) -> List[dict]:
+        computed = [(field, _compile(value)) for field, value in projection.items()
+                    if not isinstance(value, (int, bool))]
+        plain = {field: value for field, value in projection.items() if isinstance(value, (int, bool))}
+        projected = []
+        for document in documents:
+            result = _project(document, plain)
+            for field, value in computed:
+                result[field] = value(document, {})
+            projected.append(result)
+        return projected
+
+    @staticmethod
+    def _group(documents: List[dict], specification: dict) -> List[dict]:
+        group_key = _compile(specification["_id"])
+        accumulators = [
+            (field, operator, _compile(expression))
+            for field, accumulator in specification.items() if field != "_id"
+            for operator, expression in accumulator.items()
+        ]
+        groups: Dict[Any, dict] = {}
+        for document in documents:
+            key = group_key(document, {})
+            group_id = (type(key), key) if type(key) in (str, int, type(None)) else _dumps({"_id": key})
+            group = groups.get(group_id)
+            if group is None:
+                group = groups[group_id] = {"_id": key}
+            for field, operator, expression in accumulators:
+                value = expression(document, {})
+                if operator == "$sum":
+                    group[field] = group.get(field, 0) + (value if isinstance(value, (int, float)) else 0)
+                elif operator == "$push":
+                    group.setdefault(field, []).append(value)
+                elif operator == "$max":
+                    if field not in group or (_compare(value, group[field]) or 0) > 0:
+                        group[field] = value
+                elif operator == "$min":
+                    if field not in group or (_compare(value, group[field]) or 0) < 0:
+                        group[field] = value
+                else:
+                    raise OperationFailure(f"unsupported accumulator {operator}")
+        return list(groups.values())
+
+    def _lookup(self, documents: List[dict], specification: dict) -> List[dict]:
+        foreign = SQLiteCollection(self.database, specification["from"])
+        local_values = set()
+        for document in documents:
+            value = _get(document, specification["localField"])
+            for item in value if isinstance(value, list) else [value]:
+                if _is_scalar(item):
+                    local_values.add(json.dumps(_encode_value(item)))
+        candidates = foreign._find(
+            {specification["foreignField"]: {"$in": [_decode_value(json.loads(value)) for value in local_values]}},
+            None, [], 0, 0
+        ) if local_values else []
+        joined = []
+        for document in documents:
+            value = _get(document, specification["localField"])
+            matches = [
+                candidate for candidate in candidates
+                if _matches_condition(_get_values(candidate, specification["foreignField"]),
+                                      {"$in": value if isinstance(value, list) else [value]})
+            ]
+            joined.append({**document, specification["as"]: matches})
+        return joined
+
+class SQLiteDatabase:
+    def __init__(self, client: "SQLiteClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, SQLiteCollection] = {}
+
+    def __getitem__(self, name: str) -> SQLiteCollection:
+        if name not in self._collections:
+            self._collections[name] = SQLiteCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> SQLiteCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        def names():
+            prefix = self.name + "."
+            return [
+                table[len(prefix):] for table, in self.client._engine.connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?", (prefix + "%",)
+                ) if not table.endswith(KEYS_SUFFIX)
+            ]
+        return await self.client._engine.read(None, names)
+
+    async def command(self, name: str, *args, **kwargs):
+        raise OperationFailure(f"command {name} is not supported by the SQLite backend")
+
+class SQLiteClient:
+    """Drop-in for the Motor client used by database.py"""
+
+    def __init__(self, url: str):
+        path = url[len(URL_PREFIX):]
+        self._engine = _Engine(path or ":memory:")
+        self._databases: Dict[str, SQLiteDatabase] = {}
+
+    def __getitem__(self, name: str) -> SQLiteDatabase:
+        if name not in self._databases:
+            self._databases[name] = SQLiteDatabase(self, name)
+        return self._databases[name]
+
+    @property
+    def admin(self) -> SQLiteDatabase:
+        return self["admin"]
+
+    async def drop_database(self, name: str):
+        database = self[name]
+        for collection in await database.list_collection_names():
+            await database[collection].drop()
+
+    async def start_session(self, **kwargs):
+        raise OperationFailure("sessions are not supported by the SQLite backend")
+
+    def close(self):
+        self._engine.close()
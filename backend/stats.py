@@ -0,0 +1,191 @@
+"""Incrementally maintained dashboard counters.
+
+Every task mutation adds the difference between the task's counter
+contributions before and after the change to its tenant's counters
+document, so `/api/stats` never has to scan the tasks collection and
+costs the same however much data other tenants hold. Archived tasks are
+summarized the same way in a counters document of their own. The
+counters can be rebuilt from scratch with one `$facet` aggregation per
+tenant:
+
+    python stats.py verify    # report drift between counters and tasks
+    python stats.py rebuild   # recompute and store the counters
+"""
+import argparse
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from jalali import calendar_service
+from models import Priority, TaskStatus
+from repository import task_repository, archive_repository, stats_repository
+from tenancy import tenant_scope
+
+STATS_ID = "task_stats"
+ARCHIVE_STATS_ID = "archive_stats"
+
+# Counters document -> repository of the tasks it counts
+COUNTED_REPOSITORIES = {STATS_ID: task_repository, ARCHIVE_STATS_ID: archive_repository}
+
+STATUS_KEYS = {
+    TaskStatus.PENDING.value: "pending_tasks",
+    TaskStatus.COMPLETED.value: "completed_tasks",
+    TaskStatus.CANCELLED.value: "cancelled_tasks",
+}
+
+PRIORITY_KEYS = {
+    Priority.HIGH.value: "high_priority",
+    Priority.MEDIUM.value: "medium_priority",
+    Priority.LOW.value: "low_priority",
+}
+
+COUNTER_FIELDS = ["total_tasks", *STATUS_KEYS.values(), *PRIORITY_KEYS.values()]
+
+def current_due_date() -> str:
+    """The due_date value counted as "due today", i.e. the Tehran date"""
+    return calendar_service.today_info()["gregorian_date"]
+
+def _value(field):
+    """Return the raw value of a stored enum field"""
+    return getattr(field, "value", field)
+
+def task_contributions(task: Optional[dict]) -> Dict[str, int]:
+    """Counter fields a single task contributes to"""
+    if not task:
+        return {}
+    counts = {"total_tasks": 1}
+    status = _value(task.get("status"))
+    if status in STATUS_KEYS:
+        counts[STATUS_KEYS[status]] = 1
+    if status == TaskStatus.PENDING.value:
+        priority = _value(task.get("priority"))
+        if priority in PRIORITY_KEYS:
+            counts[PRIORITY_KEYS[priority]] = 1
+        if task.get("due_date"):
+            counts[f"due_pending.{task['due_date']}"] = 1
+    return counts
+
+def contribution_delta(before: Optional[dict], after: Optional[dict]) -> Dict[str, int]:
+    """Counter increments needed to go from `before` to `after`"""
+    delta = dict(task_contributions(after))
+    for key, value in task_contributions(before).items():
+        delta[key] = delta.get(key, 0) - value
+    return {key: value for key, value in delta.items() if value}
+
+def api_stats_delta(delta: Dict[str, int]) -> Dict[str, int]:
+    """Translate a counters delta into increments of the /api/stats fields"""
+    today_key = f"due_pending.{current_due_date()}"
+    api_delta = {}
+    for key, value in delta.items():
+        if key == today_key:
+            api_delta["due_today"] = value
+        elif key in COUNTER_FIELDS and key != "cancelled_tasks":
+            api_delta[key] = value
+    return api_delta
+
+async def record_task_change(before: Optional[dict], after: Optional[dict]) -> Dict[str, int]:
+    """Apply the counter changes caused by creating, updating or deleting a task.
+
+    Returns the resulting increments of the /api/stats fields.
+    """
+    delta = contribution_delta(before, after)
+    await stats_repository.increment(STATS_ID, delta)
+    return api_stats_delta(delta)
+
+async def record_task_changes(changes: List[Tuple[Optional[dict], Optional[dict]]]) -> Dict[str, int]:
+    """Apply the counter changes of many (before, after) pairs in one update"""
+    delta: Dict[str, int] = {}
+    for before, after in changes:
+        for key, value in contribution_delta(before, after).items():
+            delta[key] = delta.get(key, 0) + value
+    delta = {k: v for k, v in delta.items() if v}
+    await stats_repository.increment(STATS_ID, delta)
+    return api_stats_delta(delta)
+
+def _counts(rows: List[dict], keys: Dict[str, str]) -> Dict[str, int]:
+    counts = {field: 0 for field in keys.values()}
+    for row in rows:
+        key = keys.get(_value(row["_id"]))
+        if key:
+            counts[key] += row["count"]
+    return counts
+
+async def compute_counters(counters_id: str = STATS_ID) -> dict:
+    """Compute all counters from the tasks they count in one aggregation"""
+    pending = TaskStatus.PENDING.value
+    result = await COUNTED_REPOSITORIES[counters_id].aggregate([
+        {"$facet": {
+            "by_status": [
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+            ],
+            "pending_by_priority": [
+                {"$match": {"status": pending}},
+                {"$group": {"_id": "$priority", "count": {"$sum": 1}}},
+            ],
+            "pending_by_due_date": [
+                {"$match": {"status": pending, "due_date": {"$ne": None}}},
+                {"$group": {"_id": "$due_date", "count": {"$sum": 1}}},
+            ],
+        }},
+    ])
+    facets = result[0] if result else {}
+    by_status = facets.get("by_status", [])
+    counters = {"_id": counters_id, "total_tasks": sum(row["count"] for row in by_status)}
+    counters.update(_counts(by_status, STATUS_KEYS))
+    counters.update(_counts(facets.get("pending_by_priority", []), PRIORITY_KEYS))
+    counters["due_pending"] = {
+        str(row["_id"]): row["count"] for row in facets.get("pending_by_due_date", [])
+    }
+    return counters
+
+async def rebuild_counters(counters_id: str = STATS_ID) -> dict:
+    """Recompute a counters document and store it"""
+    counters = await compute_counters(counters_id)
+    await stats_repository.replace(counters_id, counters)
+    return counters
+
+async def get_counters(counters_id: str = STATS_ID) -> dict:
+    """Return the stored counters, building them on first use"""
+    counters = await stats_repository.get(counters_id)
+    if counters is None:
+        counters = await rebuild_counters(counters_id)
+    return counters
+
+async def verify_counters(counters_id: str = STATS_ID) -> Dict[str, tuple]:
+    """Return {field: (stored, actual)} for every counter that has drifted"""
+    stored = await stats_repository.get(counters_id) or {}
+    actual = await compute_counters(counters_id)
+    drift = {}
+    for field in COUNTER_FIELDS:
+        if stored.get(field, 0) != actual[field]:
+            drift[field] = (stored.get(field, 0), actual[field])
+    stored_due = {k: v for k, v in stored.get("due_pending", {}).items() if v}
+    for due_date in set(stored_due) | set(actual["due_pending"]):
+        if stored_due.get(due_date, 0) != actual["due_pending"].get(due_date, 0):
+            drift[f"due_pending.{due_date}"] = (
+                stored_due.get(due_date, 0), actual["due_pending"].get(due_date, 0)
+            )
+    return drift
+
+async def main(command: str):
+    # Tenants with stored counters too, whose tasks may all be gone
+    tenants = set(await stats_repository.find_tenants())
+    for repository in COUNTED_REPOSITORIES.values():
+        tenants.update(await repository.find_tenants())
+    for tenant_id in sorted(tenants):
+        with tenant_scope(tenant_id):
+            for counters_id in COUNTED_REPOSITORIES:
+                name = f"{tenant_id}/{counters_id}"
+                drift = await verify_counters(counters_id)
+                for field, (stored, actual) in sorted(drift.items()):
+                    print(f"{name}.{field}: stored={stored} actual={actual}")
+                if command == "rebuild":
+                    await rebuild_counters(counters_id)
+                    print(f"Rebuilt {name} ({len(drift)} fields repaired)")
+                elif not drift:
+                    print(f"{name} is consistent")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify or rebuild dashboard counters")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    args = parser.parse_args()
+    asyncio.run(main(args.command))
@@ -0,0 +1,179 @@
+"""Subtask storage, either embedded in tasks or in a separate collection.
+
+With SUBTASK_STORAGE=embedded (the default) subtasks stay in each task's
+`subtasks` array. With SUBTASK_STORAGE=collection they live in the
+`subtasks` collection indexed by task_id, task documents no longer carry
+the array, and clients load a checklist lazily from
+GET /api/tasks/{task_id}/subtasks. In both modes tasks carry
+`subtask_total` and `subtask_done`, which every change adjusts atomically.
+
+    python subtasks.py migrate   # move embedded subtasks into the collection
+    python subtasks.py recount   # recompute subtask_total/subtask_done
+"""
+import argparse
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+
+from repository import task_repository, subtask_repository
+from tenancy import TENANT_FIELD, scoped
+
+SUBTASK_STORAGE = os.environ.get('SUBTASK_STORAGE', 'embedded')
+SEPARATE_SUBTASKS = SUBTASK_STORAGE == 'collection'
+
+MIGRATION_BATCH_SIZE = 500
+
+async def get_subtasks(task_id: str) -> Optional[List[dict]]:
+    """A task's subtasks in creation order, or None if the task does not exist"""
+    if SEPARATE_SUBTASKS:
+        if await task_repository.get_subtask_counters(task_id) is None:
+            return None
+        return await subtask_repository.find_by_task(task_id)
+    task = await task_repository.get(task_id)
+    return task.get("subtasks", []) if task else None
+
+# The mutations below return the task's new subtask counters, or None when
+# the task or subtask does not exist
+
+async def add_subtask(task_id: str, subtask_dict: dict) -> Optional[dict]:
+    if not SEPARATE_SUBTASKS:
+        return await task_repository.add_subtask(task_id, subtask_dict)
+    counters = await task_repository.increment_subtask_counters(
+        task_id, 1, int(subtask_dict["completed"])
+    )
+    if counters is not None:
+        await subtask_repository.insert({**subtask_dict, "task_id": task_id})
+    return counters
+
+async def set_subtask_completed(task_id: str, subtask_id: str, completed: bool) -> Optional[dict]:
+    if not SEPARATE_SUBTASKS:
+        return await task_repository.update_subtask(task_id, subtask_id, completed)
+    previous = await subtask_repository.set_completed(task_id, subtask_id, completed)
+    if previous is None:
+        return None
+    if previous.get("completed") == completed:
+        return await task_repository.get_subtask_counters(task_id)
+    return await task_repository.increment_subtask_counters(task_id, 0, 1 if completed else -1)
+
+async def set_subtasks_completed(changes: Dict[Tuple[str, str], bool]) -> Dict[Tuple[str, str], Optional[dict]]:
+    """Apply many completion changes, keyed by (task id, subtask id), with
+    one bulk write and return each task's new counters"""
+    task_ids = list({task_id for task_id, _ in changes})
+    if not SEPARATE_SUBTASKS:
+        await task_repository.update_subtasks(changes)
+        tasks = await task_repository.find_subtask_counters(task_ids, with_subtask_ids=True)
+        found = {
+            (task_id, subtask["id"])
+            for task_id, task in tasks.items()
+            for subtask in task.pop("subtasks", [])
+        }
+    else:
+        previous = {
+            (subtask["task_id"], subtask["id"]): subtask
+            for subtask in await subtask_repository.find_by_ids([subtask_id for _, subtask_id in changes])
+        }
+        found = set(previous) & set(changes)
+        flipped = {key: changes[key] for key in found if previous[key].get("completed") != changes[key]}
+        await subtask_repository.set_completed_many(flipped)
+        deltas: Dict[str, tuple] = {}
+        for (task_id, _), completed in flipped.items():
+            total, done = deltas.get(task_id, (0, 0))
+            deltas[task_id] = (total, done + (1 if completed else -1))
+        await task_repository.increment_subtask_counters_many(deltas)
+        tasks = await task_repository.find_subtask_counters(task_ids)
+    return {
+        key: tasks.get(key[0]) if key in found and key[0] in tasks else None
+        for key in changes
+    }
+
+async def delete_subtask(task_id: str, subtask_id: str) -> Optional[dict]:
+    if not SEPARATE_SUBTASKS:
+        return await task_repository.delete_subtask(task_id, subtask_id)
+    removed = await subtask_repository.delete(task_id, subtask_id)
+    if removed is None:
+        return None
+    return await task_repository.increment_subtask_counters(task_id, -1, -int(removed["completed"]))
+
+async def delete_task_subtasks(task_ids: List[str]):
+    """Remove the subtasks of deleted tasks"""
+    if SEPARATE_SUBTASKS and task_ids:
+        await subtask_repository.delete_by_tasks(task_ids)
+
+async def migrate(batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """Move embedded subtask arrays into the subtasks collection"""
+    moved = 0
+    cursor = task_repository.collection.find(
+        scoped({"subtasks.0": {"$exists": True}}), {"_id": 0, "id": 1, TENANT_FIELD: 1, "subtasks": 1}
+    )
+    batch = []
+    async for task in cursor:
+        batch.append(task)
+        if len(batch) >= batch_size:
+            moved += await _migrate_batch(batch)
+            batch = []
+    moved += await _migrate_batch(batch)
+    await recount()
+    return moved
+
+async def _migrate_batch(tasks: List[dict]) -> int:
+    if not tasks:
+        return 0
+    subtasks = [
+        {**subtask, "task_id": task["id"], TENANT_FIELD: task.get(TENANT_FIELD)}
+        for task in tasks
+        for subtask in task["subtasks"]
+    ]
+    # Upsert by id so an interrupted migration can be re-run
+    await subtask_repository.upsert_many(subtasks)
+    await task_repository.collection.update_many(
+        scoped({"id": {"$in": [task["id"] for task in tasks]}}), {"$unset": {"subtasks": ""}}
+    )
+    return len(subtasks)
+
+async def recount(batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """Recompute the subtask counters of every task (of the current
+    tenant, within a tenant's scope) from the stored subtasks"""
+    updated = 0
+    batch = []
+    async for task in task_repository.collection.find(scoped({}), {"_id": 0, "id": 1, "subtasks": 1}):
+        batch.append(task)
+        if len(batch) >= batch_size:
+            updated += await _recount_batch(batch)
+            batch = []
+    updated += await _recount_batch(batch)
+    return updated
+
+async def recount_tasks(task_ids: List[str]) -> int:
+    """Recompute the subtask counters of the given tasks"""
+    if not task_ids:
+        return 0
+    cursor = task_repository.collection.find(scoped({"id": {"$in": task_ids}}), {"_id": 0, "id": 1, "subtasks": 1})
+    return await _recount_batch(await cursor.to_list(length=None))
+
+async def _recount_batch(tasks: List[dict]) -> int:
+    if not tasks:
+        return 0
+    counts = await subtask_repository.count_by_task([task["id"] for task in tasks])
+    for task in tasks:
+        embedded = task.get("subtasks") or []
+        total, done = counts[task["id"]]
+        counts[task["id"]] = (
+            total + len(embedded),
+            done + sum(1 for subtask in embedded if subtask.get("completed")),
+        )
+    await task_repository.set_subtask_counters(counts)
+    return len(tasks)
+
+async def main(command: str):
+    if command == "migrate":
+        moved = await migrate()
+        print(f"Moved {moved} subtasks into the subtasks collection")
+        print("Set SUBTASK_STORAGE=collection before restarting the API")
+    elif command == "recount":
+        print(f"Recounted subtasks of {await recount()} tasks")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Subtask storage maintenance")
+    parser.add_argument("command", choices=["migrate", "recount"])
+    args = parser.parse_args()
+    asyncio.run(main(args.command))
@@ -0,0 +1,122 @@
+"""Delta sync for clients that keep a local copy and work offline.
+
+Every write to a task, list or tag stamps the document with the next
+number of a global change sequence, and deletions leave a tombstone
+carrying their own number. GET /api/sync?since=<cursor> returns what
+changed in the caller's tenant after a cursor, oldest change first, in pages: a client starts
+from 0 (a full snapshot), applies each page and passes the returned
+cursor on its next call, while `has_more` is true.
+
+POST /api/sync/push applies edits queued offline in one go: the tasks the
+client created, under ids it chose so a retried push does not duplicate
+them, then its other changes as an unordered batch. Operations carrying
+`if_updated_at` are rejected as conflicts, with the task's current state,
+when the task changed after the client last read it.
+"""
+from typing import Dict, List
+
+from pymongo.errors import DuplicateKeyError
+
+from batch import execute_batch
+from events import event_bus
+from models import SyncPushRequest, SyncTaskCreate, TaskBatchRequest
+from recurrence import build_created_task
+from repository import (
+    SEQUENCE_FIELD, change_sequence, task_repository, list_repository, tag_repository,
+    subtask_repository, tombstone_repository,
+)
+from subtasks import SEPARATE_SUBTASKS
+from tasks import insert_task
+from tenancy import tenant_scope
+
+SYNC_PAGE_SIZE = 500
+BACKFILL_BATCH_SIZE = 1000
+
+# Response key -> repository of the documents it carries
+SOURCES = {
+    "tasks": task_repository,
+    "lists": list_repository,
+    "tags": tag_repository,
+}
+
+async def changes_since(since: int, limit: int = SYNC_PAGE_SIZE) -> dict:
+    """The next page of changes after cursor `since`"""
+    latest = await change_sequence.current()
+    if since > latest:
+        # A cursor from another database; the client starts over
+        return {"reset": True, "cursor": 0, "has_more": True,
+                "deleted": [], **{name: [] for name in SOURCES}}
+
+    # Nothing past a change this process is still writing, so a later
+    # call cannot miss it
+    ceiling = change_sequence.ceiling()
+    changes = []
+    for name, repository in SOURCES.items():
+        changes += [(doc[SEQUENCE_FIELD], name, doc)
+                    for doc in await repository.find_changed(since, ceiling, limit + 1)]
+    changes += [(doc[SEQUENCE_FIELD], "deleted", doc)
+                for doc in await tombstone_repository.find_changed(since, ceiling, limit + 1)]
+    changes.sort(key=lambda change: change[0])
+
+    page: Dict[str, List[dict]] = {name: [] for name in (*SOURCES, "deleted")}
+    for _, name, doc in changes[:limit]:
+        doc.pop(SEQUENCE_FIELD)
+        page[name].append(doc)
+    if SEPARATE_SUBTASKS and page["tasks"]:
+        subtasks = await subtask_repository.find_by_tasks([task["id"] for task in page["tasks"]])
+        for task in page["tasks"]:
+            task["subtasks"] = subtasks[task["id"]]
+    return {
+        **page,
+        "cursor": changes[min(limit, len(changes)) - 1][0] if changes else since,
+        "has_more": len(changes) > limit,
+    }
+
+async def _push_created(task: SyncTaskCreate) -> dict:
+    result = {"task_id": task.id}
+    if await task_repository.get(task.id):
+        return {**result, "ok": True, "existing": True}
+    try:
+        created = await insert_task(build_created_task(task))
+    except ValueError as e:
+        return {**result, "ok": False, "error": str(e)}
+    except DuplicateKeyError:
+        # Pushed again while the first push was still running
+        return {**result, "ok": True, "existing": True}
+    if not created:
+        return {**result, "ok": False, "error": "خطا در ایجاد تسک"}
+    return {**result, "ok": True, "existing": False}
+
+async def push(request: SyncPushRequest) -> dict:
+    """Apply a client's queued offline edits"""
+    created = [await _push_created(task) for task in request.created]
+    operations = []
+    if request.operations:
+        batch = await execute_batch(TaskBatchRequest(operations=request.operations, ordered=False),
+                                    publish=event_bus.publish)
+        operations = batch["results"]
+    results = [*created, *operations]
+    succeeded = sum(1 for result in results if result["ok"])
+    return {
+        "created": created,
+        "operations": operations,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "conflicts": sum(1 for result in operations if result.get("conflict")),
+    }
+
+async def ensure_sequences(batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Stamp documents written before change sequences existed, so a sync
+    from 0 includes them. Runs at startup and is a no-op once done."""
+    stamped = 0
+    for repository in SOURCES.values():
+        # Tenant by tenant, so the tenant-prefixed seq index finds them
+        for tenant_id in await repository.find_tenants():
+            with tenant_scope(tenant_id):
+                while True:
+                    ids = await repository.find_unsequenced_ids(batch_size)
+                    if not ids:
+                        break
+                    await repository.set_sequences(ids)
+                    stamped += len(ids)
+    return stamped
@@ -0,0 +1,50 @@
+"""Task creation shared by POST /api/tasks, recurring tasks and sync pushes."""
+import uuid
+from datetime import date, datetime
+from typing import Optional
+
+from counts import write_task
+from events import event_bus
+from models import TaskStatus
+from repository import task_repository
+from search import search_document_fields
+from serializers import to_response
+from stats import record_task_change
+from subtasks import SEPARATE_SUBTASKS
+
+def build_task(fields: dict) -> dict:
+    """A new pending task document from client supplied fields, keeping
+    an `id` the client chose"""
+    task_dict = dict(fields)
+    task_dict["id"] = task_dict.get("id") or str(uuid.uuid4())
+    task_dict["status"] = TaskStatus.PENDING
+    task_dict["created_at"] = datetime.utcnow()
+    task_dict["updated_at"] = datetime.utcnow()
+    task_dict["subtask_total"] = 0
+    task_dict["subtask_done"] = 0
+    if not SEPARATE_SUBTASKS:
+        task_dict["subtasks"] = []
+    task_dict.update(search_document_fields(task_dict["title"], task_dict.get("description")))
+
+    # Convert date to string if provided
+    if task_dict.get("due_date"):
+        if isinstance(task_dict["due_date"], date):
+            task_dict["due_date"] = task_dict["due_date"].isoformat()
+    return task_dict
+
+async def insert_task(task_dict: dict) -> Optional[dict]:
+    """Store a task built by build_task, apply its side effects and return
+    it as sent to clients, or None if it was not inserted"""
+    async def insert(session):
+        inserted = await task_repository.insert(task_dict, session=session)
+        return None, task_dict if inserted else None
+
+    # The task and its list/tag count increments are written together
+    _, created, list_delta, tag_delta = await write_task(insert)
+    if not created:
+        return None
+    stats_delta = await record_task_change(None, task_dict)
+    created_task = to_response(task_dict)
+    event_bus.publish("task.created", created_task, stats=stats_delta,
+                      lists=list_delta, tags=tag_delta)
+    return created_task
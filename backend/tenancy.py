@@ -0,0 +1,116 @@
+"""Tenant isolation for many teams sharing one database.
+
+Every task, archived task, list, tag, subtask, tombstone, job and sent
+reminder carries the `tenant_id` of the team owning it, except jobs
+started outside a request, such as the scheduled archival. TenantMiddleware
+takes the tenant of each request from the TENANT_HEADER header (set by the
+gateway that authenticates users; DEFAULT_TENANT when absent) and keeps it
+in a context variable while the request is handled. The repositories add
+it to every filter and pipeline they run and to every document they
+insert, so no route can read or change another tenant's data. Indexes are
+prefixed with tenant_id (see indexes.py), and dashboard counters, cache
+versions and change events are kept per tenant.
+
+Outside a request no tenant is set and repositories see every tenant.
+Background work spanning tenants (reminders, scheduled archival, count
+reconciliation) reads that way and enters `tenant_scope` for the writes
+of each tenant. Documents stored before tenants existed belong to
+DEFAULT_TENANT; `ensure_tenants` stamps them at startup, leaving jobs
+alone since one without a tenant spans every tenant.
+"""
+import contextvars
+import os
+import re
+from contextlib import contextmanager
+from typing import List, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from database import (
+    tasks_collection, tasks_archive_collection, lists_collection, tags_collection,
+    subtasks_collection, tombstones_collection,
+)
+
+TENANT_HEADER = os.environ.get('TENANT_HEADER', 'X-Tenant-ID')
+DEFAULT_TENANT = os.environ.get('DEFAULT_TENANT', 'default')
+
+TENANT_FIELD = "tenant_id"
+# Tenant ids end up in counter ids and field paths, so no dots or dollars
+TENANT_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Collections whose documents always belong to a tenant
+TENANT_COLLECTIONS = [
+    tasks_collection, tasks_archive_collection, lists_collection, tags_collection,
+    subtasks_collection, tombstones_collection,
+]
+
+_current_tenant: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_tenant", default=None
+)
+
+def current_tenant() -> Optional[str]:
+    """The tenant being served, or None outside a tenant's scope"""
+    return _current_tenant.get()
+
+@contextmanager
+def tenant_scope(tenant_id: Optional[str]):
+    """Scope the repositories to `tenant_id` (None: every tenant) within the block"""
+    token = _current_tenant.set(tenant_id)
+    try:
+        yield tenant_id
+    finally:
+        _current_tenant.reset(token)
+
+def scoped(query: dict) -> dict:
+    """`query` restricted to the current tenant's documents"""
+    tenant_id = _current_tenant.get()
+    return {TENANT_FIELD: tenant_id, **query} if tenant_id is not None else query
+
+def scoped_pipeline(pipeline: List[dict]) -> List[dict]:
+    """An aggregation pipeline that only reads the current tenant's documents"""
+    tenant_id = _current_tenant.get()
+    if tenant_id is None:
+        return pipeline
+    if pipeline and "$match" in pipeline[0]:
+        # Merged into the leading $match, which picks the index
+        return [{"$match": {TENANT_FIELD: tenant_id, **pipeline[0]["$match"]}}, *pipeline[1:]]
+    return [{"$match": {TENANT_FIELD: tenant_id}}, *pipeline]
+
+def owned(document: dict) -> dict:
+    """A document to insert, owned by the current tenant; outside a
+    tenant's scope it keeps the tenant it already has"""
+    tenant_id = _current_tenant.get()
+    return {**document, TENANT_FIELD: tenant_id} if tenant_id is not None else document
+
+def tenant_key(name: str) -> str:
+    """A per-tenant variant of a shared document id or counter name"""
+    tenant_id = _current_tenant.get()
+    return f"{name}:{tenant_id}" if tenant_id is not None else name
+
+class TenantMiddleware:
+    """ASGI middleware scoping every request to the tenant named in its TENANT_HEADER"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tenant_id = Headers(scope=scope).get(TENANT_HEADER) or DEFAULT_TENANT
+        if not TENANT_ID_PATTERN.fullmatch(tenant_id):
+            response = JSONResponse({"detail": "شناسه فضای کاری نامعتبر است"}, status_code=400)
+            await response(scope, receive, send)
+            return
+        with tenant_scope(tenant_id):
+            await self.app(scope, receive, send)
+
+async def ensure_tenants() -> int:
+    """Give documents written before tenants existed to DEFAULT_TENANT.
+    Runs at startup and is a no-op once done."""
+    stamped = 0
+    for collection in TENANT_COLLECTIONS:
+        result = await collection.update_many({TENANT_FIELD: None}, {"$set": {TENANT_FIELD: DEFAULT_TENANT}})
+        stamped += result.modified_count
+    return stamped
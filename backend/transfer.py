@@ -0,0 +1,187 @@
+"""Streaming NDJSON export and batched import of lists, tags and tasks.
+
+Every line is one record: {"type": "list" | "tag" | "task" | "subtask",
+"data": {...}}; subtask records only appear with SUBTASK_STORAGE=collection.
+Exports stream straight from Mongo cursors, and imports upsert records by
+`id` in batches, so both run in bounded memory regardless of data size.
+"""
+import json
+from datetime import date, datetime
+from typing import AsyncIterator, Dict, List
+
+from pydantic import ValidationError
+
+from models import TaskModel
+from repository import task_repository, list_repository, tag_repository, subtask_repository
+from search import search_document_fields
+from stats import record_task_changes
+from subtasks import SEPARATE_SUBTASKS, recount_tasks
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+REPOSITORIES = {
+    "list": list_repository,
+    "tag": tag_repository,
+    "task": task_repository,
+    # Empty unless SUBTASK_STORAGE=collection
+    "subtask": subtask_repository,
+}
+
+DATETIME_FIELDS = ["created_at", "updated_at", "completed_at"]
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def to_ndjson_line(record_type: str, document: dict) -> bytes:
+    line = json.dumps({"type": record_type, "data": document},
+                      ensure_ascii=False, default=_json_default)
+    return (line + "\n").encode("utf-8")
+
+async def export_ndjson(batch_size: int = IMPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """Yield every list, tag and task as NDJSON lines"""
+    for record_type, repository in REPOSITORIES.items():
+        async for document in repository.iter_all(batch_size):
+            yield to_ndjson_line(record_type, document)
+
+def _parse_datetimes(document: dict):
+    for field in DATETIME_FIELDS:
+        if isinstance(document.get(field), str):
+            document[field] = datetime.fromisoformat(document[field])
+
+def _task_document(document: dict) -> dict:
+    """A task record validated like created tasks, with their defaults for
+    the fields it leaves out"""
+    try:
+        task = TaskModel.model_validate(document)
+    except ValidationError as e:
+        fields = ", ".join(".".join(str(part) for part in error["loc"]) for error in e.errors())
+        raise ValueError(f"فیلدهای نامعتبر تسک: {fields}")
+    task_dict = task.model_dump(exclude={"recurrence", "series_id", "occurrence"})
+    task_dict["priority"] = task.priority.value
+    task_dict["status"] = task.status.value
+    if task.due_date:
+        task_dict["due_date"] = task.due_date.isoformat()
+    if task.recurrence:
+        task_dict["recurrence"] = task.recurrence.model_dump(mode="json")
+    # Only instances of a series carry these, as the unique index expects
+    if task.series_id is not None:
+        task_dict.update(series_id=task.series_id, occurrence=task.occurrence)
+    if SEPARATE_SUBTASKS and "subtasks" not in document:
+        del task_dict["subtasks"]
+    for subtask in task_dict.get("subtasks", []):
+        _parse_datetimes(subtask)
+    task_dict.update(search_document_fields(task.title, task.description))
+    return task_dict
+
+def prepare_record(record: dict) -> tuple:
+    """Validate an imported record and convert it to its stored form"""
+    record_type = record.get("type")
+    document = record.get("data")
+    if record_type not in REPOSITORIES or not isinstance(document, dict):
+        raise ValueError("رکورد باید type معتبر و data داشته باشد")
+    if not document.get("id"):
+        raise ValueError("شناسه (id) الزامی است")
+    document.pop("_id", None)
+    _parse_datetimes(document)
+    if record_type == "task":
+        if not document.get("title"):
+            raise ValueError("عنوان تسک الزامی است")
+        document = _task_document(document)
+    elif record_type == "subtask" and not document.get("task_id"):
+        raise ValueError("شناسه تسک (task_id) الزامی است")
+    return record_type, document
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a stream of byte chunks into lines"""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+class _Importer:
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.batches: Dict[str, List[dict]] = {record_type: [] for record_type in REPOSITORIES}
+        self.imported = {record_type: 0 for record_type in REPOSITORIES}
+
+    async def add(self, record_type: str, document: dict):
+        batch = self.batches[record_type]
+        batch.append(document)
+        if len(batch) >= self.batch_size:
+            await self.flush(record_type)
+
+    async def flush(self, record_type: str):
+        batch = self.batches[record_type]
+        if not batch:
+            return
+        self.batches[record_type] = []
+        previous: List[dict] = []
+        if record_type == "task":
+            # Replaced tasks leave their previous list, tags and stats
+            incoming = {doc["id"]: doc for doc in batch}
+            previous = await task_repository.find_by_ids(list(incoming))
+        self.imported[record_type] += await REPOSITORIES[record_type].upsert_many(batch)
+
+        # Recompute task_count once for every list the batch touched
+        if record_type == "task":
+            list_ids = list({doc["list_id"] for doc in [*batch, *previous] if doc.get("list_id")})
+        elif record_type == "list":
+            list_ids = [doc["id"] for doc in batch]
+        else:
+            list_ids = []
+        if list_ids:
+            await list_repository.set_task_counts(await task_repository.count_by_list(list_ids))
+
+        # Likewise for every tag the batch touched
+        if record_type == "task":
+            tag_ids = list({tag_id for doc in [*batch, *previous] for tag_id in doc.get("tags") or []})
+        elif record_type == "tag":
+            tag_ids = [doc["id"] for doc in batch]
+        else:
+            tag_ids = []
+        if tag_ids:
+            counts = await task_repository.count_by_tag({"tags": {"$in": tag_ids}})
+            await tag_repository.set_task_counts({tag_id: counts.get(tag_id, 0) for tag_id in tag_ids})
+
+        # Stats and subtask counters move by this batch's changes alone
+        if record_type == "task":
+            replaced = {task["id"]: task for task in previous}
+            await record_task_changes([(replaced.get(task_id), task) for task_id, task in incoming.items()])
+            await recount_tasks(list(incoming))
+        elif record_type == "subtask":
+            await recount_tasks(list({doc["task_id"] for doc in batch}))
+
+async def import_ndjson(chunks: AsyncIterator[bytes], batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Upsert the records of an NDJSON stream in batches"""
+    importer = _Importer(batch_size)
+    errors = []
+    error_count = 0
+    line_number = 0
+    async for line in _lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            record_type, document = prepare_record(json.loads(line))
+        except (ValueError, TypeError, AttributeError) as e:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": line_number, "error": str(e)})
+            continue
+        await importer.add(record_type, document)
+
+    for record_type in REPOSITORIES:
+        await importer.flush(record_type)
+
+    return {
+        "imported": {f"{record_type}s": count for record_type, count in importer.imported.items()},
+        "error_count": error_count,
+        "errors": errors,
+    }
@@ -0,0 +1,138 @@
+"""Optional write-behind buffering for high-frequency task changes.
+
+Checking off checklist items and flipping task statuses arrive as bursts
+of tiny requests. With WRITE_BUFFER_MS set, those changes are collected
+for that many milliseconds and written together: all subtask toggles in
+one bulk write, all status flips as one batch (the same path as
+POST /api/tasks/batch). Successive changes to the same subtask or task
+within the window are merged, the last one winning. Each request still
+waits for the write that contains its change, so responses and change
+events only ever describe stored data.
+
+Flushes run one at a time per process, and write each tenant's changes
+within that tenant's scope. With the default WRITE_BUFFER_MS=0 every
+change is written by its own request, as before.
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+from batch import execute_batch
+from events import event_bus
+from models import BatchAction, TaskBatchOperation, TaskBatchRequest, TaskUpdate
+from subtasks import set_subtasks_completed
+from tenancy import current_tenant, tenant_scope
+
+WRITE_BUFFER_MS = float(os.environ.get('WRITE_BUFFER_MS', '0'))
+# A window holding this many changes is written without waiting for it to end
+WRITE_BUFFER_MAX_ITEMS = int(os.environ.get('WRITE_BUFFER_MAX_ITEMS', '500'))
+
+FlushHandler = Callable[[Dict[Hashable, Any]], Awaitable[Dict[Hashable, Any]]]
+
+class CoalescingBuffer:
+    """Merges values submitted under the same key and flushes them together.
+
+    `flush(changes)` writes {key: latest value} of one tenant and returns
+    {key: result}; every submitter of a key receives the result of the
+    write that included its value.
+    """
+
+    def __init__(self, flush: FlushHandler, window_ms: float = WRITE_BUFFER_MS,
+                 max_items: int = WRITE_BUFFER_MAX_ITEMS):
+        self.flush = flush
+        self.window = window_ms / 1000
+        self.max_items = max_items
+        self._pending: Dict[Hashable, Any] = {}
+        self._waiters: Dict[Hashable, List[asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def submit(self, key: Hashable, value: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Keys of different tenants never merge
+        key = (current_tenant(), key)
+        self._pending[key] = value
+        self._waiters.setdefault(key, []).append(future)
+        if len(self._pending) >= self.max_items:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        changes, waiters = self._pending, self._waiters
+        self._pending, self._waiters = {}, {}
+        task = asyncio.ensure_future(self._write(changes, waiters))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, changes: Dict[Hashable, Any], waiters: Dict[Hashable, List[asyncio.Future]]):
+        by_tenant: Dict[Optional[str], Dict[Hashable, Any]] = {}
+        for (tenant_id, key), value in changes.items():
+            by_tenant.setdefault(tenant_id, {})[key] = value
+        async with self._lock:
+            for tenant_id, tenant_changes in by_tenant.items():
+                futures = [(key, future) for key in tenant_changes for future in waiters[(tenant_id, key)]]
+                try:
+                    with tenant_scope(tenant_id):
+                        results = await self.flush(tenant_changes)
+                except Exception as e:
+                    for _, future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for key, future in futures:
+                    # A waiter whose client disconnected has been cancelled
+                    if not future.done():
+                        future.set_result(results.get(key))
+
+    async def drain(self):
+        """Write everything pending and wait for writes in progress"""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.wait(set(self._flushes))
+
+async def _flush_subtask_toggles(changes: Dict[tuple, bool]) -> Dict[tuple, Optional[dict]]:
+    results = await set_subtasks_completed(changes)
+    for (task_id, subtask_id), counters in results.items():
+        if counters is not None:
+            event_bus.publish("subtask.updated", {
+                "task_id": task_id, "subtask": {"id": subtask_id, "completed": changes[(task_id, subtask_id)]},
+                **counters
+            })
+    return results
+
+async def _flush_status_flips(changes: Dict[str, TaskUpdate]) -> Dict[str, Optional[dict]]:
+    updated: Dict[str, dict] = {}
+
+    def publish(event_type, data, **deltas):
+        updated.update({task["id"]: task for task in data["updated"]})
+        event_bus.publish(event_type, data, **deltas)
+
+    await execute_batch(TaskBatchRequest(operations=[
+        TaskBatchOperation(action=BatchAction.UPDATE, task_id=task_id, update=update)
+        for task_id, update in changes.items()
+    ], ordered=False), publish=publish)
+    return {task_id: updated.get(task_id) for task_id in changes}
+
+subtask_buffer = CoalescingBuffer(_flush_subtask_toggles)
+status_buffer = CoalescingBuffer(_flush_status_flips)
+
+def is_status_flip(task_update: TaskUpdate) -> bool:
+    """Whether an update only changes the task's status"""
+    return task_update.model_fields_set == {"status"}
+
+async def drain_all():
+    await subtask_buffer.drain()
+    await status_buffer.drain()
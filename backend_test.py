@@ -1,8 +1,15 @@
 import requests
 import unittest
+import asyncio
 import json
+import os
+import sys
+import time
 import uuid
-from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+from unittest import mock
+from zoneinfo import ZoneInfo
 
 class PersianTodoAPITest(unittest.TestCase):
     def setUp(self):
@@ -291,6 +298,946 @@ class PersianTodoAPITest(unittest.TestCase):
         self.assertIn("message", data)
         print("✅ Delete list passed")
 
+    def test_17_stats_counters(self):
+        """Test that stats counters follow task create, update and delete"""
+        print("\n🔍 Testing stats counters...")
+        before = requests.get(f"{self.api_url}/stats").json()
+        # "Today" is the Tehran day, which the server reports
+        today = requests.get(f"{self.api_url}/persian-date").json()["gregorian_date"]
+        response = requests.post(f"{self.api_url}/tasks", json={
+            "title": f"Stats Task {uuid.uuid4().hex[:8]}",
+            "priority": "بالا",
+            "due_date": today
+        })
+        self.assertEqual(response.status_code, 200)
+        task = response.json()
+
+        stats = requests.get(f"{self.api_url}/stats").json()
+        self.assertEqual(stats["total_tasks"], before["total_tasks"] + 1)
+        self.assertEqual(stats["pending_tasks"], before["pending_tasks"] + 1)
+        self.assertEqual(stats["high_priority"], before["high_priority"] + 1)
+        self.assertEqual(stats["due_today"], before["due_today"] + 1)
+
+        response = requests.put(f"{self.api_url}/tasks/{task['id']}", json={"status": "تکمیل شده"})
+        self.assertEqual(response.status_code, 200)
+        stats = requests.get(f"{self.api_url}/stats").json()
+        self.assertEqual(stats["completed_tasks"], before["completed_tasks"] + 1)
+        self.assertEqual(stats["pending_tasks"], before["pending_tasks"])
+        self.assertEqual(stats["high_priority"], before["high_priority"])
+        self.assertEqual(stats["due_today"], before["due_today"])
+
+        response = requests.delete(f"{self.api_url}/tasks/{task['id']}")
+        self.assertEqual(response.status_code, 200)
+        stats = requests.get(f"{self.api_url}/stats").json()
+        self.assertEqual(stats["total_tasks"], before["total_tasks"])
+        self.assertEqual(stats["completed_tasks"], before["completed_tasks"])
+        print("✅ Stats counters passed")
+
+    def test_18_paginate_tasks(self):
+        """Test cursor pagination and field projection on task listing"""
+        print("\n🔍 Testing task pagination...")
+        created = []
+        for i in range(3):
+            response = requests.post(f"{self.api_url}/tasks", json={
+                "title": f"Page Task {i} {uuid.uuid4().hex[:8]}",
+                "description": "Paginated task"
+            })
+            self.assertEqual(response.status_code, 200)
+            created.append(response.json()["id"])
+
+        seen = []
+        params = {"limit": 2, "fields": "title,status"}
+        while True:
+            response = requests.get(f"{self.api_url}/tasks", params=params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page), 2)
+            for task in page:
+                self.assertIn("title", task)
+                self.assertNotIn("description", task)
+                self.assertNotIn("_id", task)
+            seen.extend(task["id"] for task in page)
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                break
+            params["cursor"] = next_cursor
+
+        self.assertEqual(len(seen), len(set(seen)))
+        for task_id in created:
+            self.assertIn(task_id, seen)
+
+        response = requests.get(f"{self.api_url}/tasks", params={"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+        for task_id in created:
+            requests.delete(f"{self.api_url}/tasks/{task_id}")
+        print(f"✅ Task pagination passed - Walked {len(seen)} tasks")
+
+    def test_19_search_tasks(self):
+        """Test Persian-aware prefix search on tasks"""
+        print("\n🔍 Testing task search...")
+        marker = uuid.uuid4().hex[:8]
+        response = requests.post(f"{self.api_url}/tasks", json={
+            "title": f"خرید کتاب‌های درسی {marker}",
+            "description": "از کتابفروشی نزدیک خانه"
+        })
+        self.assertEqual(response.status_code, 200)
+        task = response.json()
+        self.assertNotIn("search_terms", task)
+
+        # Arabic letter variants, prefixes and description words all match
+        for query in [f"كتاب {marker}", f"خری {marker}", f"کتابفروشی {marker}", marker[:4]]:
+            response = requests.get(f"{self.api_url}/tasks", params={"search": query})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(task["id"], [item["id"] for item in response.json()], query)
+
+        # Regex metacharacters are treated as plain text
+        response = requests.get(f"{self.api_url}/tasks", params={"search": "(.*"})
+        self.assertEqual(response.status_code, 200)
+
+        requests.delete(f"{self.api_url}/tasks/{task['id']}")
+        print("✅ Task search passed")
+
+    def test_20_export_import(self):
+        """Test NDJSON export and re-import of lists and tasks"""
+        print("\n🔍 Testing export and import...")
+        list_id = str(uuid.uuid4())
+        task_ids = [str(uuid.uuid4()) for _ in range(3)]
+        now = datetime.utcnow().isoformat()
+        records = [{"type": "list", "data": {
+            "id": list_id, "name": "Imported List", "color": "#3B82F6", "icon": "📋",
+            "created_at": now, "task_count": 0
+        }}]
+        for task_id in task_ids:
+            records.append({"type": "task", "data": {
+                "id": task_id, "title": f"Imported Task {task_id[:8]}", "status": "در انتظار",
+                "priority": "کم", "list_id": list_id, "tags": [], "subtasks": [],
+                "created_at": now, "updated_at": now
+            }})
+        body = "\n".join(json.dumps(r, ensure_ascii=False) for r in records) + "\nnot json\n"
+        response = requests.post(f"{self.api_url}/import", data=body.encode("utf-8"),
+                                 headers={"Content-Type": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["imported"]["tasks"], 3)
+        self.assertEqual(data["imported"]["lists"], 1)
+        self.assertEqual(data["error_count"], 1)
+
+        lists = requests.get(f"{self.api_url}/lists").json()
+        imported_list = next(item for item in lists if item["id"] == list_id)
+        self.assertEqual(imported_list["task_count"], 3)
+
+        response = requests.get(f"{self.api_url}/export", stream=True)
+        self.assertEqual(response.status_code, 200)
+        exported = [json.loads(line) for line in response.iter_lines() if line]
+        exported_ids = {r["data"]["id"] for r in exported if r["type"] == "task"}
+        for task_id in task_ids:
+            self.assertIn(task_id, exported_ids)
+        self.assertNotIn("_id", exported[0]["data"])
+
+        requests.delete(f"{self.api_url}/lists/{list_id}")
+        print(f"✅ Export and import passed - Exported {len(exported)} records")
+
+    def test_21_batch_tasks(self):
+        """Test bulk complete, move, retag and delete in one request"""
+        print("\n🔍 Testing batch task operations...")
+        source = requests.post(f"{self.api_url}/lists", json={"name": "Batch Source"}).json()
+        target = requests.post(f"{self.api_url}/lists", json={"name": "Batch Target"}).json()
+        task_ids = []
+        for i in range(3):
+            response = requests.post(f"{self.api_url}/tasks", json={
+                "title": f"Batch Task {i}", "list_id": source["id"], "tags": ["a"]
+            })
+            task_ids.append(response.json()["id"])
+
+        operations = [
+            {"action": "update", "task_id": task_ids[0], "update": {"status": "تکمیل شده"}},
+            {"action": "update", "task_id": task_ids[1], "update": {"list_id": target["id"]}},
+            {"action": "add_tags", "task_id": task_ids[1], "tags": ["b"]},
+            {"action": "remove_tags", "task_id": task_ids[0], "tags": ["a"]},
+            {"action": "delete", "task_id": task_ids[2]},
+            {"action": "delete", "task_id": str(uuid.uuid4())},
+        ]
+        response = requests.post(f"{self.api_url}/tasks/batch",
+                                 json={"operations": operations, "ordered": False})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["succeeded"], 5)
+        self.assertEqual(data["failed"], 1)
+        self.assertFalse(data["results"][5]["ok"])
+
+        completed = requests.get(f"{self.api_url}/tasks/{task_ids[0]}").json()
+        self.assertEqual(completed["status"], "تکمیل شده")
+        self.assertIsNotNone(completed["completed_at"])
+        self.assertEqual(completed["tags"], [])
+        moved = requests.get(f"{self.api_url}/tasks/{task_ids[1]}").json()
+        self.assertEqual(moved["list_id"], target["id"])
+        self.assertEqual(moved["tags"], ["a", "b"])
+        response = requests.get(f"{self.api_url}/tasks/{task_ids[2]}")
+        self.assertEqual(response.status_code, 404)
+
+        lists = {item["id"]: item for item in requests.get(f"{self.api_url}/lists").json()}
+        self.assertEqual(lists[source["id"]]["task_count"], 1)
+        self.assertEqual(lists[target["id"]]["task_count"], 1)
+
+        # Ordered batches stop at the first failure
+        operations = [
+            {"action": "delete", "task_id": str(uuid.uuid4())},
+            {"action": "delete", "task_id": task_ids[0]},
+        ]
+        data = requests.post(f"{self.api_url}/tasks/batch", json={"operations": operations}).json()
+        self.assertEqual(data["succeeded"], 0)
+        self.assertEqual(requests.get(f"{self.api_url}/tasks/{task_ids[0]}").status_code, 200)
+
+        # Let the cascades finish so their events do not reach later tests
+        for todo_list in (source, target):
+            response = requests.delete(f"{self.api_url}/lists/{todo_list['id']}")
+            self.wait_for_job(response.json()["job_id"])
+        print("✅ Batch task operations passed")
+
+    def test_22_change_feed(self):
+        """Test that mutations are pushed over the SSE change feed"""
+        print("\n🔍 Testing change feed...")
+        stream = requests.get(f"{self.api_url}/events", stream=True, timeout=10)
+        self.assertEqual(stream.status_code, 200)
+        lines = stream.iter_lines(decode_unicode=True)
+        # The stream is subscribed once its first frame arrives
+        self.assertTrue(next(lines).startswith("retry:"))
+
+        task = requests.post(f"{self.api_url}/tasks", json={"title": "Feed Task", "priority": "بالا"}).json()
+        requests.delete(f"{self.api_url}/tasks/{task['id']}")
+
+        events = []
+        for line in lines:
+            if line.startswith("data: "):
+                events.append(json.loads(line[len("data: "):]))
+            if len(events) == 2:
+                break
+        stream.close()
+
+        self.assertEqual(events[0]["type"], "task.created")
+        self.assertEqual(events[0]["data"]["id"], task["id"])
+        self.assertEqual(events[0]["stats"]["high_priority"], 1)
+        self.assertEqual(events[1]["type"], "task.deleted")
+        self.assertEqual(events[1]["stats"]["total_tasks"], -1)
+        print("✅ Change feed passed")
+
+    def test_23_conditional_get(self):
+        """Test ETags, 304 responses and invalidation after a mutation"""
+        print("\n🔍 Testing conditional GET...")
+        response = requests.get(f"{self.api_url}/tasks", params={"limit": 5})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers.get("ETag")
+        self.assertIsNotNone(etag)
+
+        response = requests.get(f"{self.api_url}/tasks", params={"limit": 5},
+                                headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        # Different query parameters get a different ETag
+        other = requests.get(f"{self.api_url}/tasks", params={"limit": 6})
+        self.assertNotEqual(other.headers.get("ETag"), etag)
+
+        task = requests.post(f"{self.api_url}/tasks", json={"title": "ETag Task"}).json()
+        response = requests.get(f"{self.api_url}/tasks", params={"limit": 5},
+                                headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers.get("ETag"), etag)
+        self.assertIn(task["id"], [t["id"] for t in response.json()])
+
+        stats_etag = requests.get(f"{self.api_url}/stats").headers.get("ETag")
+        requests.delete(f"{self.api_url}/tasks/{task['id']}")
+        response = requests.get(f"{self.api_url}/stats", headers={"If-None-Match": stats_etag})
+        self.assertEqual(response.status_code, 200)
+        print("✅ Conditional GET passed")
+
+    def test_24_metrics(self):
+        """Test the Prometheus metrics endpoint"""
+        print("\n🔍 Testing metrics...")
+        requests.get(f"{self.api_url}/tasks/{uuid.uuid4()}")
+        response = requests.get(f"{self.api_url}/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertIn("# TYPE http_request_duration_seconds histogram", response.text)
+        # Routes are labelled by template, not by the requested path
+        self.assertIn('route="/api/tasks/{task_id}",status="404"', response.text)
+        self.assertIn('http_request_mongo_commands_count{method="GET",route="/api/tasks/{task_id}"}',
+                      response.text)
+        print("✅ Metrics passed")
+
+    def test_25_due_buckets(self):
+        """Test due-date bucketing on the Tehran calendar"""
+        print("\n🔍 Testing due-date buckets...")
+        calendar = requests.get(f"{self.api_url}/persian-date").json()
+        self.assertIn("week_end", calendar)
+        today = date.fromisoformat(calendar["gregorian_date"])
+        month_end = date.fromisoformat(calendar["month_end"])
+        week_end = min(date.fromisoformat(calendar["week_end"]), month_end)
+        todo_list = requests.post(f"{self.api_url}/lists", json={"name": "Bucket List"}).json()
+        due_dates = [today - timedelta(days=3), today, today, week_end, month_end,
+                     today + timedelta(days=400)]
+        for due_date in due_dates:
+            requests.post(f"{self.api_url}/tasks", json={
+                "title": "Bucket Task", "list_id": todo_list["id"], "due_date": due_date.isoformat()
+            })
+
+        response = requests.get(f"{self.api_url}/calendar/due-buckets", params={"list_id": todo_list["id"]})
+        self.assertEqual(response.status_code, 200)
+        buckets = response.json()
+        self.assertEqual(buckets["week_end"], week_end.isoformat())
+        self.assertEqual(buckets["overdue"], 1)
+        self.assertEqual(buckets["today"], 2)
+        self.assertEqual(buckets["this_week"], sum(today <= d <= week_end for d in due_dates))
+        self.assertEqual(buckets["this_month"], sum(today <= d <= month_end for d in due_dates))
+
+        requests.delete(f"{self.api_url}/lists/{todo_list['id']}")
+        print("✅ Due-date buckets passed")
+
+    def test_26_subtask_counters(self):
+        """Test subtask progress counters and lazily loaded subtasks"""
+        print("\n🔍 Testing subtask counters...")
+        task = requests.post(f"{self.api_url}/tasks", json={"title": "Checklist Task"}).json()
+        self.assertEqual((task["subtask_total"], task["subtask_done"]), (0, 0))
+        subtask_ids = []
+        for title in ("one", "two", "three"):
+            response = requests.post(f"{self.api_url}/tasks/{task['id']}/subtasks", json={"title": title})
+            self.assertEqual(response.status_code, 200)
+            subtask_ids.append(response.json()["subtask"]["id"])
+
+        url = f"{self.api_url}/tasks/{task['id']}/subtasks"
+        response = requests.put(f"{url}/{subtask_ids[0]}", params={"completed": True})
+        self.assertEqual(response.json()["subtask_done"], 1)
+        # Repeating a toggle does not count twice
+        response = requests.put(f"{url}/{subtask_ids[0]}", params={"completed": True})
+        self.assertEqual(response.json()["subtask_done"], 1)
+        response = requests.delete(f"{url}/{subtask_ids[0]}")
+        self.assertEqual((response.json()["subtask_total"], response.json()["subtask_done"]), (2, 0))
+
+        subtasks = requests.get(url).json()
+        self.assertEqual([subtask["title"] for subtask in subtasks], ["two", "three"])
+        fetched = requests.get(f"{self.api_url}/tasks/{task['id']}").json()
+        self.assertEqual((fetched["subtask_total"], fetched["subtask_done"]), (2, 0))
+        self.assertEqual(requests.get(f"{self.api_url}/tasks/{uuid.uuid4()}/subtasks").status_code, 404)
+
+        requests.delete(f"{self.api_url}/tasks/{task['id']}")
+        print("✅ Subtask counters passed")
+
+    def wait_for_job(self, job_id):
+        for _ in range(50):
+            job = requests.get(f"{self.api_url}/jobs/{job_id}").json()
+            if job["status"] in ("completed", "failed"):
+                return job
+            time.sleep(0.1)
+        self.fail(f"Job {job_id} did not finish")
+
+    def test_27_background_cascade(self):
+        """Test that list and tag deletes cascade in background jobs"""
+        print("\n🔍 Testing background cascades...")
+        todo_list = requests.post(f"{self.api_url}/lists", json={"name": "Cascade List"}).json()
+        tag = requests.post(f"{self.api_url}/tags", json={"name": "Cascade Tag"}).json()
+        other = requests.post(f"{self.api_url}/tasks", json={"title": "Tagged Task", "tags": [tag["id"], "keep"]}).json()
+        task_ids = [
+            requests.post(f"{self.api_url}/tasks", json={
+                "title": f"Cascade Task {i}", "list_id": todo_list["id"], "tags": [tag["id"]]
+            }).json()["id"]
+            for i in range(3)
+        ]
+        before = requests.get(f"{self.api_url}/stats").json()
+
+        response = requests.delete(f"{self.api_url}/tags/{tag['id']}")
+        self.assertEqual(response.status_code, 200)
+        job = self.wait_for_job(response.json()["job_id"])
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual((job["processed"], job["total"]), (4, 4))
+        self.assertEqual(requests.get(f"{self.api_url}/tasks/{other['id']}").json()["tags"], ["keep"])
+        self.assertNotIn(tag["id"], [t["id"] for t in requests.get(f"{self.api_url}/tags").json()])
+
+        response = requests.delete(f"{self.api_url}/lists/{todo_list['id']}")
+        self.assertEqual(response.status_code, 200)
+        # The list disappears at once; a second delete finds nothing
+        self.assertNotIn(todo_list["id"], [l["id"] for l in requests.get(f"{self.api_url}/lists").json()])
+        self.assertEqual(requests.delete(f"{self.api_url}/lists/{todo_list['id']}").status_code, 404)
+        job = self.wait_for_job(response.json()["job_id"])
+        self.assertEqual(job["status"], "completed")
+        for task_id in task_ids:
+            self.assertEqual(requests.get(f"{self.api_url}/tasks/{task_id}").status_code, 404)
+        stats = requests.get(f"{self.api_url}/stats").json()
+        self.assertEqual(stats["total_tasks"], before["total_tasks"] - 3)
+        self.assertEqual(stats["total_lists"], before["total_lists"] - 1)
+
+        requests.delete(f"{self.api_url}/tasks/{other['id']}")
+        print("✅ Background cascades passed")
+
+    def test_28_tag_filter_and_expand(self):
+        """Test tag filtering, server-side expansion and tag task counts"""
+        print("\n🔍 Testing tag filter and expand...")
+        todo_list = requests.post(f"{self.api_url}/lists", json={"name": "Expand List"}).json()
+        red = requests.post(f"{self.api_url}/tags", json={"name": "Red", "color": "#EF4444"}).json()
+        blue = requests.post(f"{self.api_url}/tags", json={"name": "Blue"}).json()
+        self.assertEqual(red["task_count"], 0)
+        both = requests.post(f"{self.api_url}/tasks", json={
+            "title": "Red and Blue", "list_id": todo_list["id"], "tags": [red["id"], blue["id"]]
+        }).json()
+        only_red = requests.post(f"{self.api_url}/tasks", json={"title": "Only Red", "tags": [red["id"]]}).json()
+
+        any_ids = {t["id"] for t in requests.get(f"{self.api_url}/tasks", params={
+            "tags": f"{red['id']},{blue['id']}"
+        }).json()}
+        self.assertEqual(any_ids, {both["id"], only_red["id"]})
+        all_ids = {t["id"] for t in requests.get(f"{self.api_url}/tasks", params={
+            "tags": f"{red['id']},{blue['id']}", "tag_match": "all"
+        }).json()}
+        self.assertEqual(all_ids, {both["id"]})
+
+        expanded = requests.get(f"{self.api_url}/tasks", params={
+            "tags": blue["id"], "expand": "tags,list", "fields": "title"
+        }).json()
+        self.assertEqual(len(expanded), 1)
+        self.assertEqual(expanded[0]["list"], {"id": todo_list["id"], "name": "Expand List", "color": todo_list["color"]})
+        self.assertEqual({t["id"] for t in expanded[0]["tag_details"]}, {red["id"], blue["id"]})
+        plain = requests.get(f"{self.api_url}/tasks", params={"tags": blue["id"], "expand": "tags"}).json()
+        self.assertNotIn("list", plain[0])
+        self.assertEqual(requests.get(f"{self.api_url}/tasks", params={"expand": "owner"}).status_code, 400)
+
+        def tag_counts():
+            return {t["id"]: t["task_count"] for t in requests.get(f"{self.api_url}/tags").json()}
+        self.assertEqual((tag_counts()[red["id"]], tag_counts()[blue["id"]]), (2, 1))
+        requests.put(f"{self.api_url}/tasks/{only_red['id']}", json={"tags": [blue["id"]]})
+        self.assertEqual((tag_counts()[red["id"]], tag_counts()[blue["id"]]), (1, 2))
+        requests.delete(f"{self.api_url}/tasks/{only_red['id']}")
+        self.assertEqual(tag_counts()[blue["id"]], 1)
+
+        job_id = requests.delete(f"{self.api_url}/lists/{todo_list['id']}").json()["job_id"]
+        self.wait_for_job(job_id)
+        self.assertEqual((tag_counts()[red["id"]], tag_counts()[blue["id"]]), (0, 0))
+        for tag in (red, blue):
+            self.wait_for_job(requests.delete(f"{self.api_url}/tags/{tag['id']}").json()["job_id"])
+        print("✅ Tag filter and expand passed")
+
+    def test_29_list_moves_keep_counts(self):
+        """Test that moving tasks between lists keeps task_count correct"""
+        print("\n🔍 Testing list task counts on moves...")
+        source = requests.post(f"{self.api_url}/lists", json={"name": "Source"}).json()
+        target = requests.post(f"{self.api_url}/lists", json={"name": "Target"}).json()
+        task_ids = [
+            requests.post(f"{self.api_url}/tasks", json={"title": f"Move {i}", "list_id": source["id"]}).json()["id"]
+            for i in range(3)
+        ]
+
+        def counts():
+            lists = {l["id"]: l["task_count"] for l in requests.get(f"{self.api_url}/lists").json()}
+            return lists[source["id"]], lists[target["id"]]
+        self.assertEqual(counts(), (3, 0))
+        response = requests.put(f"{self.api_url}/tasks/{task_ids[0]}", json={"list_id": target["id"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(counts(), (2, 1))
+        # Updates that keep the list leave the counts alone
+        requests.put(f"{self.api_url}/tasks/{task_ids[0]}", json={"title": "Moved"})
+        self.assertEqual(counts(), (2, 1))
+        requests.post(f"{self.api_url}/tasks/batch", json={"operations": [
+            {"action": "update", "task_id": task_ids[1], "update": {"list_id": target["id"]}},
+        ]})
+        self.assertEqual(counts(), (1, 2))
+        requests.delete(f"{self.api_url}/tasks/{task_ids[2]}")
+        self.assertEqual(counts(), (0, 2))
+
+        for todo_list in (source, target):
+            self.wait_for_job(requests.delete(f"{self.api_url}/lists/{todo_list['id']}").json()["job_id"])
+        print("✅ List task counts passed")
+
+    def test_30_concurrent_toggles(self):
+        """Test that bursts of subtask toggles and status flips all land"""
+        print("\n🔍 Testing concurrent toggles...")
+        task = requests.post(f"{self.api_url}/tasks", json={"title": "Burst Task"}).json()
+        url = f"{self.api_url}/tasks/{task['id']}/subtasks"
+        subtask_ids = [
+            requests.post(url, json={"title": f"item {i}"}).json()["subtask"]["id"]
+            for i in range(4)
+        ]
+        missing = str(uuid.uuid4())
+
+        def toggle(subtask_id):
+            return requests.put(f"{url}/{subtask_id}", params={"completed": True})
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            responses = list(pool.map(toggle, [*subtask_ids[:3], subtask_ids[0], missing]))
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200, 200, 404])
+        fetched = requests.get(f"{self.api_url}/tasks/{task['id']}").json()
+        self.assertEqual((fetched["subtask_total"], fetched["subtask_done"]), (4, 3))
+        self.assertEqual([s["completed"] for s in requests.get(url).json()], [True, True, True, False])
+
+        before = requests.get(f"{self.api_url}/stats").json()
+        response = requests.put(f"{self.api_url}/tasks/{task['id']}", json={"status": "تکمیل شده"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "تکمیل شده")
+        self.assertIsNotNone(response.json()["completed_at"])
+        stats = requests.get(f"{self.api_url}/stats").json()
+        self.assertEqual(stats["completed_tasks"], before["completed_tasks"] + 1)
+        self.assertEqual(requests.put(f"{self.api_url}/tasks/{missing}", json={"status": "در انتظار"}).status_code, 404)
+
+        # A full edit stores the search fields in the same update
+        requests.put(f"{self.api_url}/tasks/{task['id']}", json={"title": "Renamed burst", "description": "zanjabil"})
+        found = requests.get(f"{self.api_url}/tasks", params={"search": "zanjabil"}).json()
+        self.assertEqual([t["id"] for t in found], [task["id"]])
+        self.assertNotIn("search_terms", found[0])
+
+        requests.delete(f"{self.api_url}/tasks/{task['id']}")
+        print("✅ Concurrent toggles passed")
+
+    def test_31_recurring_tasks(self):
+        """Test recurring task occurrences and next-instance rolling"""
+        print("\n🔍 Testing recurring tasks...")
+        title = f"Standup {uuid.uuid4().hex[:8]}"
+        # 2030-01-05 is a Saturday; repeat on Saturdays and Tuesdays
+        task = requests.post(f"{self.api_url}/tasks", json={
+            "title": title, "due_date": "2030-01-05",
+            "recurrence": {"frequency": "weekly", "weekdays": [3, 0]},
+        }).json()
+        self.assertEqual(task["recurrence"]["weekdays"], [0, 3])
+        self.assertEqual(task["recurrence"]["start"], "2030-01-05")
+        self.assertEqual((task["series_id"], task["occurrence"]), (task["id"], 0))
+
+        window = {"start": "2030-01-01", "end": "2030-01-20"}
+        occurrences = [o for o in requests.get(f"{self.api_url}/calendar/occurrences", params=window).json()
+                       if o["series_id"] == task["id"]]
+        self.assertEqual([o["date"] for o in occurrences],
+                         ["2030-01-05", "2030-01-08", "2030-01-12", "2030-01-15", "2030-01-19"])
+        self.assertEqual([o["materialized"] for o in occurrences], [True, False, False, False, False])
+
+        # Completing an instance creates the next one, once
+        url = f"{self.api_url}/tasks/{task['id']}"
+        requests.put(url, json={"status": "تکمیل شده"})
+        requests.put(url, json={"status": "در انتظار"})
+        requests.put(url, json={"status": "تکمیل شده"})
+        series = requests.get(f"{self.api_url}/tasks", params={"search": title}).json()
+        self.assertEqual(len(series), 2)
+        following = next(t for t in series if t["id"] != task["id"])
+        self.assertEqual((following["due_date"], following["occurrence"]), ("2030-01-08", 1))
+        self.assertEqual(following["series_id"], task["id"])
+
+        # A series with a count stops after its last instance
+        limited = requests.post(f"{self.api_url}/tasks", json={
+            "title": f"{title} rent", "due_date": "2030-03-21",
+            "recurrence": {"frequency": "jalali_monthly", "count": 2},
+        }).json()
+        occurrences = [o for o in requests.get(f"{self.api_url}/calendar/occurrences", params={
+            "start": "2030-03-01", "end": "2031-03-01"}).json() if o["series_id"] == limited["id"]]
+        self.assertEqual(len(occurrences), 2)
+        requests.put(f"{self.api_url}/tasks/{limited['id']}", json={"status": "تکمیل شده"})
+        second = next(t for t in requests.get(f"{self.api_url}/tasks", params={"search": "rent"}).json()
+                      if t.get("series_id") == limited["id"] and t["id"] != limited["id"])
+        requests.put(f"{self.api_url}/tasks/{second['id']}", json={"status": "تکمیل شده"})
+        rent = [t for t in requests.get(f"{self.api_url}/tasks", params={"search": "rent"}).json()
+                if t.get("series_id") == limited["id"]]
+        self.assertEqual(len(rent), 2)
+
+        # An explicit null stops the task recurring
+        cleared = requests.put(f"{self.api_url}/tasks/{following['id']}", json={"recurrence": None}).json()
+        self.assertIsNone(cleared["recurrence"])
+        response = requests.get(f"{self.api_url}/calendar/occurrences", params={"start": "2030-01-01", "end": "2032-01-01"})
+        self.assertEqual(response.status_code, 400)
+
+        for t in [*series, *rent]:
+            requests.delete(f"{self.api_url}/tasks/{t['id']}")
+        print("✅ Recurring tasks passed")
+
+    def sync_all(self, since, limit=500):
+        """Follow sync pages from a cursor, returning the changes and the final cursor"""
+        changes = {"tasks": [], "lists": [], "tags": [], "deleted": []}
+        while True:
+            page = requests.get(f"{self.api_url}/sync", params={"since": since, "limit": limit}).json()
+            for name in changes:
+                changes[name] += page[name]
+            self.assertGreaterEqual(page["cursor"], since)
+            since = page["cursor"]
+            if not page["has_more"]:
+                return changes, since
+
+    def test_32_delta_sync(self):
+        """Test delta sync pages, tombstones and pushed offline edits"""
+        print("\n🔍 Testing delta sync...")
+        _, cursor = self.sync_all(0)
+
+        lst = requests.post(f"{self.api_url}/lists", json={"name": "Sync List"}).json()
+        tag = requests.post(f"{self.api_url}/tags", json={"name": "Sync Tag"}).json()
+        kept = requests.post(f"{self.api_url}/tasks", json={"title": "Sync kept", "list_id": lst["id"]}).json()
+        removed = requests.post(f"{self.api_url}/tasks", json={"title": "Sync removed"}).json()
+        requests.put(f"{self.api_url}/tasks/{kept['id']}", json={"title": "Sync kept v2"})
+        requests.delete(f"{self.api_url}/tasks/{removed['id']}")
+        requests.delete(f"{self.api_url}/tags/{tag['id']}")
+        url = f"{self.api_url}/tasks/{kept['id']}/subtasks"
+        subtask = requests.post(url, json={"title": "gone"}).json()["subtask"]
+        requests.delete(f"{url}/{subtask['id']}")
+
+        changes, latest = self.sync_all(cursor)
+        self.assertGreater(latest, cursor)
+        self.assertEqual([t["title"] for t in changes["tasks"]], ["Sync kept v2"])
+        self.assertNotIn("seq", changes["tasks"][0])
+        self.assertEqual([l["id"] for l in changes["lists"]], [lst["id"]])
+        self.assertEqual(changes["tags"], [])
+        deleted = {(d["kind"], d["id"]) for d in changes["deleted"]}
+        self.assertEqual(deleted, {("task", removed["id"]), ("tag", tag["id"]), ("subtask", subtask["id"])})
+        # Smaller pages deliver the same changes
+        paged, paged_latest = self.sync_all(cursor, limit=1)
+        self.assertEqual(paged_latest, latest)
+        self.assertEqual(len(paged["tasks"]) + len(paged["lists"]) + len(paged["deleted"]), 5)
+        self.assertEqual(self.sync_all(latest), ({"tasks": [], "lists": [], "tags": [], "deleted": []}, latest))
+        self.assertTrue(requests.get(f"{self.api_url}/sync", params={"since": latest + 10**9}).json()["reset"])
+
+        # Offline edits: a new task, a stale edit and an up-to-date one
+        current = requests.get(f"{self.api_url}/tasks/{kept['id']}").json()
+        offline_id = str(uuid.uuid4())
+        body = {
+            "created": [{"id": offline_id, "title": "Offline task"}],
+            "operations": [
+                {"action": "update", "task_id": kept["id"], "if_updated_at": kept["updated_at"],
+                 "update": {"title": "stale"}},
+                {"action": "update", "task_id": kept["id"], "if_updated_at": current["updated_at"],
+                 "update": {"priority": "بالا"}},
+            ],
+        }
+        result = requests.post(f"{self.api_url}/sync/push", json=body).json()
+        self.assertEqual((result["succeeded"], result["failed"], result["conflicts"]), (2, 1, 1))
+        conflict = result["operations"][0]
+        self.assertTrue(conflict["conflict"])
+        self.assertEqual(conflict["task"]["title"], "Sync kept v2")
+        task = requests.get(f"{self.api_url}/tasks/{kept['id']}").json()
+        self.assertEqual((task["title"], task["priority"]), ("Sync kept v2", "بالا"))
+        self.assertEqual(requests.get(f"{self.api_url}/tasks/{offline_id}").json()["title"], "Offline task")
+        # Pushing the same creation again does not duplicate it
+        again = requests.post(f"{self.api_url}/sync/push", json={"created": body["created"]}).json()
+        self.assertTrue(again["created"][0]["existing"])
+        changes, _ = self.sync_all(latest)
+        self.assertEqual({t["id"] for t in changes["tasks"]}, {kept["id"], offline_id})
+
+        for task_id in (kept["id"], offline_id):
+            requests.delete(f"{self.api_url}/tasks/{task_id}")
+        requests.delete(f"{self.api_url}/lists/{lst['id']}")
+        print("✅ Delta sync passed")
+
+    def test_33_archive(self):
+        """Test archiving finished tasks, reading them back and restoring them"""
+        print("\n🔍 Testing task archival...")
+        title = f"Archive {uuid.uuid4().hex[:8]}"
+        lst = requests.post(f"{self.api_url}/lists", json={"name": "Archive List"}).json()
+        done = requests.post(f"{self.api_url}/tasks", json={"title": f"{title} done", "list_id": lst["id"]}).json()
+        active = requests.post(f"{self.api_url}/tasks", json={"title": f"{title} active"}).json()
+        requests.put(f"{self.api_url}/tasks/{done['id']}", json={"status": "تکمیل شده"})
+        before = requests.get(f"{self.api_url}/stats").json()
+
+        response = requests.post(f"{self.api_url}/archive/run", params={"older_than_days": 0})
+        self.assertEqual(response.status_code, 200)
+        job = self.wait_for_job(response.json()["id"])
+        self.assertEqual(job["status"], "completed")
+        self.assertGreaterEqual(job["processed"], 1)
+
+        live = requests.get(f"{self.api_url}/tasks", params={"search": title}).json()
+        self.assertEqual([t["id"] for t in live], [active["id"]])
+        merged = requests.get(f"{self.api_url}/tasks", params={"search": title, "include_archived": True}).json()
+        self.assertEqual({t["id"] for t in merged}, {done["id"], active["id"]})
+        self.assertEqual(requests.get(f"{self.api_url}/tasks/{done['id']}").status_code, 404)
+        archived = requests.get(f"{self.api_url}/tasks/{done['id']}", params={"include_archived": True}).json()
+        self.assertIn("archived_at", archived)
+        self.assertEqual(requests.get(f"{self.api_url}/lists").json()[0]["task_count"], 0)
+
+        after = requests.get(f"{self.api_url}/stats").json()
+        for field in ("total_tasks", "completed_tasks", "pending_tasks"):
+            self.assertEqual(after[field], before[field])
+        self.assertGreaterEqual(after["archived_tasks"], 1)
+
+        restored = requests.post(f"{self.api_url}/tasks/{done['id']}/restore").json()
+        self.assertEqual((restored["id"], restored["list_id"]), (done["id"], lst["id"]))
+        self.assertNotIn("archived_at", restored)
+        self.assertEqual(requests.get(f"{self.api_url}/tasks/{done['id']}").json()["status"], "تکمیل شده")
+        self.assertEqual(requests.post(f"{self.api_url}/tasks/{done['id']}/restore").status_code, 404)
+        final = requests.get(f"{self.api_url}/stats").json()
+        self.assertEqual((final["total_tasks"], final["archived_tasks"]),
+                         (after["total_tasks"], after["archived_tasks"] - 1))
+
+        for task_id in (done["id"], active["id"]):
+            requests.delete(f"{self.api_url}/tasks/{task_id}")
+        requests.delete(f"{self.api_url}/lists/{lst['id']}")
+        print("✅ Task archival passed")
+
+    def test_34_reminders(self):
+        """Test that reminders follow task creates, edits and completion"""
+        print("\n🔍 Testing reminder scheduling...")
+        tomorrow = (datetime.now(ZoneInfo("Asia/Tehran")).date() + timedelta(days=1)).isoformat()
+        task = requests.post(f"{self.api_url}/tasks", json={
+            "title": "Reminder Task", "due_date": tomorrow, "due_time": "10:30"
+        }).json()
+
+        def scheduled_at():
+            upcoming = requests.get(f"{self.api_url}/reminders/upcoming", params={"limit": 500}).json()
+            return next((r["remind_at"] for r in upcoming["upcoming"] if r["task_id"] == task["id"]), None)
+
+        # 10:30 in Tehran (UTC+3:30) is 07:00 UTC
+        self.assertEqual(scheduled_at(), f"{tomorrow}T07:00:00")
+        requests.put(f"{self.api_url}/tasks/{task['id']}", json={"due_time": "12:00"})
+        self.assertEqual(scheduled_at(), f"{tomorrow}T08:30:00")
+        requests.put(f"{self.api_url}/tasks/{task['id']}", json={"status": "تکمیل شده"})
+        self.assertIsNone(scheduled_at())
+        requests.put(f"{self.api_url}/tasks/{task['id']}", json={"status": "در انتظار"})
+        self.assertEqual(scheduled_at(), f"{tomorrow}T08:30:00")
+        requests.delete(f"{self.api_url}/tasks/{task['id']}")
+        self.assertIsNone(scheduled_at())
+        print("✅ Reminder scheduling passed")
+
+    def test_35_ranked_search_pages(self):
+        """Test that search pages keep relevance order across cursors"""
+        print("\n🔍 Testing ranked search pages...")
+        marker = uuid.uuid4().hex[:8]
+        title_matches, description_matches = [], []
+        for i in range(5):
+            in_title = i % 2 == 0
+            response = requests.post(f"{self.api_url}/tasks", json={
+                "title": f"Ranked {marker} {i}" if in_title else f"Ranked task {i}",
+                "description": None if in_title else f"mentions {marker}",
+            })
+            self.assertEqual(response.status_code, 200)
+            (title_matches if in_title else description_matches).append(response.json()["id"])
+
+        seen = []
+        params = {"search": marker, "limit": 2, "fields": "title"}
+        while True:
+            response = requests.get(f"{self.api_url}/tasks", params=params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page), 2)
+            for task in page:
+                self.assertNotIn("description", task)
+                self.assertNotIn("search_terms", task)
+            seen.extend(task["id"] for task in page)
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                break
+            params["cursor"] = next_cursor
+
+        # Title matches outrank description matches; each group is newest first
+        self.assertEqual(seen, title_matches[::-1] + description_matches[::-1])
+
+        for task_id in seen:
+            requests.delete(f"{self.api_url}/tasks/{task_id}")
+        print(f"✅ Ranked search pages passed - Walked {len(seen)} tasks")
+
+    def test_36_tenant_isolation(self):
+        """Test that tenants only see and count their own tasks, lists and tags"""
+        print("\n🔍 Testing tenant isolation...")
+        acme = {"X-Tenant-ID": f"acme-{uuid.uuid4().hex[:8]}"}
+        globex = {"X-Tenant-ID": f"globex-{uuid.uuid4().hex[:8]}"}
+        todo_list = requests.post(f"{self.api_url}/lists", json={"name": "Acme List"}, headers=acme).json()
+        tag = requests.post(f"{self.api_url}/tags", json={"name": "Acme Tag"}, headers=acme).json()
+        response = requests.post(f"{self.api_url}/tasks", json={
+            "title": "Acme Task", "list_id": todo_list["id"], "tags": [tag["id"]]
+        }, headers=acme)
+        self.assertEqual(response.status_code, 200)
+        task = response.json()
+        self.assertNotIn("tenant_id", task)
+
+        expanded = requests.get(f"{self.api_url}/tasks", params={"expand": "tags,list"}, headers=acme).json()
+        self.assertEqual([t["id"] for t in expanded], [task["id"]])
+        self.assertEqual(expanded[0]["list"]["id"], todo_list["id"])
+        self.assertEqual([t["id"] for t in expanded[0]["tag_details"]], [tag["id"]])
+
+        # Another tenant, and requests without the header, see none of it
+        for headers in (globex, {}):
+            self.assertNotIn(task["id"], {t["id"] for t in requests.get(
+                f"{self.api_url}/tasks", params={"search": "Acme"}, headers=headers).json()})
+            self.assertNotIn(todo_list["id"], {l["id"] for l in requests.get(f"{self.api_url}/lists", headers=headers).json()})
+            self.assertNotIn(tag["id"], {t["id"] for t in requests.get(f"{self.api_url}/tags", headers=headers).json()})
+            self.assertEqual(requests.get(f"{self.api_url}/tasks/{task['id']}", headers=headers).status_code, 404)
+        self.assertEqual(requests.put(f"{self.api_url}/tasks/{task['id']}", json={"title": "Stolen"},
+                                      headers=globex).status_code, 404)
+        self.assertEqual(requests.delete(f"{self.api_url}/tasks/{task['id']}", headers=globex).status_code, 404)
+
+        acme_stats = requests.get(f"{self.api_url}/stats", headers=acme).json()
+        globex_stats = requests.get(f"{self.api_url}/stats", headers=globex).json()
+        self.assertEqual((acme_stats["total_tasks"], acme_stats["total_lists"]), (1, 1))
+        self.assertEqual((globex_stats["total_tasks"], globex_stats["total_lists"]), (0, 0))
+        self.assertEqual(requests.get(f"{self.api_url}/tasks/{task['id']}", headers=acme).json()["title"], "Acme Task")
+
+        self.assertEqual(requests.get(f"{self.api_url}/tasks", headers={"X-Tenant-ID": "no.dots"}).status_code, 400)
+
+        requests.delete(f"{self.api_url}/tasks/{task['id']}", headers=acme)
+        requests.delete(f"{self.api_url}/tags/{tag['id']}", headers=acme)
+        requests.delete(f"{self.api_url}/lists/{todo_list['id']}", headers=acme)
+        self.assertEqual(requests.get(f"{self.api_url}/stats", headers=acme).json()["total_tasks"], 0)
+        print("✅ Tenant isolation passed")
+
+    def test_37_import_minimal_task(self):
+        """Test that imported task records get the defaults of created tasks"""
+        print("\n🔍 Testing import of a minimal task...")
+        marker = uuid.uuid4().hex[:8]
+        task_id = str(uuid.uuid4())
+        before = requests.get(f"{self.api_url}/stats").json()
+        records = [
+            {"type": "task", "data": {"id": task_id, "title": f"Minimal {marker}"}},
+            {"type": "task", "data": {"id": str(uuid.uuid4()), "title": "Bad", "status": "unknown"}},
+        ]
+        body = "\n".join(json.dumps(r) for r in records)
+        data = requests.post(f"{self.api_url}/import", data=body.encode("utf-8"),
+                             headers={"Content-Type": "application/x-ndjson"}).json()
+        self.assertEqual(data["imported"]["tasks"], 1)
+        self.assertEqual(data["error_count"], 1)
+        self.assertEqual(data["errors"][0]["line"], 2)
+
+        task = requests.get(f"{self.api_url}/tasks/{task_id}").json()
+        self.assertEqual((task["status"], task["priority"]), ("در انتظار", "متوسط"))
+        self.assertIn("created_at", task)
+        response = requests.get(f"{self.api_url}/tasks", params={"limit": 500})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(task_id, {t["id"] for t in response.json()})
+        response = requests.get(f"{self.api_url}/tasks", params={"search": marker})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t["id"] for t in response.json()], [task_id])
+        stats = requests.get(f"{self.api_url}/stats").json()
+        self.assertEqual(stats["total_tasks"], before["total_tasks"] + 1)
+        self.assertEqual(stats["pending_tasks"], before["pending_tasks"] + 1)
+
+        requests.delete(f"{self.api_url}/tasks/{task_id}")
+        print("✅ Minimal task import passed")
+
+    def test_38_expanded_etag_follows_list(self):
+        """Test that renaming a list invalidates expanded task responses"""
+        print("\n🔍 Testing expanded task ETags...")
+        todo_list = requests.post(f"{self.api_url}/lists", json={"name": "Before Rename"}).json()
+        task = requests.post(f"{self.api_url}/tasks", json={"title": "Expanded", "list_id": todo_list["id"]}).json()
+        params = {"list_id": todo_list["id"], "expand": "list"}
+        response = requests.get(f"{self.api_url}/tasks", params=params)
+        self.assertEqual(response.json()[0]["list"]["name"], "Before Rename")
+        etag = response.headers.get("ETag")
+
+        requests.put(f"{self.api_url}/lists/{todo_list['id']}", json={"name": "After Rename"})
+        response = requests.get(f"{self.api_url}/tasks", params=params, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["list"]["name"], "After Rename")
+
+        requests.delete(f"{self.api_url}/tasks/{task['id']}")
+        requests.delete(f"{self.api_url}/lists/{todo_list['id']}")
+        print("✅ Expanded task ETags passed")
+
+    def test_39_search_result_fields(self):
+        """Test that search results carry the same fields as plain listings"""
+        print("\n🔍 Testing search result fields...")
+        marker = uuid.uuid4().hex[:8]
+        todo_list = requests.post(f"{self.api_url}/lists", json={"name": "Search Fields"}).json()
+        task = requests.post(f"{self.api_url}/tasks", json={
+            "title": f"Fields {marker}", "list_id": todo_list["id"]
+        }).json()
+        listed = requests.get(f"{self.api_url}/tasks", params={"list_id": todo_list["id"]}).json()
+        found = requests.get(f"{self.api_url}/tasks", params={"search": marker}).json()
+        self.assertEqual([t["id"] for t in found], [task["id"]])
+        self.assertEqual(set(found[0]), set(listed[0]))
+        for field in ("search_score", "seq", "tenant_id"):
+            self.assertNotIn(field, found[0])
+
+        requests.delete(f"{self.api_url}/tasks/{task['id']}")
+        requests.delete(f"{self.api_url}/lists/{todo_list['id']}")
+        print("✅ Search result fields passed")
+
+    def test_40_archive_job_survives_restart(self):
+        """Test that a scheduled archive job resumed at startup still spans every tenant"""
+        print("\n🔍 Testing archive job resumed after a restart...")
+        # A restart cannot be driven over HTTP, so this runs the backend
+        # in-process on the in-memory stand-in
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+        with mock.patch.dict(os.environ, {"MONGO_URL": "mongomock://"}):
+            from archive import archive_cutoff
+            from jobs import COMPLETED, JobQueue
+            from repository import job_repository, task_repository
+            from tenancy import ensure_tenants, tenant_scope
+
+        tenants = [f"restart-{uuid.uuid4().hex[:8]}" for _ in range(2)]
+
+        async def restart_with_pending_archive_job():
+            old = datetime.utcnow() - timedelta(days=365)
+            for tenant_id in tenants:
+                with tenant_scope(tenant_id):
+                    await task_repository.insert({
+                        "id": str(uuid.uuid4()), "title": "Old Task", "status": "تکمیل شده",
+                        "priority": "متوسط", "created_at": old, "updated_at": old,
+                    })
+            # Enqueued by the scheduler of a process that stopped before running it
+            await JobQueue().enqueue("archive_tasks", archive_cutoff().isoformat(), job_id="archive-restart")
+
+            await ensure_tenants()
+            queue = JobQueue()
+            await queue.start()
+            await queue.join()
+            await queue.stop()
+            live = {}
+            for tenant_id in tenants:
+                with tenant_scope(tenant_id):
+                    live[tenant_id] = await task_repository.count({})
+            return (await job_repository.get("archive-restart"))["status"], live
+
+        status, live = asyncio.run(restart_with_pending_archive_job())
+        self.assertEqual(status, COMPLETED)
+        self.assertEqual(live, {tenant_id: 0 for tenant_id in tenants})
+        print("✅ Archive job restart passed")
+
+    def test_41_due_buckets_week_across_months(self):
+        """Test that this week's bucket stays within this month when the week crosses into the next"""
+        print("\n🔍 Testing due-date buckets across a month boundary...")
+        # The day must be pinned, so this runs the backend in-process
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+        with mock.patch.dict(os.environ, {"MONGO_URL": "mongomock://"}):
+            import jalali
+            from repository import task_repository
+            from tenancy import tenant_scope
+
+        # Sunday 1405/07/26; the week ends on Friday 1405/08/01, a day after the month
+        calendar = jalali.CalendarService()
+        calendar.now = lambda: datetime(2026, 10, 18, 12, tzinfo=jalali.TEHRAN)
+        list_id = str(uuid.uuid4())
+
+        async def bucket_counts():
+            with tenant_scope(f"buckets-{uuid.uuid4().hex[:8]}"):
+                for due_date in ("2026-10-18", "2026-10-22", "2026-10-23"):
+                    await task_repository.insert({
+                        "id": str(uuid.uuid4()), "title": "Bucket Task", "status": "در انتظار",
+                        "priority": "متوسط", "list_id": list_id, "due_date": due_date,
+                    })
+                return await jalali.due_buckets(list_id)
+
+        with mock.patch.object(jalali, "calendar_service", calendar):
+            buckets = asyncio.run(bucket_counts())
+        self.assertEqual(calendar.today_info()["week_end"], "2026-10-23")
+        self.assertEqual((buckets["week_end"], buckets["month_end"]), ("2026-10-22", "2026-10-22"))
+        self.assertEqual((buckets["today"], buckets["this_week"], buckets["this_month"]), (1, 2, 2))
+        print("✅ Due-date buckets across months passed")
+
+    def test_42_reimport_moves_task(self):
+        """Test that re-importing a task into another list and tag updates the old counts too"""
+        print("\n🔍 Testing re-import of a moved task...")
+        old_list = requests.post(f"{self.api_url}/lists", json={"name": "Old Import List"}).json()
+        new_list = requests.post(f"{self.api_url}/lists", json={"name": "New Import List"}).json()
+        old_tag = requests.post(f"{self.api_url}/tags", json={"name": f"old-{uuid.uuid4().hex[:8]}"}).json()
+        task = requests.post(f"{self.api_url}/tasks", json={
+            "title": "Moved Import Task", "list_id": old_list["id"], "tags": [old_tag["id"]]
+        }).json()
+        before = requests.get(f"{self.api_url}/stats").json()
+
+        record = {"type": "task", "data": {**task, "list_id": new_list["id"], "tags": [],
+                                           "status": "تکمیل شده"}}
+        data = requests.post(f"{self.api_url}/import", data=json.dumps(record, ensure_ascii=False).encode("utf-8"),
+                             headers={"Content-Type": "application/x-ndjson"}).json()
+        self.assertEqual(data["imported"]["tasks"], 1)
+
+        lists = {item["id"]: item for item in requests.get(f"{self.api_url}/lists").json()}
+        self.assertEqual(lists[old_list["id"]]["task_count"], 0)
+        self.assertEqual(lists[new_list["id"]]["task_count"], 1)
+        tags = {item["id"]: item for item in requests.get(f"{self.api_url}/tags").json()}
+        self.assertEqual(tags[old_tag["id"]]["task_count"], 0)
+        stats = requests.get(f"{self.api_url}/stats").json()
+        self.assertEqual(stats["total_tasks"], before["total_tasks"])
+        self.assertEqual(stats["completed_tasks"], before["completed_tasks"] + 1)
+        self.assertEqual(stats["pending_tasks"], before["pending_tasks"] - 1)
+
+        requests.delete(f"{self.api_url}/tasks/{task['id']}")
+        for todo_list in (old_list, new_list):
+            requests.delete(f"{self.api_url}/lists/{todo_list['id']}")
+        requests.delete(f"{self.api_url}/tags/{old_tag['id']}")
+        print("✅ Re-import of a moved task passed")
+
 if __name__ == "__main__":
     print("🧪 Starting Persian Todo API Tests")
     unittest.main(verbosity=2)
\ No newline at end of file
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 import api from './services/api';
 import TaskCard from './components/TaskCard';
@@ -8,13 +8,70 @@ import Header from './components/Header';
 import Dashboard from './components/Dashboard';
 import { FaPlus, FaSearch, FaFilter } from 'react-icons/fa';
 
+// Typing in the search box reloads the tasks once it pauses this long
+const SEARCH_DEBOUNCE_MS = 300;
+
+// Query parameters for the selected list, status, priority and search
+const buildTaskFilters = (listId, status, priority, search) => {
+  const filters = {};
+  if (listId) filters.list_id = listId;
+  if (status !== 'all') filters.status = status;
+  if (priority !== 'all') filters.priority = priority;
+  if (search.trim()) filters.search = search.trim();
+  return filters;
+};
+
+// Whether a created or updated task belongs in the filtered pages
+const matchesFilters = (task, filters) =>
+  (!filters.list_id || task.list_id === filters.list_id) &&
+  (!filters.status || task.status === filters.status) &&
+  (!filters.priority || task.priority === filters.priority);
+
+// Replace the item with the same id; when it is missing, prepend it only if asked
+const upsertById = (items, item, prependIfMissing) => {
+  if (items.some(existing => existing.id === item.id)) {
+    return items.map(existing => existing.id === item.id ? item : existing);
+  }
+  return prependIfMissing ? [item, ...items] : items;
+};
+
+// Merge a created or updated task into pages fetched with `filters`; search
+// matches are ranked on the server, so new ones only arrive on reload
+const mergeTask = (tasks, task, created, filters) => (matchesFilters(task, filters)
+  ? upsertById(tasks, task, created && !filters.search)
+  : tasks.filter(existing => existing.id !== task.id));
+
+// Apply a subtask change event: the counters always, the checklist only when
+// the task carries one (with separate subtask storage it is loaded lazily)
+const updateSubtasks = (tasks, data, update) =>
+  tasks.map(task => task.id === data.task_id ? {
+    ...task,
+    subtask_total: data.subtask_total,
+    subtask_done: data.subtask_done,
+    ...(task.subtasks ? { subtasks: update(task.subtasks) } : {}),
+  } : task);
+
+const applyStatsDelta = (stats, delta) => {
+  const next = { ...stats };
+  Object.entries(delta).forEach(([key, value]) => {
+    next[key] = (next[key] || 0) + value;
+  });
+  next.completion_rate = next.total_tasks > 0
+    ? Math.round(next.completed_tasks / next.total_tasks * 1000) / 10
+    : 0;
+  return next;
+};
+
 function App() {
   const [tasks, setTasks] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [lists, setLists] = useState([]);
   const [tags, setTags] = useState([]);
   const [stats, setStats] = useState({});
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [reminder, setReminder] = useState(null);
   const [currentView, setCurrentView] = useState('dashboard');
   const [selectedList, setSelectedList] = useState(null);
   const [searchTerm, setSearchTerm] = useState('');
@@ -23,23 +80,52 @@ function App() {
   const [showTaskForm, setShowTaskForm] = useState(false);
   const [editingTask, setEditingTask] = useState(null);
   const [sidebarOpen, setSidebarOpen] = useState(false);
+  // The filters the loaded pages were fetched with, read by the change feed
+  const taskFilters = useRef({});
+  // Bumped on every reload, so pages of superseded filters are dropped
+  const tasksRequest = useRef(0);
+  const filtersMounted = useRef(false);
 
-  // Load initial data
+  // Load initial data, then keep it current from the server's change feed
   useEffect(() => {
     loadData();
+    return api.subscribeToChanges(applyChange, loadData);
   }, []);
 
+  // Filters run on the server, so changing one reloads from the first page
+  useEffect(() => {
+    taskFilters.current = buildTaskFilters(selectedList, filterStatus, filterPriority, searchTerm);
+    if (!filtersMounted.current) {
+      filtersMounted.current = true;
+      return undefined;
+    }
+    const timer = setTimeout(() => {
+      loadTasks().catch(err => {
+        setError('خطا در بارگذاری تسک‌ها');
+        console.error('Error loading tasks:', err);
+      });
+    }, searchTerm ? SEARCH_DEBOUNCE_MS : 0);
+    return () => clearTimeout(timer);
+  }, [selectedList, filterStatus, filterPriority, searchTerm]);
+
+  const loadTasks = async () => {
+    const request = ++tasksRequest.current;
+    const page = await api.getTasksPage(taskFilters.current);
+    if (request !== tasksRequest.current) return;
+    setTasks(page.tasks);
+    setNextCursor(page.nextCursor);
+  };
+
   const loadData = async () => {
     try {
       setLoading(true);
-      const [tasksRes, listsRes, tagsRes, statsRes] = await Promise.all([
-        api.getTasks(),
+      const [, listsRes, tagsRes, statsRes] = await Promise.all([
+        loadTasks(),
         api.getLists(),
         api.getTags(),
         api.getStats()
       ]);
       
-      setTasks(tasksRes.data);
       setLists(listsRes.data);
       setTags(tagsRes.data);
       setStats(statsRes.data);
@@ -51,13 +137,110 @@ function App() {
     }
   };
 
+  const applyChange = (event) => {
+    const { type, data } = event;
+    switch (type) {
+      case 'task.created':
+        setTasks(prevTasks => mergeTask(prevTasks, data, true, taskFilters.current));
+        break;
+      case 'task.updated':
+        setTasks(prevTasks => mergeTask(prevTasks, data, false, taskFilters.current));
+        break;
+      case 'task.deleted':
+        setTasks(prevTasks => prevTasks.filter(task => task.id !== data.id));
+        break;
+      case 'tasks.batch':
+        setTasks(prevTasks => data.updated.reduce(
+          (next, task) => mergeTask(next, task, false, taskFilters.current),
+          prevTasks.filter(task => !data.deleted.includes(task.id))
+        ));
+        break;
+      case 'subtask.added':
+        setTasks(prevTasks => updateSubtasks(prevTasks, data, subtasks =>
+          subtasks.some(subtask => subtask.id === data.subtask.id)
+            ? subtasks
+            : [...subtasks, data.subtask]
+        ));
+        break;
+      case 'subtask.updated':
+        setTasks(prevTasks => updateSubtasks(prevTasks, data, subtasks =>
+          subtasks.map(subtask => subtask.id === data.subtask.id ? { ...subtask, ...data.subtask } : subtask)
+        ));
+        break;
+      case 'subtask.deleted':
+        setTasks(prevTasks => updateSubtasks(prevTasks, data, subtasks =>
+          subtasks.filter(subtask => subtask.id !== data.subtask.id)
+        ));
+        break;
+      case 'list.created':
+        setLists(prevLists => upsertById(prevLists, data, true));
+        break;
+      case 'list.updated':
+        setLists(prevLists => upsertById(prevLists, data, false));
+        break;
+      case 'list.deleted':
+        setLists(prevLists => prevLists.filter(list => list.id !== data.id));
+        setTasks(prevTasks => prevTasks.filter(task => task.list_id !== data.id));
+        break;
+      case 'tag.created':
+        setTags(prevTags => upsertById(prevTags, data, true));
+        break;
+      case 'tag.deleted':
+        setTags(prevTags => prevTags.filter(tag => tag.id !== data.id));
+        // The server removes the tag from tasks in the background
+        setTasks(prevTasks => prevTasks.map(task => (task.tags || []).includes(data.id)
+          ? { ...task, tags: task.tags.filter(tagId => tagId !== data.id) }
+          : task));
+        break;
+      case 'reminder.due':
+        setReminder(data);
+        break;
+      case 'resync':
+        loadData();
+        break;
+      default:
+        break;
+    }
+    if (event.stats) {
+      setStats(prevStats => applyStatsDelta(prevStats, event.stats));
+    }
+    if (event.lists) {
+      setLists(prevLists => prevLists.map(list => event.lists[list.id]
+        ? { ...list, task_count: (list.task_count || 0) + event.lists[list.id] }
+        : list
+      ));
+    }
+    if (event.tags) {
+      setTags(prevTags => prevTags.map(tag => event.tags[tag.id]
+        ? { ...tag, task_count: (tag.task_count || 0) + event.tags[tag.id] }
+        : tag
+      ));
+    }
+  };
+
+  const loadMoreTasks = async () => {
+    if (!nextCursor) return;
+    const request = tasksRequest.current;
+    try {
+      setLoadingMore(true);
+      const page = await api.getTasksPage({ ...taskFilters.current, cursor: nextCursor });
+      if (request !== tasksRequest.current) return;
+      setTasks(prevTasks => [...prevTasks, ...page.tasks]);
+      setNextCursor(page.nextCursor);
+    } catch (err) {
+      setError('خطا در بارگذاری تسک‌های بیشتر');
+      console.error('Error loading more tasks:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // Task operations
   const handleCreateTask = async (taskData) => {
     try {
       const response = await api.createTask(taskData);
-      setTasks([response.data, ...tasks]);
+      setTasks(prevTasks => mergeTask(prevTasks, response.data, true, taskFilters.current));
       setShowTaskForm(false);
-      await loadData(); // Refresh stats
     } catch (err) {
       setError('خطا در ایجاد تسک');
       console.error('Error creating task:', err);
@@ -67,9 +250,8 @@ function App() {
   const handleUpdateTask = async (taskId, taskData) => {
     try {
       const response = await api.updateTask(taskId, taskData);
-      setTasks(tasks.map(task => task.id === taskId ? response.data : task));
+      setTasks(prevTasks => mergeTask(prevTasks, response.data, false, taskFilters.current));
       setEditingTask(null);
-      await loadData(); // Refresh stats
     } catch (err) {
       setError('خطا در به‌روزرسانی تسک');
       console.error('Error updating task:', err);
@@ -79,8 +261,7 @@ function App() {
   const handleDeleteTask = async (taskId) => {
     try {
       await api.deleteTask(taskId);
-      setTasks(tasks.filter(task => task.id !== taskId));
-      await loadData(); // Refresh stats
+      setTasks(prevTasks => prevTasks.filter(task => task.id !== taskId));
     } catch (err) {
       setError('خطا در حذف تسک');
       console.error('Error deleting task:', err);
@@ -96,7 +277,7 @@ function App() {
   const handleCreateList = async (listData) => {
     try {
       const response = await api.createList(listData);
-      setLists([response.data, ...lists]);
+      setLists(prevLists => upsertById(prevLists, response.data, true));
     } catch (err) {
       setError('خطا در ایجاد لیست');
       console.error('Error creating list:', err);
@@ -106,11 +287,11 @@ function App() {
   const handleDeleteList = async (listId) => {
     try {
       await api.deleteList(listId);
-      setLists(lists.filter(list => list.id !== listId));
+      setLists(prevLists => prevLists.filter(list => list.id !== listId));
+      setTasks(prevTasks => prevTasks.filter(task => task.list_id !== listId));
       if (selectedList === listId) {
         setSelectedList(null);
       }
-      await loadData(); // Refresh tasks and stats
     } catch (err) {
       setError('خطا در حذف لیست');
       console.error('Error deleting list:', err);
@@ -121,7 +302,7 @@ function App() {
   const handleCreateTag = async (tagData) => {
     try {
       const response = await api.createTag(tagData);
-      setTags([response.data, ...tags]);
+      setTags(prevTags => upsertById(prevTags, response.data, true));
     } catch (err) {
       setError('خطا در ایجاد برچسب');
       console.error('Error creating tag:', err);
@@ -131,27 +312,16 @@ function App() {
   const handleDeleteTag = async (tagId) => {
     try {
       await api.deleteTag(tagId);
-      setTags(tags.filter(tag => tag.id !== tagId));
+      setTags(prevTags => prevTags.filter(tag => tag.id !== tagId));
     } catch (err) {
       setError('خطا در حذف برچسب');
       console.error('Error deleting tag:', err);
     }
   };
 
-  // Filter and search
-  const filteredTasks = tasks.filter(task => {
-    const matchesSearch = task.title.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         (task.description && task.description.toLowerCase().includes(searchTerm.toLowerCase()));
-    const matchesList = !selectedList || task.list_id === selectedList;
-    const matchesStatus = filterStatus === 'all' || task.status === filterStatus;
-    const matchesPriority = filterPriority === 'all' || task.priority === filterPriority;
-    
-    return matchesSearch && matchesList && matchesStatus && matchesPriority;
-  });
-
-  // Group tasks by status
-  const pendingTasks = filteredTasks.filter(task => task.status === 'در انتظار');
-  const completedTasks = filteredTasks.filter(task => task.status === 'تکمیل شده');
+  // Group the loaded (already filtered) tasks by status
+  const pendingTasks = tasks.filter(task => task.status === 'در انتظار');
+  const completedTasks = tasks.filter(task => task.status === 'تکمیل شده');
 
   if (loading) {
     return (
@@ -200,6 +370,18 @@ function App() {
             </div>
           )}
 
+          {reminder && (
+            <div className="toast-notification info mb-4">
+              یادآوری: {reminder.title}{reminder.due_time ? ` (${reminder.due_time})` : ''}
+              <button 
+                onClick={() => setReminder(null)}
+                className="mr-2 text-white hover:text-gray-200"
+              >
+                ×
+              </button>
+            </div>
+          )}
+
           {currentView === 'dashboard' && (
             <Dashboard 
               stats={stats}
@@ -345,6 +527,18 @@ function App() {
                   </div>
                 </div>
               </div>
+
+              {nextCursor && (
+                <div className="text-center mt-6">
+                  <button
+                    onClick={loadMoreTasks}
+                    disabled={loadingMore}
+                    className="btn-secondary"
+                  >
+                    {loadingMore ? 'در حال بارگذاری...' : 'بارگذاری تسک‌های بیشتر'}
+                  </button>
+                </div>
+              )}
             </div>
           )}
 
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import { 
   FaCheck, 
   FaEdit, 
@@ -8,12 +8,51 @@ import {
   FaTag,
   FaList,
   FaChevronDown,
-  FaChevronUp
+  FaChevronUp,
+  FaRedo
 } from 'react-icons/fa';
 import persianDateUtils from '../utils/persianDate';
+import api from '../services/api';
+
+const RECURRENCE_LABELS = {
+  daily: 'روزانه',
+  weekly: 'هفتگی',
+  monthly: 'ماهانه',
+  jalali_monthly: 'ماهانه (شمسی)',
+};
 
 const TaskCard = ({ task, onToggle, onEdit, onDelete, lists, tags }) => {
   const [showDetails, setShowDetails] = useState(false);
+  // Subtasks fetched on demand when the task does not embed them
+  const [loadedSubtasks, setLoadedSubtasks] = useState(null);
+
+  const subtasks = task.subtasks || loadedSubtasks || [];
+  const subtaskTotal = task.subtask_total ?? subtasks.length;
+  const subtaskDone = task.subtask_done ?? subtasks.filter(st => st.completed).length;
+
+  const loadSubtasks = async () => {
+    try {
+      const response = await api.getSubtasks(task.id);
+      setLoadedSubtasks(response.data);
+    } catch (err) {
+      console.error('Error loading subtasks:', err);
+    }
+  };
+
+  // Refresh a lazily loaded checklist when its counters change
+  useEffect(() => {
+    if (loadedSubtasks !== null) {
+      loadSubtasks();
+    }
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [task.subtask_total, task.subtask_done]);
+
+  const toggleDetails = () => {
+    if (!showDetails && !task.subtasks && loadedSubtasks === null) {
+      loadSubtasks();
+    }
+    setShowDetails(!showDetails);
+  };
   
   const getPriorityClass = (priority) => {
     switch (priority) {
@@ -49,12 +88,15 @@ const TaskCard = ({ task, onToggle, onEdit, onDelete, lists, tags }) => {
     return persianDateUtils.formatPersianTime(timeString);
   };
 
+  // Prefer summaries embedded by expand=list,tags, falling back to the loaded lists and tags
   const getList = (listId) => {
-    return lists.find(list => list.id === listId);
+    return (task.list && task.list.id === listId ? task.list : null)
+      || lists.find(list => list.id === listId);
   };
 
   const getTag = (tagId) => {
-    return tags.find(tag => tag.id === tagId);
+    return (task.tag_details || []).find(tag => tag.id === tagId)
+      || tags.find(tag => tag.id === tagId);
   };
 
   const isCompleted = task.status === 'تکمیل شده';
@@ -125,6 +167,14 @@ const TaskCard = ({ task, onToggle, onEdit, onDelete, lists, tags }) => {
                 </div>
               )}
 
+              {/* Recurrence */}
+              {task.recurrence && (
+                <div className="flex items-center space-x-1 space-x-reverse text-xs text-purple-600">
+                  <FaRedo className="w-3 h-3" />
+                  <span>{RECURRENCE_LABELS[task.recurrence.frequency]}</span>
+                </div>
+              )}
+
               {/* List */}
               {task.list_id && getList(task.list_id) && (
                 <div className="flex items-center space-x-1 space-x-reverse text-xs text-gray-600">
@@ -154,14 +204,14 @@ const TaskCard = ({ task, onToggle, onEdit, onDelete, lists, tags }) => {
             )}
 
             {/* Subtasks */}
-            {task.subtasks && task.subtasks.length > 0 && (
+            {subtaskTotal > 0 && (
               <div className="mt-3">
                 <div className="flex items-center justify-between">
                   <span className="text-sm text-gray-600">
-                    زیر تسک‌ها ({task.subtasks.filter(st => st.completed).length}/{task.subtasks.length})
+                    زیر تسک‌ها ({subtaskDone}/{subtaskTotal})
                   </span>
                   <button
-                    onClick={() => setShowDetails(!showDetails)}
+                    onClick={toggleDetails}
                     className="text-sm text-blue-600 hover:text-blue-800"
                   >
                     {showDetails ? <FaChevronUp /> : <FaChevronDown />}
@@ -170,7 +220,7 @@ const TaskCard = ({ task, onToggle, onEdit, onDelete, lists, tags }) => {
                 
                 {showDetails && (
                   <div className="mt-2 space-y-1">
-                    {task.subtasks.map((subtask, index) => (
+                    {subtasks.map((subtask, index) => (
                       <div key={index} className="flex items-center space-x-2 space-x-reverse text-sm">
                         <div className={`w-3 h-3 rounded border ${
                           subtask.completed 
@@ -214,13 +264,13 @@ const TaskCard = ({ task, onToggle, onEdit, onDelete, lists, tags }) => {
       </div>
 
       {/* Progress Bar for subtasks */}
-      {task.subtasks && task.subtasks.length > 0 && (
+      {subtaskTotal > 0 && (
         <div className="mt-3">
           <div className="bg-gray-200 rounded-full h-2">
             <div 
               className="bg-green-500 h-2 rounded-full transition-all duration-300"
               style={{ 
-                width: `${(task.subtasks.filter(st => st.completed).length / task.subtasks.length) * 100}%` 
+                width: `${(subtaskDone / subtaskTotal) * 100}%` 
               }}
             />
           </div>
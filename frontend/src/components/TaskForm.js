@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { FaTimes, FaCalendarAlt, FaClock, FaTag, FaList, FaPlus, FaTrash } from 'react-icons/fa';
+import { FaTimes, FaCalendarAlt, FaClock, FaTag, FaList, FaPlus, FaTrash, FaRedo } from 'react-icons/fa';
 import PersianDatePicker from './PersianDatePicker';
 import persianDateUtils from '../utils/persianDate';
 
@@ -11,7 +11,8 @@ const TaskForm = ({ task, lists, tags, onSubmit, onClose }) => {
     due_date: '',
     due_time: '',
     list_id: '',
-    tags: []
+    tags: [],
+    recurrence: ''
   });
 
   const [subtasks, setSubtasks] = useState([]);
@@ -27,12 +28,25 @@ const TaskForm = ({ task, lists, tags, onSubmit, onClose }) => {
         due_date: task.due_date || '',
         due_time: task.due_time || '',
         list_id: task.list_id || '',
-        tags: task.tags || []
+        tags: task.tags || [],
+        recurrence: task.recurrence?.frequency || ''
       });
       setSubtasks(task.subtasks || []);
     }
   }, [task]);
 
+  // Keeps the stored rule (weekdays, end date...) while its frequency is unchanged;
+  // null stops an existing task recurring
+  const buildRecurrence = () => {
+    if (!formData.recurrence) {
+      return task?.recurrence ? null : undefined;
+    }
+    if (task?.recurrence?.frequency === formData.recurrence) {
+      return task.recurrence;
+    }
+    return { frequency: formData.recurrence };
+  };
+
   const handleSubmit = (e) => {
     e.preventDefault();
     
@@ -52,6 +66,7 @@ const TaskForm = ({ task, lists, tags, onSubmit, onClose }) => {
       due_date: formData.due_date || null,
       due_time: formData.due_time || null,
       list_id: formData.list_id || null,
+      recurrence: buildRecurrence(),
     };
 
     onSubmit(submitData);
@@ -109,6 +124,14 @@ const TaskForm = ({ task, lists, tags, onSubmit, onClose }) => {
     { value: 'بالا', label: 'بالا', color: 'text-red-600' }
   ];
 
+  const recurrenceOptions = [
+    { value: '', label: 'بدون تکرار' },
+    { value: 'daily', label: 'روزانه' },
+    { value: 'weekly', label: 'هفتگی' },
+    { value: 'monthly', label: 'ماهانه (میلادی)' },
+    { value: 'jalali_monthly', label: 'ماهانه (شمسی)' }
+  ];
+
   return (
     <div className="modal-overlay">
       <div className="modal-content max-w-2xl">
@@ -233,6 +256,26 @@ const TaskForm = ({ task, lists, tags, onSubmit, onClose }) => {
               </div>
             </div>
 
+            {/* Recurrence */}
+            <div className="form-group">
+              <label className="form-label">
+                <FaRedo className="inline w-4 h-4 ml-1" />
+                تکرار
+              </label>
+              <select
+                name="recurrence"
+                value={formData.recurrence}
+                onChange={handleInputChange}
+                className="form-select"
+              >
+                {recurrenceOptions.map(option => (
+                  <option key={option.value} value={option.value}>
+                    {option.label}
+                  </option>
+                ))}
+              </select>
+            </div>
+
             {/* Tags */}
             {tags.length > 0 && (
               <div className="form-group">
@@ -34,14 +34,39 @@ api.interceptors.response.use(
 );
 
 // Tasks API
+export const TASKS_PAGE_SIZE = 100;
+
 export const tasksApi = {
   getTasks: (params = {}) => api.get('/api/tasks', { params }),
+  // Fetch one page of tasks; pass the returned nextCursor to get the following page.
+  // `fields` limits the returned fields, e.g. ['title', 'status'] for list views.
+  // tags: tag ids matched with tagMatch ('any' | 'all');
+  // expand: ['tags', 'list'] embeds tag_details and list summaries
+  getTasksPage: async ({ cursor, limit = TASKS_PAGE_SIZE, fields, tags, tagMatch, expand, ...filters } = {}) => {
+    const params = { ...filters, limit };
+    if (cursor) params.cursor = cursor;
+    if (fields) params.fields = fields.join(',');
+    if (tags && tags.length) params.tags = tags.join(',');
+    if (tagMatch) params.tag_match = tagMatch;
+    if (expand) params.expand = expand.join(',');
+    const response = await api.get('/api/tasks', { params });
+    return {
+      tasks: response.data,
+      nextCursor: response.headers['x-next-cursor'] || null,
+    };
+  },
   getTask: (id) => api.get(`/api/tasks/${id}`),
   createTask: (task) => api.post('/api/tasks', task),
   updateTask: (id, task) => api.put(`/api/tasks/${id}`, task),
   deleteTask: (id) => api.delete(`/api/tasks/${id}`),
+  restoreTask: (id) => api.post(`/api/tasks/${id}/restore`),
+  // Apply many operations in one request, e.g.
+  // [{ action: 'update', task_id, update: { status: 'تکمیل شده' } }, { action: 'delete', task_id }]
+  batchTasks: (operations, ordered = true) =>
+    api.post('/api/tasks/batch', { operations, ordered }),
   
   // Subtasks
+  getSubtasks: (taskId) => api.get(`/api/tasks/${taskId}/subtasks`),
   addSubtask: (taskId, subtask) => api.post(`/api/tasks/${taskId}/subtasks`, subtask),
   updateSubtask: (taskId, subtaskId, completed) => 
     api.put(`/api/tasks/${taskId}/subtasks/${subtaskId}`, { completed }),
@@ -67,18 +92,50 @@ export const tagsApi = {
 // Stats API
 export const statsApi = {
   getStats: () => api.get('/api/stats'),
+  getDueBuckets: (listId) => api.get('/api/calendar/due-buckets', {
+    params: listId ? { list_id: listId } : {},
+  }),
+  // Pending tasks due in [start, end] (ISO dates), including upcoming occurrences of recurring tasks
+  getOccurrences: (start, end, listId) => api.get('/api/calendar/occurrences', {
+    params: listId ? { start, end, list_id: listId } : { start, end },
+  }),
+};
+
+// Change feed: calls onEvent for every server-pushed change. onReconnect runs
+// when the stream comes back after an interruption, since events may have been
+// missed meanwhile. Returns a function that closes the stream.
+export const subscribeToChanges = (onEvent, onReconnect) => {
+  const source = new EventSource(`${API_BASE_URL}/api/events`);
+  let connectedBefore = false;
+  source.onopen = () => {
+    if (connectedBefore && onReconnect) onReconnect();
+    connectedBefore = true;
+  };
+  [
+    'task.created', 'task.updated', 'task.deleted', 'tasks.batch',
+    'subtask.added', 'subtask.updated', 'subtask.deleted',
+    'list.created', 'list.updated', 'list.deleted',
+    'tag.created', 'tag.deleted', 'reminder.due', 'resync',
+  ].forEach((type) => {
+    source.addEventListener(type, (message) => onEvent(JSON.parse(message.data)));
+  });
+  return () => source.close();
 };
 
 // Combined API object
 const apiService = {
   // Tasks
   getTasks: tasksApi.getTasks,
+  getTasksPage: tasksApi.getTasksPage,
   getTask: tasksApi.getTask,
   createTask: tasksApi.createTask,
   updateTask: tasksApi.updateTask,
   deleteTask: tasksApi.deleteTask,
+  restoreTask: tasksApi.restoreTask,
+  batchTasks: tasksApi.batchTasks,
   
   // Subtasks
+  getSubtasks: tasksApi.getSubtasks,
   addSubtask: tasksApi.addSubtask,
   updateSubtask: tasksApi.updateSubtask,
   deleteSubtask: tasksApi.deleteSubtask,
@@ -96,6 +153,11 @@ const apiService = {
   
   // Stats
   getStats: statsApi.getStats,
+  getDueBuckets: statsApi.getDueBuckets,
+  getOccurrences: statsApi.getOccurrences,
+
+  // Change feed
+  subscribeToChanges,
 };
 
 export default apiService;
\ No newline at end of file